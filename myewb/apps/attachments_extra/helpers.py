@@ -0,0 +1,21 @@
+"""myEWB attachment download tokens
+
+Attachment links in post emails carry a token that lets whoever has the
+email download the file without logging in: recipients include bulk
+(email-only) members, who can't log in to see a private group's post.
+
+This file is part of myEWB
+Copyright 2009 Engineers Without Borders (Canada) Organisation and/or volunteer contributors
+"""
+
+from django.conf import settings
+from django.utils.hashcompat import sha_constructor
+
+def download_token(attachment_id):
+    """
+    The token for downloading an attachment without the visibility check.
+    """
+    return sha_constructor("%s-attachment-download-%s" % (settings.SECRET_KEY, attachment_id)).hexdigest()[::2]
+
+def check_download_token(attachment_id, token):
+    return token == download_token(attachment_id)
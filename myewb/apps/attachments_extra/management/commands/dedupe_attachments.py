@@ -0,0 +1,70 @@
+import os
+
+from django.core.files.base import File
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from attachments.models import Attachment
+
+from attachments_extra.models import AttachmentBlob, adjust_blob_refcount
+from attachments_extra.storage import attachment_storage, content_hash_for_name, BLOB_DIR
+
+
+class Command(NoArgsCommand):
+    help = "Moves attachments saved before attachments were content-addressed into the shared store, " \
+           "keeping one copy of each distinct file, and recounts the uses of every stored file."
+
+    def handle_noargs(self, **options):
+        moved = 0
+        for attachment in Attachment.objects.all().iterator():
+            name = attachment.attachment_file.name
+            if content_hash_for_name(name):
+                continue
+            if self.move(attachment, name):
+                moved += 1
+        
+        recounted = self.recount()
+        return 'Moved %d attachments into the store; %d distinct files are stored.' % (moved, recounted)
+
+    @transaction.commit_on_success
+    def move(self, attachment, name):
+        path = attachment_storage.path(name)
+        if not os.path.exists(path):
+            return False
+        
+        file = open(path, 'rb')
+        try:
+            new_name = attachment_storage.save(name, File(file))
+        finally:
+            file.close()
+        # update() rather than save(), so that nothing else is touched
+        Attachment.objects.filter(id=attachment.id).update(attachment_file=new_name)
+        
+        if not Attachment.objects.filter(attachment_file=name).count():
+            os.remove(path)
+            try:
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                # not empty
+                pass
+        return True
+
+    @transaction.commit_on_success
+    def recount(self):
+        uses = {}
+        for name in Attachment.objects.values_list('attachment_file', flat=True):
+            content_hash = content_hash_for_name(name)
+            if content_hash:
+                uses[content_hash] = uses.get(content_hash, 0) + 1
+        
+        AttachmentBlob.objects.all().delete()
+        for content_hash, count in uses.items():
+            adjust_blob_refcount(content_hash, count)
+        
+        # and files nothing uses any more
+        blob_dir = attachment_storage.path(BLOB_DIR)
+        if os.path.isdir(blob_dir):
+            for content_hash in os.listdir(blob_dir):
+                if content_hash not in uses and len(content_hash) == 40:
+                    attachment_storage.remove_blob(content_hash)
+        return len(uses)
@@ -0,0 +1,79 @@
+"""myEWB attachment storage models
+
+Puts attachments (the attachments app's Attachment.attachment_file) in the
+content-addressed store, and counts how many attachments use each stored
+blob so that it can be removed with the last of them.
+
+This file is part of myEWB
+Copyright 2009 Engineers Without Borders (Canada) Organisation and/or volunteer contributors
+"""
+
+import os
+
+from django.db import models, connection, transaction, IntegrityError
+from django.db.models.signals import post_save, post_delete
+from django.utils.translation import ugettext_lazy as _
+
+from attachments.models import Attachment
+
+from attachments_extra.storage import attachment_storage, content_hash_for_name
+
+# new attachments are saved to the content-addressed store; attachments
+# from before keep working from their old paths (dedupe_attachments moves
+# them over)
+Attachment._meta.get_field('attachment_file').storage = attachment_storage
+
+class AttachmentBlob(models.Model):
+    """
+    One distinct attachment content, and how many attachments have it.
+    """
+    content_hash = models.CharField(_('content hash'), max_length=40, primary_key=True)
+    size = models.PositiveIntegerField(_('size'), default=0)
+    refcount = models.PositiveIntegerField(_('reference count'), default=0)
+
+    def __unicode__(self):
+        return "%s (%d bytes, %d uses)" % (self.content_hash, self.size, self.refcount)
+
+def adjust_blob_refcount(content_hash, amount):
+    """
+    Atomically adds amount (which may be negative) to the number of
+    attachments using a blob, and removes the blob once none do.
+    """
+    qn = connection.ops.quote_name
+    table = qn(AttachmentBlob._meta.db_table)
+    cursor = connection.cursor()
+    cursor.execute("UPDATE %s SET %s = %s + %%s WHERE %s = %%s" % (
+                       table, qn('refcount'), qn('refcount'), qn('content_hash')),
+                   [amount, content_hash])
+    if not cursor.rowcount and amount > 0:
+        size = 0
+        try:
+            size = os.path.getsize(attachment_storage.blob_path(content_hash))
+        except OSError:
+            pass
+        sid = transaction.savepoint()
+        try:
+            AttachmentBlob.objects.create(content_hash=content_hash, size=size, refcount=amount)
+            transaction.savepoint_commit(sid)
+        except IntegrityError:
+            # counted by someone else in the meantime
+            transaction.savepoint_rollback(sid)
+            return adjust_blob_refcount(content_hash, amount)
+    
+    unused = AttachmentBlob.objects.filter(content_hash=content_hash, refcount__lte=0)
+    if unused.count():
+        unused.delete()
+        attachment_storage.remove_blob(content_hash)
+    transaction.commit_unless_managed()
+
+def count_new_attachment(sender, instance, created, **kwargs):
+    content_hash = content_hash_for_name(instance.attachment_file.name)
+    if created and content_hash:
+        adjust_blob_refcount(content_hash, 1)
+post_save.connect(count_new_attachment, sender=Attachment, dispatch_uid='attachmentblobcount')
+
+def count_removed_attachment(sender, instance, **kwargs):
+    content_hash = content_hash_for_name(instance.attachment_file.name)
+    if content_hash:
+        adjust_blob_refcount(content_hash, -1)
+post_delete.connect(count_removed_attachment, sender=Attachment, dispatch_uid='attachmentblobdeletecount')
@@ -0,0 +1,140 @@
+"""myEWB content-addressed attachment storage
+
+Attachments are stored once per distinct content, under the SHA-1 of
+their bytes:
+
+    attachments/blobs/<hash>            the one copy of the bytes
+    attachments/<hash>/<filename>       a hard link to it, for each name
+                                        the content was uploaded under
+
+so the same slide deck uploaded to twenty chapters takes the disk space of
+one, while every attachment keeps its own file name (and a path that the
+web server and the filesize tags can still read directly).  How many
+attachments use each blob is counted in AttachmentBlob; the blob goes when
+the last of them is deleted.
+
+This file is part of myEWB
+Copyright 2009 Engineers Without Borders (Canada) Organisation and/or volunteer contributors
+"""
+
+import errno
+import os
+import re
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.utils.hashcompat import sha_constructor
+
+STORE_DIR = 'attachments'
+BLOB_DIR = os.path.join(STORE_DIR, 'blobs')
+
+# bytes read or written at a time when hashing or copying
+CHUNK_SIZE = 64 * 1024
+
+# names of content-addressed attachments: attachments/<hash>/<filename>
+ATTACHMENT_NAME_RE = re.compile(r'^%s/([0-9a-f]{40})/[^/]+$' % STORE_DIR)
+
+def content_hash_for_name(name):
+    """
+    The content hash in a stored attachment's name, or None for files saved
+    before attachments were content-addressed.
+    """
+    match = ATTACHMENT_NAME_RE.match(name or '')
+    return match and match.group(1) or None
+
+def _upload_attr(content, attr):
+    # the uploaded file can come wrapped in a File or FieldFile
+    for obj in (content, getattr(content, 'file', None), getattr(content, '_file', None)):
+        if obj is not None and hasattr(obj, attr):
+            return getattr(obj, attr)
+    return None
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Saves files under the hash of their content (see the module docstring).
+    Uploads hashed on arrival by HashingFileUploadHandler are moved into
+    place without being read again; anything else is hashed while it is
+    copied, a chunk at a time.
+    """
+
+    def get_available_name(self, name):
+        # a name already taken holds the same bytes, and is shared
+        return name
+
+    def blob_path(self, content_hash):
+        return self.path(os.path.join(BLOB_DIR, content_hash))
+
+    def _save(self, name, content):
+        blob_dir = self.path(BLOB_DIR)
+        if not os.path.exists(blob_dir):
+            os.makedirs(blob_dir)
+        
+        content_hash = _upload_attr(content, 'content_hash')
+        temporary_path = _upload_attr(content, 'temporary_file_path')
+        if content_hash is None or temporary_path is None:
+            # hash while streaming to a file next to the blobs, so that
+            # moving it into place is a rename
+            fd, temporary_path = tempfile.mkstemp(dir=blob_dir)
+            hash = sha_constructor()
+            out = os.fdopen(fd, 'wb')
+            try:
+                for chunk in content.chunks(CHUNK_SIZE):
+                    hash.update(chunk)
+                    out.write(chunk)
+            finally:
+                out.close()
+            content_hash = hash.hexdigest()
+        else:
+            temporary_path = temporary_path()
+        
+        blob = self.blob_path(content_hash)
+        if not os.path.exists(blob):
+            try:
+                file_move_safe(temporary_path, blob)
+                os.chmod(blob, 0644)
+            except IOError:
+                # the same content was just stored by another upload
+                if not os.path.exists(blob):
+                    raise
+        if os.path.exists(temporary_path) and os.path.dirname(temporary_path) == blob_dir:
+            os.remove(temporary_path)
+        
+        name = os.path.join(STORE_DIR, content_hash, os.path.basename(name))
+        path = self.path(name)
+        if not os.path.exists(path):
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            try:
+                os.link(blob, path)
+            except (AttributeError, OSError):
+                # no hard links here (or across these directories)
+                shutil.copyfile(blob, path)
+        return name
+
+    def delete(self, name):
+        """
+        Removes one name of an attachment's content.  The blob itself is
+        removed by remove_blob once nothing uses it.
+        """
+        super(ContentAddressedStorage, self).delete(name)
+        if content_hash_for_name(name):
+            try:
+                os.rmdir(os.path.dirname(self.path(name)))
+            except OSError, e:
+                if e.errno not in (errno.ENOTEMPTY, errno.EEXIST, errno.ENOENT):
+                    raise
+
+    def remove_blob(self, content_hash):
+        """
+        Removes a blob, and whatever names of it are left.
+        """
+        for path in (self.path(os.path.join(STORE_DIR, content_hash)), self.blob_path(content_hash)):
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.exists(path):
+                os.remove(path)
+
+attachment_storage = ContentAddressedStorage(location=settings.MEDIA_ROOT, base_url=settings.MEDIA_URL)
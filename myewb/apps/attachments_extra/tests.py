@@ -0,0 +1,106 @@
+import os
+import shutil
+import tempfile
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.base import ContentFile
+from django.test import TestCase
+
+from attachments.models import Attachment
+from base_groups.models import BaseGroup
+from group_topics.models import GroupTopic
+
+from attachments_extra.helpers import download_token
+from attachments_extra.models import AttachmentBlob
+from attachments_extra.storage import attachment_storage
+from attachments_extra.views import parse_range
+
+class TestAttachmentStore(TestCase):
+    """
+    Identical attachments are stored once, counted, and removed with the
+    last of them; downloads honour Range requests and visibility
+    """
+
+    def setUp(self):
+        self.location = attachment_storage.location
+        attachment_storage.location = tempfile.mkdtemp()
+        self.creator = User.objects.create_user('creator', 'creator@ewb.ca', 'password')
+        self.group = BaseGroup.objects.create(slug='attachgrp', name='attach group', creator=self.creator, visibility='E')
+        self.topic = GroupTopic.objects.create(title="post", body="text", group=self.group, creator=self.creator)
+
+    def tearDown(self):
+        Attachment.objects.all().delete()
+        GroupTopic.objects.all().delete()
+        BaseGroup.objects.all().delete()
+        User.objects.all().delete()
+        shutil.rmtree(attachment_storage.location)
+        attachment_storage.location = self.location
+
+    def attach(self, filename, content):
+        attachment = Attachment(creator=self.creator, object_id=self.topic.id,
+                                content_type=ContentType.objects.get_for_model(GroupTopic))
+        attachment.attachment_file.save(filename, ContentFile(content))
+        return attachment
+
+    def test_dedupe(self):
+        first = self.attach('deck.ppt', 'slides' * 1000)
+        second = self.attach('deck.ppt', 'slides' * 1000)
+        renamed = self.attach('copy of deck.ppt', 'slides' * 1000)
+        self.assertEquals(first.attachment_file.name, second.attachment_file.name)
+        self.assertEquals(renamed.filename(), 'copy of deck.ppt')
+        self.assertEquals(open(renamed.attachment_file.path, 'rb').read(), 'slides' * 1000)
+        
+        blob = AttachmentBlob.objects.get()
+        self.assertEquals((blob.refcount, blob.size), (3, 6000))
+        blob_path = attachment_storage.blob_path(blob.content_hash)
+        
+        first.delete()
+        second.delete()
+        self.assertTrue(os.path.exists(blob_path))
+        renamed.delete()
+        self.assertFalse(os.path.exists(blob_path))
+        self.assertEquals(AttachmentBlob.objects.count(), 0)
+
+    def test_parse_range(self):
+        self.assertEquals(parse_range(None, 100), None)
+        self.assertEquals(parse_range('bytes=0-9', 100), (0, 9))
+        self.assertEquals(parse_range('bytes=90-', 100), (90, 99))
+        self.assertEquals(parse_range('bytes=-10', 100), (90, 99))
+        self.assertEquals(parse_range('bytes=50-500', 100), (50, 99))
+        self.assertEquals(parse_range('bytes=100-', 100), False)
+        self.assertEquals(parse_range('bytes=0-1,5-6', 100), None)
+
+    def test_download(self):
+        attachment = self.attach('notes.txt', '0123456789')
+        url = '/attachments/%d/' % attachment.id
+        
+        response = self.client.get(url)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.content, '0123456789')
+        self.assertEquals(response['Accept-Ranges'], 'bytes')
+        
+        response = self.client.get(url, HTTP_RANGE='bytes=2-5')
+        self.assertEquals(response.status_code, 206)
+        self.assertEquals(response.content, '2345')
+        self.assertEquals(response['Content-Range'], 'bytes 2-5/10')
+        
+        self.assertEquals(self.client.get(url, HTTP_RANGE='bytes=20-').status_code, 416)
+        
+        self.group.visibility = 'M'
+        self.group.save()
+        self.assertEquals(self.client.get(url).status_code, 403)
+
+    def test_emailed_link(self):
+        attachment = self.attach('notes.txt', '0123456789')
+        self.group.visibility = 'M'
+        self.group.save()
+        
+        # recipients of the post's email needn't be able to log in
+        url = '/attachments/%d/%s/' % (attachment.id, download_token(attachment.id))
+        response = self.client.get(url)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.content, '0123456789')
+        
+        other = self.attach('other.txt', 'abc')
+        self.assertEquals(self.client.get('/attachments/%d/%s/' % (other.id, download_token(attachment.id))).status_code, 404)
@@ -0,0 +1,41 @@
+"""myEWB hashing upload handler
+
+Streams uploaded attachments to a temporary file on disk (never holding
+them in memory, whatever their size) and works out their SHA-1 on the way,
+so that ContentAddressedStorage can file them away without reading them
+again.  Only views that take attachments use it (see hashing_uploads);
+other uploads are handled by FILE_UPLOAD_HANDLERS as usual.
+
+This file is part of myEWB
+Copyright 2009 Engineers Without Borders (Canada) Organisation and/or volunteer contributors
+"""
+
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.utils.functional import wraps
+from django.utils.hashcompat import sha_constructor
+
+class HashingFileUploadHandler(TemporaryFileUploadHandler):
+
+    def new_file(self, *args, **kwargs):
+        super(HashingFileUploadHandler, self).new_file(*args, **kwargs)
+        self.hash = sha_constructor()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.hash.update(raw_data)
+        return super(HashingFileUploadHandler, self).receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super(HashingFileUploadHandler, self).file_complete(file_size)
+        file.content_hash = self.hash.hexdigest()
+        return file
+
+def hashing_uploads(view):
+    """
+    Decorator for views that save uploads as attachments: their uploads go
+    through HashingFileUploadHandler.  Must be applied before anything
+    reads request.POST or request.FILES.
+    """
+    def wrapper(request, *args, **kwargs):
+        request.upload_handlers = [HashingFileUploadHandler(request)]
+        return view(request, *args, **kwargs)
+    return wraps(view)(wrapper)
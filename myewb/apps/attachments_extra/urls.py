@@ -0,0 +1,7 @@
+from django.conf.urls.defaults import *
+
+urlpatterns = patterns('',
+    url(r'^(?P<attachment_id>\d+)/$', 'attachments_extra.views.download', name='attachment_download'),
+    url(r'^(?P<attachment_id>\d+)/(?P<token>[0-9a-f]+)/$', 'attachments_extra.views.download',
+        name='attachment_token_download'),
+)
@@ -0,0 +1,119 @@
+"""myEWB attachment downloads
+
+Serves attachments through Django, so that only people who can see the
+post (or reply) an attachment belongs to, or who were emailed a link to it
+(see helpers.download_token), can fetch it, with support for
+resuming downloads and seeking (HTTP Range requests) and for conditional
+GETs.
+
+This file is part of myEWB
+Copyright 2009 Engineers Without Borders (Canada) Organisation and/or volunteer contributors
+"""
+
+import mimetypes
+import os
+import re
+
+from django.http import HttpResponse, HttpResponseForbidden, HttpResponseNotModified, Http404
+from django.shortcuts import get_object_or_404
+from django.utils.encoding import force_unicode
+
+from attachments.models import Attachment
+from threadedcomments.models import ThreadedComment
+
+from attachments_extra.helpers import check_download_token
+from attachments_extra.storage import content_hash_for_name, CHUNK_SIZE
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+def parse_range(header, size):
+    """
+    Returns the (first, last) byte positions asked for by a Range header
+    for a file of the given size; None if the whole file should be sent
+    (no header, or one we don't handle, such as several ranges); or False
+    if the range can't be satisfied.
+    """
+    match = RANGE_RE.match((header or '').strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '':
+        # the last n bytes
+        length = int(last)
+        if not length:
+            return False
+        return max(0, size - length), size - 1
+    first = int(first)
+    last = last and min(int(last), size - 1) or size - 1
+    if first >= size or first > last:
+        return False
+    return first, last
+
+def _file_range(path, first, length):
+    file = open(path, 'rb')
+    try:
+        file.seek(first)
+        while length > 0:
+            data = file.read(min(CHUNK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        file.close()
+
+def _owner(attachment):
+    """
+    The post (or whatever else) an attachment ultimately belongs to: a
+    reply's attachment belongs to what was replied to.
+    """
+    owner = attachment.content_object
+    if isinstance(owner, ThreadedComment):
+        owner = owner.content_object
+    return owner
+
+def download(request, attachment_id, token=None):
+    attachment = get_object_or_404(Attachment, id=attachment_id)
+    if token is not None:
+        if not check_download_token(attachment.id, token):
+            raise Http404
+    else:
+        owner = _owner(attachment)
+        if owner is not None and hasattr(owner, 'is_visible') and not owner.is_visible(request.user):
+            return HttpResponseForbidden()
+    
+    try:
+        path = attachment.attachment_file.path
+        size = os.path.getsize(path)
+    except (OSError, ValueError):
+        raise Http404
+    
+    # content-addressed files never change; older ones are told apart by
+    # size and modification time
+    content_hash = content_hash_for_name(attachment.attachment_file.name)
+    etag = '"%s"' % (content_hash or '%x-%x' % (size, int(os.path.getmtime(path))))
+    if request.META.get('HTTP_IF_NONE_MATCH', None) == etag:
+        return HttpResponseNotModified()
+    
+    byte_range = None
+    if request.META.get('HTTP_IF_RANGE', etag) == etag:
+        byte_range = parse_range(request.META.get('HTTP_RANGE', None), size)
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */%d' % size
+        return response
+    
+    mimetype = mimetypes.guess_type(attachment.filename())[0] or 'application/octet-stream'
+    if byte_range is None:
+        first, last = 0, size - 1
+        response = HttpResponse(_file_range(path, 0, size), mimetype=mimetype)
+    else:
+        first, last = byte_range
+        response = HttpResponse(_file_range(path, first, last - first + 1), mimetype=mimetype, status=206)
+        response['Content-Range'] = 'bytes %d-%d/%d' % (first, last, size)
+    response['Content-Length'] = str(max(0, last - first + 1))
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    filename = force_unicode(attachment.filename()).encode('ascii', 'ignore').replace('"', '')
+    response['Content-Disposition'] = 'inline; filename="%s"' % filename
+    return response
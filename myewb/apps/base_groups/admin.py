@@ -7,7 +7,7 @@ Last modified on 2009-07-29
 @author Joshua Gorner
 """
 from django.contrib import admin
-from base_groups.models import BaseGroup, GroupMember, InvitationToJoinGroup
+from base_groups.models import BaseGroup, GroupMember, InvitationToJoinGroup, GroupMailing, GroupMailBatch
 
 class BaseGroupAdmin(admin.ModelAdmin):
     list_display = ('name', 'slug', 'creator', 'created')
@@ -18,6 +18,15 @@ class GroupMemberAdmin(admin.ModelAdmin):
 class InvitationToJoinGroupAdmin(admin.ModelAdmin):
     list_display = ('group', 'user', 'request_date', 'message')
 
+class GroupMailingAdmin(admin.ModelAdmin):
+    list_display = ('group', 'subject', 'created', 'status')
+
+class GroupMailBatchAdmin(admin.ModelAdmin):
+    list_display = ('mailing', 'status', 'attempts', 'sent', 'last_error')
+    list_filter = ('status',)
+
 admin.site.register(BaseGroup, BaseGroupAdmin)
 admin.site.register(GroupMember, GroupMemberAdmin)
-admin.site.register(InvitationToJoinGroup, InvitationToJoinGroupAdmin)
\ No newline at end of file
+admin.site.register(InvitationToJoinGroup, InvitationToJoinGroupAdmin)
+admin.site.register(GroupMailing, GroupMailingAdmin)
+admin.site.register(GroupMailBatch, GroupMailBatchAdmin)
@@ -2,20 +2,25 @@ from django.conf.urls.defaults import *
 from django.contrib.contenttypes.models import ContentType
 from django.utils.datastructures import SortedDict
 
-from base_groups.models import BaseGroup, GroupMember
+from django.db.models import Q
 
+from base_groups.models import BaseGroup, GroupMember, visible_groups_q
+from search_index.models import filter_by_search
+
+# both are primary key lookups into the GroupCounts table
 TOPIC_COUNT_SQL = """
-SELECT COUNT(*)
-FROM topics_topic
-WHERE
-    topics_topic.object_id = base_groups_basegroup.id AND
-    topics_topic.content_type_id = %s
+SELECT COALESCE((
+    SELECT topic_count
+    FROM base_groups_groupcounts
+    WHERE base_groups_groupcounts.group_id = base_groups_basegroup.id
+), 0)
 """
 MEMBER_COUNT_SQL = """
-SELECT COUNT(*)
-FROM base_groups_groupmember
-WHERE 
-    base_groups_groupmember.group_id = base_groups_basegroup.id
+SELECT COALESCE((
+    SELECT member_count
+    FROM base_groups_groupcounts
+    WHERE base_groups_groupcounts.group_id = base_groups_basegroup.id
+), 0)
 """
 
 def group_url_patterns(model, *args):
@@ -79,32 +84,70 @@ def group_url_patterns(model, *args):
     return urlpatterns
     
 def group_search_filter(groups, search_terms):
+    """
+    Groups with a word in their name, slug or description starting with
+    each of the search words.
+    """
     if search_terms:
-        return (groups.filter(name__icontains=search_terms) |
-            groups.filter(description__icontains=search_terms))
+        return filter_by_search(groups, search_terms, model=BaseGroup)
     else:
         return groups
         
 def get_counts(groups, model):
-    name = model._meta.verbose_name
-    plural = model._meta.verbose_name_plural
-    content_type = ContentType.objects.get_for_model(model)
-
     groups = groups.extra(select=SortedDict([
         ('member_count', MEMBER_COUNT_SQL),
         ('topic_count', TOPIC_COUNT_SQL),
-    ]), select_params=(content_type.id,))
+    ]))
     
     return groups
     
 def enforce_visibility(groups, user):
+    """
+    Narrows groups down to the public ones and those user can see: their own
+    groups, 'P' groups under their groups, and anything below a group they
+    are an admin of (at any level).
+    """
     if user.is_anonymous():
         return groups.filter(visibility='E')
+    return groups.filter(Q(visibility='E') | visible_groups_q(user))
     
-    visible_groups = groups.filter(visibility='E') | groups.filter(member_users=user) \
-        | groups.filter(visibility='P', parent__member_users=user)
-    return visible_groups.distinct()
+class GroupListingBatch(object):
+    """
+    Membership details for a page of groups, shared by every group on the
+    page so that per-row template tags don't each go to the database.
     
+    The admins of every group are fetched together, on first use, in one
+    query; the viewer's memberships and pending requests come from their
+    (per-request) UserMemberships, which is two queries in total.
+    """
+    def __init__(self, groups, user):
+        self.group_ids = [group.id for group in groups]
+        self.user = user
+        self._admins = None
+
+    def get_admins(self, group):
+        if self._admins is None:
+            self._admins = dict([(id, []) for id in self.group_ids])
+            admins = GroupMember.objects.filter(group__in=self.group_ids, is_admin=True)
+            for admin in admins.select_related('user'):
+                self._admins[admin.group_id].append(admin)
+        return self._admins.get(group.id, [])
+
+    def get_membership(self, group):
+        return group.get_membership(self.user)
+
+def preload_group_memberships(groups, user):
+    """
+    Evaluates a page of groups and attaches a shared GroupListingBatch to
+    each; returns them as a list.  The get_admins and get_membership tags
+    use the batch when it is there.
+    """
+    groups = list(groups)
+    batch = GroupListingBatch(groups, user)
+    for group in groups:
+        group._listing_batch = batch
+    return groups
+
 def get_valid_parents(user, group=None, model=BaseGroup):
     if user.has_module_perms("base_groups"):
         vps = model.objects.all()
@@ -0,0 +1,27 @@
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+from django.utils import simplejson
+
+from base_groups.models import MemberRecordBatch, write_member_records
+
+
+class Command(NoArgsCommand):
+    help = "Writes queued group membership history (see GROUP_MEMBER_RECORDS_DEFERRED)."
+
+    def handle_noargs(self, **options):
+        batches = 0
+        records = 0
+        for batch_id in MemberRecordBatch.objects.order_by('id').values_list('id', flat=True):
+            records += self.drain_batch(batch_id)
+            batches += 1
+        return 'Wrote %d membership records from %d batches.' % (records, batches)
+
+    # the rows are written and the batch removed together, so an interrupted
+    # drain never writes a batch twice
+    @transaction.commit_on_success
+    def drain_batch(self, batch_id):
+        batch = MemberRecordBatch.objects.get(id=batch_id)
+        rows = simplejson.loads(batch.rows)
+        write_member_records(rows)
+        batch.delete()
+        return len(rows)
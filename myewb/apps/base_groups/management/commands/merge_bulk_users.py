@@ -0,0 +1,37 @@
+from django.core.management.base import NoArgsCommand
+from django.db import connection, transaction
+from django.contrib.auth.models import User
+
+from emailconfirmation.models import EmailAddress
+
+from base_groups.models import merge_bulk_user
+
+# bulk users whose address has been verified by a real user, paired with
+# the (first) real user who verified it
+DUPLICATES_SQL = """
+    SELECT b.id, MIN(e.user_id) FROM %(user)s b
+    INNER JOIN %(emailaddress)s e ON e.email = b.email AND e.verified = %%s
+    INNER JOIN %(user)s u ON u.id = e.user_id AND u.is_bulk = %%s
+    WHERE b.is_bulk = %%s
+    GROUP BY b.id
+"""
+
+class Command(NoArgsCommand):
+    help = "Merges bulk users into the real users who have since verified the same email address."
+
+    def handle_noargs(self, **options):
+        qn = connection.ops.quote_name
+        cursor = connection.cursor()
+        cursor.execute(DUPLICATES_SQL % {'user': qn(User._meta.db_table),
+                                         'emailaddress': qn(EmailAddress._meta.db_table)},
+                       [True, False, True])
+        pairs = cursor.fetchall()
+        
+        for bulk_id, user_id in pairs:
+            self.merge(bulk_id, user_id)
+        return 'Merged %d bulk users.' % len(pairs)
+
+    # one transaction per merge, so a failure only leaves that pair behind
+    @transaction.commit_on_success
+    def merge(self, bulk_id, user_id):
+        merge_bulk_user(User.objects.get(id=bulk_id), User.objects.get(id=user_id))
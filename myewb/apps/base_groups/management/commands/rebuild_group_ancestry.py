@@ -0,0 +1,24 @@
+from django.core.management.base import NoArgsCommand
+
+from base_groups.models import BaseGroup, rebuild_group_ancestry, invalidate_all_visible_groups
+
+
+class Command(NoArgsCommand):
+    help = "Rebuilds the GroupAncestor table used for parent-chain admin and visibility checks."
+
+    def handle_noargs(self, **options):
+        changed = 0
+        # top-level groups first, so parents are always built before children
+        for group in BaseGroup.objects.filter(parent__isnull=True):
+            changed += self.rebuild_tree(group)
+        if changed:
+            invalidate_all_visible_groups()
+        return 'Updated ancestry for %d groups.' % changed
+
+    def rebuild_tree(self, group):
+        changed = 0
+        if rebuild_group_ancestry(group):
+            changed += 1
+        for child in BaseGroup.objects.filter(parent=group):
+            changed += self.rebuild_tree(child)
+        return changed
@@ -0,0 +1,36 @@
+from django.core.management.base import NoArgsCommand
+from django.db import connection, transaction
+
+from base_groups.models import GroupMemberRecord, GroupMembershipInterval, \
+        MEMBER_RECORD_COLUMNS, update_membership_intervals
+
+# number of records replayed per batch
+CHUNK_SIZE = 1000
+
+class Command(NoArgsCommand):
+    help = "Rebuilds the membership intervals used for point-in-time membership queries from the full membership history."
+
+    @transaction.commit_on_success
+    def handle_noargs(self, **options):
+        qn = connection.ops.quote_name
+        cursor = connection.cursor()
+        cursor.execute("DELETE FROM %s" % qn(GroupMembershipInterval._meta.db_table))
+        
+        # stream the history in chronological order per membership; each
+        # chunk picks up the intervals left open by the previous one
+        cursor.execute("SELECT %s FROM %s ORDER BY %s, %s, %s, %s" % (
+                           ", ".join([qn(c) for c in MEMBER_RECORD_COLUMNS]),
+                           qn(GroupMemberRecord._meta.db_table),
+                           qn('group_id'), qn('user_id'), qn('datetime'), qn('id')))
+        records = 0
+        while True:
+            rows = cursor.fetchmany(CHUNK_SIZE)
+            if not rows:
+                break
+            update_membership_intervals(rows)
+            records += len(rows)
+        # the writes above are raw SQL, which commit_on_success can't see
+        transaction.set_dirty()
+        
+        return 'Replayed %d membership records into %d intervals.' % (
+                   records, GroupMembershipInterval.objects.count())
@@ -0,0 +1,32 @@
+from django.core.management.base import NoArgsCommand
+from django.db import connection, transaction
+
+from base_groups.models import BaseGroup, GroupCounts
+
+
+class Command(NoArgsCommand):
+    help = "Recomputes the member and topic totals shown in the group listings."
+
+    def handle_noargs(self, **options):
+        cursor = connection.cursor()
+        
+        cursor.execute("SELECT group_id, COUNT(*) FROM base_groups_groupmember GROUP BY group_id")
+        member_counts = dict(cursor.fetchall())
+        cursor.execute("SELECT parent_group_id, COUNT(*) FROM group_topics_grouptopic GROUP BY parent_group_id")
+        topic_counts = dict(cursor.fetchall())
+        
+        existing = dict((c.pk, c) for c in GroupCounts.objects.all())
+        fixed = 0
+        for group_id in BaseGroup.objects.values_list('id', flat=True):
+            counts = existing.get(group_id, None) or GroupCounts(pk=group_id)
+            member_count = member_counts.get(group_id, 0)
+            topic_count = topic_counts.get(group_id, 0)
+            if counts.member_count != member_count or counts.topic_count != topic_count \
+                    or group_id not in existing:
+                counts.member_count = member_count
+                counts.topic_count = topic_count
+                counts.save()
+                fixed += 1
+        
+        transaction.commit_unless_managed()
+        return 'Fixed totals for %d groups.' % fixed
@@ -0,0 +1,26 @@
+from django.core.management.base import NoArgsCommand
+
+from base_groups.models import GroupMailing, GroupMailBatch, requeue_stalled_batches
+
+
+class Command(NoArgsCommand):
+    help = "Expands queued group emails into batches and sends them, retrying failed and stalled batches."
+
+    def handle_noargs(self, **options):
+        requeued = requeue_stalled_batches()
+        
+        expanded = 0
+        for mailing in GroupMailing.objects.filter(status='Q'):
+            if mailing.expand():
+                expanded += 1
+        
+        sent = 0
+        failed = 0
+        for batch in GroupMailBatch.objects.filter(status='Q').order_by('id').select_related('mailing'):
+            if batch.send():
+                sent += 1
+            else:
+                failed += 1
+        
+        return 'Requeued %d stalled batches; expanded %d mailings; sent %d batches, %d not sent.' % (
+                   requeued, expanded, sent, failed)
@@ -0,0 +1,29 @@
+"""myEWB base groups middleware
+
+This file is part of myEWB
+Copyright 2009 Engineers Without Borders (Canada) Organisation and/or volunteer contributors
+"""
+
+from base_groups.models import start_member_record_buffer, flush_member_records, discard_member_records
+
+class MemberRecordBufferMiddleware(object):
+    """
+    Collects the GroupMemberRecord snapshots made during a request and writes
+    them in one batch at the end.
+    
+    Must be listed *after* django.middleware.transaction.TransactionMiddleware
+    so that the flush happens before the request's transaction is committed
+    (response middleware runs in reverse order).
+    """
+    
+    def process_request(self, request):
+        # clear anything left over from a request that never finished
+        discard_member_records()
+        start_member_record_buffer()
+    
+    def process_exception(self, request, exception):
+        discard_member_records()
+    
+    def process_response(self, request, response):
+        flush_member_records()
+        return response
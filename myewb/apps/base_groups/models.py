@@ -8,17 +8,26 @@ Last modified on 2009-07-29
 @author Joshua Gorner, Benjamin Best
 """
 
+import bisect
 import datetime
 import re
+import threading
 import unicodedata
 
 from django.core.urlresolvers import reverse
 from django.contrib.auth.models import  User
 from django.utils.translation import ugettext_lazy as _
-from django.db import models, connection
-from django.db.models.signals import post_save, pre_delete
+from django.db import models, connection, transaction, IntegrityError
+from django.db.models import Q
+from django.db.models.signals import post_save, pre_delete, post_delete
+from django.dispatch import Signal
+from django.core import mail
 from django.core.mail import EmailMessage
 from django.conf import settings
+from django.core.cache import cache
+from django.utils import simplejson
+from django.utils.html import escape
+from django.utils.http import urlquote
 
 from emailconfirmation.models import EmailAddress
 
@@ -26,6 +35,7 @@ from siteutils.helpers import get_email_user
 from manager_extras.models import ExtraUserManager
 from groups.base import Group
 from wiki.models import Article
+from whiteboard.helpers import empty_whiteboard, GROUP_WHITEBOARD_TITLE
 from messages.models import Message
 
 if "notification" in settings.INSTALLED_APPS:
@@ -33,6 +43,43 @@ if "notification" in settings.INSTALLED_APPS:
 else:
     notification = None
 
+# member addresses, preferring the verified primary address; sorted
+# case-insensitively so that duplicates arrive next to each other
+MEMBER_EMAILS_SQL = """
+    SELECT COALESCE(e.email, u.email) FROM %(member)s m
+    INNER JOIN %(user)s u ON u.id = m.user_id
+    LEFT OUTER JOIN %(emailaddress)s e ON e.user_id = u.id AND e.%(primary)s = %%s AND e.verified = %%s
+    WHERE m.group_id = %%s
+    ORDER BY LOWER(COALESCE(e.email, u.email))
+"""
+MEMBER_EMAILS_CHUNK_SIZE = 1000
+
+# number of times a new group will retry its slug after losing a race
+SLUG_ALLOCATION_ATTEMPTS = 5
+
+def allocate_group_slug(slug, exclude=()):
+    """
+    Returns slug if it is free, otherwise slug with the smallest free numeric
+    suffix appended (ewb, ewb1, ewb2...).
+    
+    Only the slug itself and slugs of the form slug + digits are fetched,
+    using a range on the (unique, indexed) slug column rather than a LIKE
+    scan.  ':' is the character following '9', so the range covers exactly
+    the slugs that begin with slug followed by a digit.  Slugs listed in
+    exclude are treated as taken.
+    """
+    taken = BaseGroup.objects.filter(models.Q(slug=slug)
+                                     | models.Q(slug__gte=slug + '0', slug__lt=slug + ':'))
+    taken = set([s.lower() for s in taken.values_list('slug', flat=True)])
+    taken.update([s.lower() for s in exclude])
+    
+    candidate = slug
+    i = 0
+    while candidate.lower() in taken:
+        i = i + 1
+        candidate = slug + "%d" % (i, )
+    return candidate
+
 class BaseGroup(Group):
     """Base group (from which networks, communities, projects, etc. derive).
     
@@ -57,6 +104,34 @@ class BaseGroup(Group):
     
     whiteboard = models.ForeignKey(Article, related_name="group", verbose_name=_('whiteboard'), null=True)
 
+    def __init__(self, *args, **kwargs):
+        super(BaseGroup, self).__init__(*args, **kwargs)
+        # remembered so update_group_ancestry can tell when a group is moved,
+        # and invalidate_all_visible_groups when it is moved or re-scoped
+        self._saved_parent_id = self.parent_id
+        self._saved_scope = (self.parent_id, self.visibility)
+
+    def get_ancestor_ids(self):
+        """
+        Returns the ids of this group's parent, grandparent, and so on
+        (nearest first), read from GroupAncestor in one query.
+        """
+        if not hasattr(self, '_ancestor_ids'):
+            if not self.parent_id:
+                ancestor_ids = []
+            else:
+                ancestor_ids = list(GroupAncestor.objects.filter(group=self, depth__gt=0)
+                                                   .order_by('depth')
+                                                   .values_list('ancestor', flat=True))
+                if not ancestor_ids:
+                    # rows haven't been built for this group yet
+                    rebuild_group_ancestry(self)
+                    ancestor_ids = list(GroupAncestor.objects.filter(group=self, depth__gt=0)
+                                                       .order_by('depth')
+                                                       .values_list('ancestor', flat=True))
+            self._ancestor_ids = ancestor_ids
+        return self._ancestor_ids
+
     def is_visible(self, user):
         visible = False
         
@@ -69,19 +144,19 @@ class BaseGroup(Group):
             if user.has_module_perms("base_groups"):
                 return True
                 
-            # admins of the parent group are automatically admins here
-            if self.parent and self.parent.user_is_admin(user):
+            memberships = get_memberships(user)
+            
+            # admins of a parent group are automatically admins here
+            if self.parent_id and memberships.is_admin_of_any(self.get_ancestor_ids()):
                 return True
             
             # members of the group can see the group...
-            member_list = self.members.filter(user=user)
-            if member_list.count() > 0:
+            if memberships.is_member(self.id):
                 visible = True
                 
             # and the last option, members of the parent group can see this one
-            elif self.visibility == 'P':
-                parent_member_list = self.parent.members.filter(user=user)
-                if parent_member_list.count() > 0:
+            elif self.visibility == 'P' and self.parent_id:
+                if memberships.is_member(self.parent_id):
                     visible = True
                     
         return visible
@@ -90,13 +165,16 @@ class BaseGroup(Group):
     def user_is_member(self, user, admin_override = False):
         if admin_override and user.has_module_perms("base_groups"):
             return True
-        return user.is_authenticated() and (self.members.filter(user=user).count() > 0)
+        return user.is_authenticated() and get_memberships(user).is_member(self.id)
         
     def user_is_member_or_pending(self, user):
-        return user.is_authenticated() and ((self.members.filter(user=user).count() > 0) or self.pending_members.filter(user=user).count() > 0)
+        if not user.is_authenticated():
+            return False
+        memberships = get_memberships(user)
+        return memberships.is_member(self.id) or memberships.is_pending(self.id)
 
     def user_is_pending_member(self, user):
-        return user.is_authenticated() and self.pending_members.filter(user=user).count() > 0
+        return user.is_authenticated() and get_memberships(user).is_pending(self.id)
     
     def user_is_admin(self, user):
         if user.is_authenticated():
@@ -104,22 +182,63 @@ class BaseGroup(Group):
             if user.has_module_perms("base_groups"):
                 return True
                 
-            # admins of the parent group are admins here...
-            if self.parent and self.parent.user_is_admin(user):
+            memberships = get_memberships(user)
+            
+            # regular admins...
+            if memberships.is_admin(self.id):
                 return True
             
-            # and check for regular admins
-            if self.members.filter(user=user, is_admin=True).count() > 0:
+            # and admins of any parent group are admins here
+            if self.parent_id and memberships.is_admin_of_any(self.get_ancestor_ids()):
                 return True
         
         return False
 
+    def get_membership(self, user):
+        """
+        Returns the user's GroupMember object for this group, their
+        PendingMember object if they have asked (or been invited) to join,
+        or None.
+        """
+        if not user.is_authenticated():
+            return None
+        memberships = get_memberships(user)
+        return memberships.get_member(self.id) or memberships.get_pending(self.id)
+
     def get_absolute_url(self):
         return reverse('group_detail', kwargs={'group_slug': self.slug})
 
+    def iter_member_emails(self):
+        """
+        Yields one address for every member (accepted and bulk): their
+        verified primary EmailAddress if they have one, otherwise the address
+        on their user account.  Each address is yielded once.
+        
+        Reads plain rows in address order straight from the cursor instead of
+        building GroupMember and User objects, so memory use stays flat
+        however large the group is.
+        """
+        qn = connection.ops.quote_name
+        cursor = connection.cursor()
+        cursor.execute(MEMBER_EMAILS_SQL % {
+                           'member': qn(GroupMember._meta.db_table),
+                           'user': qn(User._meta.db_table),
+                           'emailaddress': qn(EmailAddress._meta.db_table),
+                           'primary': qn('primary'),
+                       },
+                       [True, True, self.id])
+        previous = None
+        while True:
+            rows = cursor.fetchmany(MEMBER_EMAILS_CHUNK_SIZE)
+            if not rows:
+                break
+            for (email, ) in rows:
+                if email and email.lower() != previous:
+                    previous = email.lower()
+                    yield email
+
     def get_member_emails(self):
-        members_with_emails = self.members.all().select_related(depth=1)
-        return [member.user.email for member in members_with_emails if member.user.email]
+        return list(self.iter_member_emails())
 
     def add_member(self, user):
         """
@@ -128,27 +247,31 @@ class BaseGroup(Group):
         """
         return GroupMember.objects.create(user=user, group=self)
 
-    def send_mail_to_members(self, subject, body, html=True, fail_silently=False):
+    def send_mail_to_members(self, subject, body, html=True, fail_silently=False, footer=''):
         """
-        Creates and sends an email to all members of a network using Django's
-        EmailMessage.
-        Takes in a a subject and a message and an optional fail_silently flag.
+        Queues an email to all members of a network and returns immediately;
+        the send_group_mail command expands the recipients and delivers it in
+        batches of GROUP_MAIL_BATCH_SIZE.
+        Takes in a a subject and a message, and optionally a footer to be
+        personalized for each recipient (see GroupMailing.personalize).
+        fail_silently is kept for compatibility; failed batches are retried
+        by the worker instead.
         Automatically sets:
         from_email: group_name <group_slug@ewb.ca>
         to: list-group_slug@ewb.ca
-        bcc: list of member emails
+        bcc: member emails (one batch per message; with a footer, each
+             member gets a message of their own instead)
+        Returns the GroupMailing.
         """
-        msg = EmailMessage(
+        return GroupMailing.objects.create(
+                group=self,
                 subject=subject, 
                 body=body, 
+                html=html,
+                footer=footer,
                 from_email='%s <%s@ewb.ca>' % (self.name, self.slug), 
-                to=['list-%s@ewb.ca' % self.slug],
-                bcc=self.get_member_emails(),
+                to_email='list-%s@ewb.ca' % self.slug,
                 )
-        if html:
-            msg.content_subtype = "html"
-            
-        msg.send(fail_silently=fail_silently)
     
     # TODO:
     # list of members (NOT CSV)
@@ -170,22 +293,34 @@ class BaseGroup(Group):
             if match is None or not match.group(0) == slug:
                 slug = re.sub(r'[^-\w]+', '', slug)
             
-            # check if slug is in use; increment until we find a good one.
-            # (is there anything better than numerical incrementing?)
-            temp_groups = BaseGroup.objects.filter(slug__contains=slug, model=self.model)
-
-            if (temp_groups.count() != 0):
-                slugs = [n.slug for n in temp_groups]
-                old_slug = slug
-                i = 0
-                while slug in slugs:
-                    i = i + 1
-                    slug = old_slug + "%d" % (i, )
-            self.slug = slug
+            # slugs are unique across all group models; if two groups are
+            # created with the same name at once, the loser of the race hits
+            # the unique index and retries with the next free suffix.
+            taken = []
+            for attempt in range(SLUG_ALLOCATION_ATTEMPTS):
+                self.slug = allocate_group_slug(slug, exclude=taken)
+                sid = transaction.savepoint()
+                try:
+                    super(BaseGroup, self).save(force_insert=force_insert, force_update=force_update)
+                except IntegrityError:
+                    transaction.savepoint_rollback(sid)
+                    if attempt == SLUG_ALLOCATION_ATTEMPTS - 1:
+                        raise
+                    taken.append(self.slug)
+                else:
+                    transaction.savepoint_commit(sid)
+                    return
         super(BaseGroup, self).save(force_insert=force_insert, force_update=force_update)
 
     def get_url_kwargs(self):
         return {'group_slug': self.slug}
+    
+    def get_whiteboard(self):
+        """
+        The group's whiteboard, or an empty unsaved one if nobody has
+        written it yet (it is created on first edit).
+        """
+        return self.whiteboard or empty_whiteboard(GROUP_WHITEBOARD_TITLE)
         
     def get_visible_children(self, user):
         if not user.is_authenticated():
@@ -208,7 +343,378 @@ class BaseGroup(Group):
 
     def num_pending_members(self):
         return self.pending_members.all().count()
+
+    def members_as_of(self, when):
+        """
+        Returns the users who were members of this group at the given
+        datetime, according to the membership history.
+        """
+        user_ids = GroupMembershipInterval.objects.as_of(when).filter(group=self).values('user')
+        return User.objects.filter(id__in=user_ids)
+    
+    def member_count_as_of(self, when):
+        return GroupMembershipInterval.objects.as_of(when).filter(group=self).count()
+    
+    def member_counts(self, moments):
+        """
+        Returns the number of members at each of the given datetimes (which
+        must be in ascending order), as a list of (datetime, count) pairs.
+        
+        Fetches only the start/end times of intervals that overlap the
+        requested period, in one query, and counts them with a sweep.
+        """
+        if not moments:
+            return []
+        intervals = GroupMembershipInterval.objects.filter(group=self, started__lte=moments[-1])
+        intervals = intervals.filter(models.Q(ended__isnull=True) | models.Q(ended__gt=moments[0]))
+        
+        starts = []
+        ends = []
+        for started, ended in intervals.values_list('started', 'ended'):
+            starts.append(started)
+            if ended is not None:
+                ends.append(ended)
+        starts.sort()
+        ends.sort()
+        
+        # a member at moment m: started <= m and not (ended <= m)
+        return [(m, bisect.bisect_right(starts, m) - bisect.bisect_right(ends, m))
+                for m in moments]
+    
+    def monthly_member_counts(self, start, end):
+        """
+        Returns (date, count) pairs giving the number of members on the first
+        of each month from start to end (dates or datetimes).
+        """
+        months = []
+        year, month = start.year, start.month
+        while (year, month) <= (end.year, end.month):
+            months.append(datetime.datetime(year, month, 1))
+            year, month = (month == 12) and (year + 1, 1) or (year, month + 1)
+        return [(m.date(), count) for m, count in self.member_counts(months)]
+    
+class GroupMailing(models.Model):
+    """
+    An email to all members of a group, waiting to be (or being) delivered
+    by the send_group_mail command.  The recipients are expanded into
+    GroupMailBatch rows by the worker, so queueing a mailing is cheap no
+    matter how big the group is.
+    """
+    group = models.ForeignKey(BaseGroup, related_name="mailings", verbose_name=_('group'))
+    subject = models.CharField(_('subject'), max_length=255)
+    body = models.TextField(_('body'))
+    html = models.BooleanField(_('html'), default=True)
+    from_email = models.CharField(_('from'), max_length=255)
+    to_email = models.CharField(_('to'), max_length=255)
+    footer = models.TextField(_('footer'), blank=True)
+    created = models.DateTimeField(_('created'), default=datetime.datetime.now)
+    
+    STATUS_CHOICES = (
+        ('Q', _("queued")),
+        ('E', _("expanding recipients")),
+        ('D', _("dispatched in batches")),
+    )
+    status = models.CharField(_('status'), max_length=1, choices=STATUS_CHOICES, default='Q')
+    
+    class Meta:
+        ordering = ('created',)
+
+    def __unicode__(self):
+        return "%s: %s" % (self.group, self.subject)
+    
+    # all batches are written in one transaction, so a mailing is never
+    # left half-expanded
+    @transaction.commit_on_success
+    def expand(self):
+        """
+        Splits the group's member addresses into batches.  Returns False if
+        another worker already took this mailing.
+        """
+        if not claim_row(GroupMailing, self.id, 'Q', 'E'):
+            return False
+        
+        batch_size = getattr(settings, 'GROUP_MAIL_BATCH_SIZE', 100)
+        recipients = []
+        for email in self.group.iter_member_emails():
+            recipients.append(email)
+            if len(recipients) == batch_size:
+                self.batches.create(recipients="\n".join(recipients))
+                recipients = []
+        if recipients:
+            self.batches.create(recipients="\n".join(recipients))
+        
+        self.status = 'D'
+        self.save()
+        return True
+    
+    def personalize(self, email):
+        """
+        Returns the body for one recipient: the body (rendered once, when the
+        mailing was queued) with the footer added, %(email)s in the footer
+        replaced by their address and %(email_url)s by the address quoted
+        for use in a link.
+        """
+        if self.html:
+            footer = self.footer % {'email': escape(email), 'email_url': urlquote(email)}
+            if '</body>' in self.body:
+                return self.body.replace('</body>', footer + '</body>', 1)
+        else:
+            footer = self.footer % {'email': email, 'email_url': urlquote(email)}
+        return self.body + footer
+    
+    def delivery_status(self):
+        """
+        Returns a dict of batch status code -> number of batches.
+        """
+        status = {}
+        for code in self.batches.values_list('status', flat=True):
+            status[code] = status.get(code, 0) + 1
+        return status
+
+class GroupMailBatch(models.Model):
+    """
+    One message's worth of recipients (sent as bcc) for a GroupMailing.
+    Batches are sent and retried independently, so one bad address or a
+    dropped connection only holds up its own batch.
+    """
+    mailing = models.ForeignKey(GroupMailing, related_name="batches", verbose_name=_('mailing'))
+    recipients = models.TextField(_('recipients'))
+    
+    STATUS_CHOICES = (
+        ('Q', _("queued")),
+        ('W', _("sending")),
+        ('S', _("sent")),
+        ('F', _("failed")),
+    )
+    status = models.CharField(_('status'), max_length=1, choices=STATUS_CHOICES, default='Q')
+    attempts = models.PositiveIntegerField(_('attempts'), default=0)
+    last_error = models.TextField(_('last error'), blank=True)
+    sent = models.DateTimeField(_('sent'), null=True, blank=True)
+    claimed = models.DateTimeField(_('claimed'), null=True, blank=True)
+    
+    def send(self):
+        """
+        Sends this batch.  Failures are recorded and the batch re-queued
+        until GROUP_MAIL_MAX_ATTEMPTS is reached.  Returns True if the batch
+        went out (False if it failed or another worker took it).
+        
+        Mailings with a footer go out as one message per recipient, over a
+        single connection; if that fails part way through, the recipients
+        already sent to are dropped from the batch before it is retried.
+        A worker that dies mid-send leaves the batch to
+        requeue_stalled_batches.
+        """
+        if not claim_row(GroupMailBatch, self.id, 'Q', 'W', claimed_field='claimed'):
+            return False
+        
+        mailing = self.mailing
+        recipients = self.recipients.split()
+        self.attempts = self.attempts + 1
+        try:
+            if mailing.footer:
+                smtp = mail.SMTPConnection(fail_silently=False)
+                smtp.open()
+                try:
+                    while recipients:
+                        smtp.send_messages([self.message(mailing.personalize(recipients[0]),
+                                                         to=[recipients[0]])])
+                        recipients.pop(0)
+                finally:
+                    smtp.close()
+            else:
+                self.message(mailing.body, to=[mailing.to_email], bcc=recipients).send(fail_silently=False)
+        except Exception, e:
+            self.recipients = "\n".join(recipients)
+            self.last_error = unicode(e)
+            if self.attempts >= getattr(settings, 'GROUP_MAIL_MAX_ATTEMPTS', 5):
+                self.status = 'F'
+            else:
+                self.status = 'Q'
+            self.save()
+            return False
+        
+        self.status = 'S'
+        self.sent = datetime.datetime.now()
+        self.save()
+        return True
     
+    def message(self, body, to, bcc=None):
+        mailing = self.mailing
+        msg = EmailMessage(
+                subject=mailing.subject,
+                body=body,
+                from_email=mailing.from_email,
+                to=to,
+                bcc=bcc,
+                )
+        if mailing.html:
+            msg.content_subtype = "html"
+        return msg
+
+def claim_row(model, id, from_status, to_status, claimed_field=None):
+    """
+    Atomically moves a row from one status to another, so that two workers
+    never pick up the same mailing, batch or import job.  Returns True if
+    this caller made the change.  If claimed_field is given, that column is
+    set to the time of the claim.
+    """
+    qn = connection.ops.quote_name
+    sets = ["%s = %%s" % qn('status')]
+    params = [to_status]
+    if claimed_field:
+        sets.append("%s = %%s" % qn(model._meta.get_field(claimed_field).column))
+        params.append(connection.ops.value_to_db_datetime(datetime.datetime.now()))
+    cursor = connection.cursor()
+    cursor.execute("UPDATE %s SET %s WHERE %s = %%s AND %s = %%s" % (
+                       qn(model._meta.db_table), ", ".join(sets), qn(model._meta.pk.column), qn('status')),
+                   params + [id, from_status])
+    claimed = cursor.rowcount == 1
+    transaction.commit_unless_managed()
+    return claimed
+
+def requeue_stalled_batches(timeout=None):
+    """
+    Puts batches that have been sending for more than timeout seconds
+    (default GROUP_MAIL_SEND_TIMEOUT) back in the queue: their worker died
+    before recording how the send went.  The stalled send counts as an
+    attempt, so a batch that keeps killing its worker ends up failed.
+    Recipients of a footer mailing who were sent to before the worker died
+    will get the message again.  Returns the number of batches requeued.
+    """
+    if timeout is None:
+        timeout = getattr(settings, 'GROUP_MAIL_SEND_TIMEOUT', 60 * 60)
+    cutoff = datetime.datetime.now() - datetime.timedelta(seconds=timeout)
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    cursor.execute("UPDATE %s SET %s = CASE WHEN %s + 1 >= %%s THEN %%s ELSE %%s END, "
+                   "%s = %s + 1, %s = %%s "
+                   "WHERE %s = %%s AND (%s IS NULL OR %s < %%s)" % (
+                       qn(GroupMailBatch._meta.db_table), qn('status'), qn('attempts'),
+                       qn('attempts'), qn('attempts'), qn('last_error'),
+                       qn('status'), qn('claimed'), qn('claimed')),
+                   [getattr(settings, 'GROUP_MAIL_MAX_ATTEMPTS', 5), 'F', 'Q',
+                    'worker stopped while sending', 'W', connection.ops.value_to_db_datetime(cutoff)])
+    requeued = cursor.rowcount
+    transaction.commit_unless_managed()
+    return requeued
+    
+class GroupAncestor(models.Model):
+    """
+    Materialized group ancestry: one row for every (group, ancestor) pair,
+    including the group itself at depth 0.  Lets "is the user an admin of
+    this group or any of its parents" be answered without walking up the
+    parent chain one query at a time.
+    
+    Kept in sync by update_group_ancestry; rows are removed along with
+    either group when it is deleted.
+    """
+    group = models.ForeignKey(BaseGroup, related_name="ancestor_links", verbose_name=_('group'))
+    ancestor = models.ForeignKey(BaseGroup, related_name="descendant_links", verbose_name=_('ancestor'))
+    depth = models.PositiveIntegerField(_('depth'))
+    
+    class Meta:
+        unique_together = (('group', 'ancestor'),)
+
+    def __unicode__(self):
+        return "%s - %s (%d)" % (self.group, self.ancestor, self.depth)
+
+def rebuild_group_ancestry(group):
+    """
+    Recomputes the GroupAncestor rows for a single group from its parent's
+    rows.  Returns True if anything changed.
+    """
+    chain = []
+    if group.parent_id:
+        chain = list(GroupAncestor.objects.filter(group=group.parent_id)
+                                          .order_by('depth')
+                                          .values_list('ancestor', flat=True))
+        if not chain:
+            # parent predates the ancestry table; build it first
+            rebuild_group_ancestry(BaseGroup.objects.get(id=group.parent_id))
+            chain = list(GroupAncestor.objects.filter(group=group.parent_id)
+                                              .order_by('depth')
+                                              .values_list('ancestor', flat=True))
+        if group.id in chain:
+            # a group can't be its own ancestor; ignore the bad parent
+            chain = []
+    ancestors = [group.id] + chain
+    
+    existing = list(GroupAncestor.objects.filter(group=group)
+                                         .order_by('depth')
+                                         .values_list('ancestor', flat=True))
+    if existing == ancestors:
+        return False
+    
+    GroupAncestor.objects.filter(group=group).delete()
+    for depth, ancestor_id in enumerate(ancestors):
+        GroupAncestor.objects.create(group_id=group.id, ancestor_id=ancestor_id, depth=depth)
+    return True
+
+def update_group_ancestry(sender, instance, created, **kwargs):
+    """
+    Builds the ancestry of a new group, or of a group that has been given a
+    new parent - along with everything underneath it.
+    """
+    if not created and instance.parent_id == instance._saved_parent_id:
+        return
+    instance._saved_parent_id = instance.parent_id
+    if hasattr(instance, '_ancestor_ids'):
+        del instance._ancestor_ids
+    
+    if rebuild_group_ancestry(instance) and not created:
+        # ordering by (old) depth means parents are always rebuilt before
+        # their children
+        descendants = GroupAncestor.objects.filter(ancestor=instance, depth__gt=0) \
+                                           .order_by('depth') \
+                                           .values_list('group', flat=True)
+        for group_id in list(descendants):
+            rebuild_group_ancestry(BaseGroup.objects.get(id=group_id))
+post_save.connect(update_group_ancestry, sender=BaseGroup)
+
+class GroupCounts(models.Model):
+    """
+    Denormalized member and topic totals for the group listings.
+    
+    These live in their own table, rather than as columns on BaseGroup, so
+    that saving a group can never write stale totals back over them.  Kept
+    up to date by adjust_group_count; the recount_groups management command
+    repairs any drift.
+    """
+    group = models.OneToOneField(BaseGroup, primary_key=True, related_name="counts", verbose_name=_('group'))
+    member_count = models.PositiveIntegerField(_('member count'), default=0)
+    topic_count = models.PositiveIntegerField(_('topic count'), default=0)
+
+    def __unicode__(self):
+        return "%s (%d members, %d topics)" % (self.group, self.member_count, self.topic_count)
+
+def recount_group(group_id):
+    """
+    Recomputes a group's totals from scratch.
+    """
+    counts, created = GroupCounts.objects.get_or_create(pk=group_id)
+    counts.member_count = GroupMember.objects.filter(group=group_id).count()
+    counts.topic_count = counts.group.topics.count()
+    counts.save()
+    return counts
+
+def adjust_group_count(group_id, field, amount):
+    """
+    Atomically adds amount (which may be negative) to one of a group's
+    totals.  field is either 'member_count' or 'topic_count'.
+    """
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    cursor.execute("UPDATE %s SET %s = %s + %%s WHERE %s = %%s" % (
+                       qn(GroupCounts._meta.db_table), qn(field), qn(field),
+                       qn(GroupCounts._meta.pk.column)),
+                   [amount, group_id])
+    updated = cursor.rowcount
+    transaction.commit_unless_managed()
+    
+    if not updated:
+        # no totals yet for this group (created before the table existed)
+        recount_group(group_id)
+
 class BaseGroupMember(models.Model):
     is_admin = models.BooleanField(_('admin'), default=False)
     admin_title = models.CharField(_('admin title'), max_length=500, null=True, blank=True)
@@ -285,23 +791,231 @@ class GroupMemberRecord(BaseGroupMember):
             self.joined = instance.joined
 
 
+class MemberRecordBatch(models.Model):
+    """
+    A batch of GroupMemberRecord rows waiting to be written by the
+    drain_member_records command, used when
+    settings.GROUP_MEMBER_RECORDS_DEFERRED is on.  rows is a JSON list of
+    column values in MEMBER_RECORD_COLUMNS order.
+    """
+    created = models.DateTimeField(auto_now_add=True)
+    rows = models.TextField()
+
+MEMBER_RECORD_COLUMNS = ('group_id', 'user_id', 'is_admin', 'admin_title', 'admin_order',
+                         'joined', 'datetime', 'membership_end')
+
+# per-thread buffer of pending snapshot rows; only active between
+# start_member_record_buffer() and flush_member_records()
+_record_buffer = threading.local()
+
+def _member_record_row(instance, membership_end):
+    """
+    Returns the column values for a snapshot of instance taken right now.
+    The timestamp is captured here so a buffered record keeps the time of
+    the change, not the time it was flushed.
+    """
+    ops = connection.ops
+    return [instance.group_id, instance.user_id, instance.is_admin, instance.admin_title,
+            instance.admin_order, ops.value_to_db_datetime(instance.joined),
+            ops.value_to_db_datetime(datetime.datetime.now()), membership_end]
+
+def start_member_record_buffer():
+    """
+    Starts collecting GroupMemberRecord snapshots for the current thread
+    instead of writing each one as it happens.  Calls may be nested; only
+    the outermost flush_member_records() writes anything.
+    """
+    _record_buffer.depth = getattr(_record_buffer, 'depth', 0) + 1
+    if _record_buffer.depth == 1:
+        _record_buffer.rows = []
+
+def flush_member_records():
+    """
+    Ends the current buffer and writes everything collected in a single
+    batched insert (or queues it, if GROUP_MEMBER_RECORDS_DEFERRED is on).
+    This should run inside the same transaction as the changes it records.
+    """
+    depth = getattr(_record_buffer, 'depth', 0)
+    if depth == 0:
+        return
+    _record_buffer.depth = depth - 1
+    if depth > 1:
+        return
+    
+    rows = _record_buffer.rows
+    _record_buffer.rows = None
+    if rows:
+        save_member_records(rows)
+
+def discard_member_records():
+    """
+    Ends the current buffer without writing it, ie when the transaction
+    holding the recorded changes is being rolled back.
+    """
+    _record_buffer.depth = 0
+    _record_buffer.rows = None
+
+def save_member_records(rows):
+    """
+    Writes a list of GroupMemberRecord rows, or queues them for
+    drain_member_records if GROUP_MEMBER_RECORDS_DEFERRED is on.  While
+    that is on every record must go through the queue, or it could be
+    written (and its interval applied) ahead of older queued records.
+    """
+    if getattr(settings, 'GROUP_MEMBER_RECORDS_DEFERRED', False):
+        MemberRecordBatch.objects.create(rows=simplejson.dumps(rows))
+    else:
+        write_member_records(rows)
+
+def write_member_records(rows):
+    """
+    Inserts a list of GroupMemberRecord rows (see MEMBER_RECORD_COLUMNS)
+    with one executemany call.
+    """
+    qn = connection.ops.quote_name
+    sql = "INSERT INTO %s (%s) VALUES (%s)" % (
+              qn(GroupMemberRecord._meta.db_table),
+              ", ".join([qn(c) for c in MEMBER_RECORD_COLUMNS]),
+              ", ".join(["%s"] * len(MEMBER_RECORD_COLUMNS)))
+    cursor = connection.cursor()
+    cursor.executemany(sql, rows)
+    update_membership_intervals(rows)
+    transaction.commit_unless_managed()
+
+class MembershipIntervalManager(models.Manager):
+    def as_of(self, when):
+        """
+        Intervals covering the given datetime.
+        """
+        return self.get_query_set().filter(models.Q(ended__isnull=True) | models.Q(ended__gt=when),
+                                           started__lte=when)
+
+class GroupMembershipInterval(models.Model):
+    """
+    A continuous stretch of membership in a group, from the record that
+    started it to the record that ended it (null while still a member).
+    
+    A compact summary of GroupMemberRecord used to answer "who was a member
+    on date D" without replaying the history; it is maintained as records
+    are written and can be rebuilt with the rebuild_membership_intervals
+    command.  See sql/groupmembershipinterval.sql for its indexes.
+    """
+    group = models.ForeignKey(BaseGroup, related_name="membership_intervals", verbose_name=_('group'))
+    user = models.ForeignKey(User, related_name="membership_intervals", verbose_name=_('user'))
+    started = models.DateTimeField(_('started'))
+    ended = models.DateTimeField(_('ended'), null=True, blank=True)
+    
+    objects = MembershipIntervalManager()
+
+    def __unicode__(self):
+        return "%s - %s (%s to %s)" % (self.user, self.group, self.started, self.ended or "now")
+
+def update_membership_intervals(rows):
+    """
+    Extends GroupMembershipInterval with a chronological list of
+    GroupMemberRecord rows (see MEMBER_RECORD_COLUMNS): the first record of
+    a membership opens an interval and the membership_end record closes it.
+    Records for memberships that are already open (admin changes etc) are
+    ignored.  Costs one select plus one batched update and insert.
+    """
+    if not rows:
+        return
+    pairs = set([(row[0], row[1]) for row in rows])
+    
+    # intervals already open in the table for anyone in this batch
+    open_ids = {}
+    existing = GroupMembershipInterval.objects.filter(ended__isnull=True,
+                                                      group__in=set([p[0] for p in pairs]),
+                                                      user__in=set([p[1] for p in pairs]))
+    for id, group_id, user_id in existing.values_list('id', 'group', 'user'):
+        if (group_id, user_id) in pairs:
+            open_ids[(group_id, user_id)] = id
+    
+    closed = []         # [ended, id] for intervals already in the table
+    opened = {}         # intervals opened in this batch and not yet closed
+    created = []        # [group_id, user_id, started, ended] to insert
+    for row in rows:
+        pair = (row[0], row[1])
+        when = row[6]
+        if row[7]:
+            if pair in opened:
+                opened.pop(pair)[3] = when
+            elif pair in open_ids:
+                closed.append([when, open_ids.pop(pair)])
+        elif pair not in opened and pair not in open_ids:
+            interval = [row[0], row[1], when, None]
+            opened[pair] = interval
+            created.append(interval)
+    
+    qn = connection.ops.quote_name
+    table = qn(GroupMembershipInterval._meta.db_table)
+    cursor = connection.cursor()
+    if closed:
+        cursor.executemany("UPDATE %s SET %s = %%s WHERE %s = %%s" % (table, qn('ended'), qn('id')),
+                           closed)
+    if created:
+        cursor.executemany("INSERT INTO %s (%s, %s, %s, %s) VALUES (%%s, %%s, %%s, %%s)" % (
+                               table, qn('group_id'), qn('user_id'), qn('started'), qn('ended')),
+                           created)
+
+def buffer_member_records(func):
+    """
+    Decorator for views and jobs that change many memberships at once:
+    snapshots are collected while func runs and written together at the end.
+    """
+    def wrapper(*args, **kwargs):
+        start_member_record_buffer()
+        try:
+            result = func(*args, **kwargs)
+        except:
+            discard_member_records()
+            raise
+        flush_member_records()
+        return result
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+def record_member_snapshot(instance, membership_end=False):
+    """
+    Records a GroupMemberRecord for instance; buffered if a buffer is
+    active in this thread, otherwise saved immediately (see
+    save_member_records).
+    """
+    record_member_rows([_member_record_row(instance, membership_end)])
+
+def record_member_rows(rows):
+    """
+    As record_member_snapshot, for rows already in MEMBER_RECORD_COLUMNS form.
+    """
+    if getattr(_record_buffer, 'depth', 0):
+        _record_buffer.rows.extend(rows)
+    else:
+        save_member_records(rows)
+
 def group_member_snapshot(sender, instance, **kwargs):
     """
     Takes a snapshot of a GroupMember object each time is
     saved.
     """
-    record = GroupMemberRecord(instance=instance)
-    record.save()
+    record_member_snapshot(instance)
 post_save.connect(group_member_snapshot, sender=GroupMember, dispatch_uid='groupmembersnapshot')
 
+def count_new_member(sender, instance, created, **kwargs):
+    if created:
+        adjust_group_count(instance.group_id, 'member_count', 1)
+post_save.connect(count_new_member, sender=GroupMember, dispatch_uid='groupmembercount')
+
+def count_removed_member(sender, instance, **kwargs):
+    adjust_group_count(instance.group_id, 'member_count', -1)
+post_delete.connect(count_removed_member, sender=GroupMember, dispatch_uid='groupmemberdeletecount')
+
 def end_group_member_snapshot(sender, instance, **kwargs):
     """
     Takes the final snapshot of a group member as it is deleted.
     Sets the membership_end = True to signify the end.
     """
-    record = GroupMemberRecord(instance=instance)
-    record.membership_end = True
-    record.save()
+    record_member_snapshot(instance, membership_end=True)
 pre_delete.connect(end_group_member_snapshot, sender=GroupMember, dispatch_uid='endgroupmembersnapshot')
             
 class PendingMember(models.Model):
@@ -360,12 +1074,282 @@ def invitation_notify(sender, instance, created, **kwargs):
 
 post_save.connect(invitation_notify, sender=InvitationToJoinGroup)
     
+class UserMemberships(object):
+    """
+    All of a user's GroupMember and PendingMember objects, loaded with one
+    query each.
+    
+    An instance is kept on the user object (see get_memberships), and since
+    request.user only lives as long as the request, every membership and
+    permission check made while handling a request is answered from memory.
+    """
+    def __init__(self, user):
+        self.generation = _membership_generation()
+        
+        self.members = {}
+        for member in GroupMember.objects.filter(user=user):
+            member.user = user
+            self.members[member.group_id] = member
+            
+        self.pending = {}
+        for pending in PendingMember.objects.filter(user=user):
+            pending.user = user
+            self.pending[pending.group_id] = pending
+    
+    def is_current(self):
+        return self.generation == _membership_generation()
+
+    def get_member(self, group_id):
+        return self.members.get(group_id, None)
+    
+    def get_pending(self, group_id):
+        return self.pending.get(group_id, None)
+
+    def is_member(self, group_id):
+        return group_id in self.members
+
+    def is_pending(self, group_id):
+        return group_id in self.pending
+
+    def is_admin(self, group_id):
+        member = self.members.get(group_id, None)
+        return member is not None and member.is_admin
+
+    def is_admin_of_any(self, group_ids):
+        for group_id in group_ids:
+            if self.is_admin(group_id):
+                return True
+        return False
+
+# a per-thread counter, bumped whenever anyone's memberships change, so that
+# a UserMemberships loaded earlier in the same request knows to reload
+# itself.  A set only lives as long as its request, so changes made by
+# other threads or processes don't need to be seen, and checking is a plain
+# attribute lookup rather than a cache round-trip.
+_memberships_changed = threading.local()
+
+def _membership_generation():
+    return getattr(_memberships_changed, 'generation', 0)
+
+def _bump_membership_generation():
+    _memberships_changed.generation = _membership_generation() + 1
+
+def get_memberships(user):
+    """
+    Returns the (cached) UserMemberships for an authenticated user.
+    """
+    memberships = getattr(user, '_group_memberships', None)
+    if memberships is None or not memberships.is_current():
+        memberships = UserMemberships(user)
+        user._group_memberships = memberships
+    return memberships
+
+def invalidate_memberships(sender, instance, **kwargs):
+    """
+    Marks the UserMemberships loaded so far in this thread as out of date.
+    """
+    _bump_membership_generation()
+post_save.connect(invalidate_memberships, sender=GroupMember, dispatch_uid='groupmemberinvalidate')
+post_delete.connect(invalidate_memberships, sender=GroupMember, dispatch_uid='groupmemberdeleteinvalidate')
+# signals are sent with the concrete class as sender, so each PendingMember
+# subclass needs to be connected separately
+for pending_model in (PendingMember, RequestToJoinGroup, InvitationToJoinGroup):
+    post_save.connect(invalidate_memberships, sender=pending_model)
+    post_delete.connect(invalidate_memberships, sender=pending_model)
+    
+# seconds a user's set of visible groups is cached for
+VISIBLE_GROUPS_CACHE_TIME = 60 * 60
+VISIBLE_GROUPS_GENERATION_KEY = 'visible_groups_generation'
+
+def _visible_groups_key(user_id):
+    # bumping the generation (see invalidate_all_visible_groups) orphans
+    # every user's cached set at once
+    generation = cache.get(VISIBLE_GROUPS_GENERATION_KEY, 0)
+    return 'visible_groups_%d_%d' % (generation, user_id)
+
+def get_visible_group_sets(user):
+    """
+    Returns the ids of the non-public groups an authenticated user can see,
+    as a dict of sets:
+        member: groups they belong to
+        parent_member: 'P' groups whose parent they belong to
+        admin_descendant: groups below one they are an admin of
+    Public ('E') groups are not included; they are visible to everyone and
+    better found by filtering on visibility directly.
+    
+    Cached across requests; invalidated by membership changes for the user
+    and by any group being created, moved, re-scoped or deleted.
+    """
+    key = _visible_groups_key(user.id)
+    sets = cache.get(key)
+    if sets is None:
+        memberships = get_memberships(user)
+        member_ids = set(memberships.members.keys())
+        admin_ids = set([id for id, member in memberships.members.items() if member.is_admin])
+        
+        parent_member_ids = set()
+        if member_ids:
+            parent_member_ids.update(BaseGroup.objects.filter(visibility='P', parent__in=member_ids)
+                                                      .values_list('id', flat=True))
+        admin_descendant_ids = set()
+        if admin_ids:
+            admin_descendant_ids.update(GroupAncestor.objects.filter(ancestor__in=admin_ids, depth__gt=0)
+                                                             .values_list('group', flat=True))
+        
+        sets = {'member': member_ids,
+                'parent_member': parent_member_ids,
+                'admin_descendant': admin_descendant_ids}
+        cache.set(key, sets, VISIBLE_GROUPS_CACHE_TIME)
+    return sets
+
+def visible_groups_q(user, sets=('member', 'parent_member', 'admin_descendant'), field='id'):
+    """
+    The SQL counterpart of get_visible_group_sets: a Q matching rows whose
+    field (a group; 'id' for groups themselves) is in any of the named sets
+    for user.  Made of subqueries on the user's memberships, so the query
+    doesn't grow with the number of groups they can see.
+    """
+    prefix = field != 'id' and '%s__' % field or ''
+    member_ids = GroupMember.objects.filter(user=user).values('group')
+    conditions = []
+    if 'member' in sets:
+        conditions.append(Q(**{'%s__in' % field: member_ids}))
+    if 'parent_member' in sets:
+        conditions.append(Q(**{'%svisibility' % prefix: 'P', '%sparent__in' % prefix: member_ids}))
+    if 'admin_descendant' in sets:
+        admin_ids = GroupMember.objects.filter(user=user, is_admin=True).values('group')
+        descendant_ids = GroupAncestor.objects.filter(ancestor__in=admin_ids, depth__gt=0).values('group')
+        conditions.append(Q(**{'%s__in' % field: descendant_ids}))
+    q = conditions[0]
+    for condition in conditions[1:]:
+        q = q | condition
+    return q
+
+def invalidate_visible_groups(sender, instance, **kwargs):
+    """
+    Drops the cached visible groups of the user whose membership changed.
+    """
+    cache.delete(_visible_groups_key(instance.user_id))
+post_save.connect(invalidate_visible_groups, sender=GroupMember, dispatch_uid='groupmembervisibility')
+post_delete.connect(invalidate_visible_groups, sender=GroupMember, dispatch_uid='groupmemberdeletevisibility')
+
+def invalidate_all_visible_groups(sender=None, instance=None, created=False, signal=None, **kwargs):
+    """
+    Drops everyone's cached visible groups, when a group is created, moved,
+    deleted or has its visibility changed.  Other group saves leave them be.
+    """
+    if signal is post_save and not created:
+        scope = (instance.parent_id, instance.visibility)
+        if scope == getattr(instance, '_saved_scope', None):
+            return
+        instance._saved_scope = scope
+    cache.set(VISIBLE_GROUPS_GENERATION_KEY, cache.get(VISIBLE_GROUPS_GENERATION_KEY, 0) + 1)
+post_save.connect(invalidate_all_visible_groups, sender=BaseGroup)
+post_delete.connect(invalidate_all_visible_groups, sender=BaseGroup)
+
 class GroupLocation(models.Model):
     group = models.ForeignKey(BaseGroup, related_name="locations", verbose_name=_('group'))
     place = models.CharField(max_length=100, null=True, blank=True)
     latitude = models.FloatField(null=True, blank=True)
     longitude = models.FloatField(null=True, blank=True)
 
+# sent for each user whose memberships were changed without going through
+# GroupMember.save() or delete() (see add_members_in_bulk, merge_bulk_user),
+# for apps keeping their own per-user data derived from memberships
+memberships_changed = Signal(providing_args=["user_id"])
+
+def invalidate_user_group_caches(user_id):
+    """
+    Drops the cached memberships and visible groups of a user, for changes
+    made without going through GroupMember.save() or delete().
+    """
+    _bump_membership_generation()
+    cache.delete(_visible_groups_key(user_id))
+    memberships_changed.send(sender=GroupMember, user_id=user_id)
+
+def add_members_in_bulk(group, user_ids):
+    """
+    Adds many users to a group at once as ordinary (non-admin) members, with
+    one multi-row insert, one batch of history records and one change to the
+    group's member total.  Users who are already members are skipped.
+    Returns the ids of the users added.
+    
+    user_ids should be passed a few hundred at a time, as they end up in an
+    IN clause.
+    """
+    existing = set(group.members.filter(user__in=user_ids).values_list('user', flat=True))
+    new_ids = []
+    for user_id in user_ids:
+        if user_id not in existing:
+            existing.add(user_id)
+            new_ids.append(user_id)
+    if not new_ids:
+        return []
+    
+    ops = connection.ops
+    qn = ops.quote_name
+    joined = ops.value_to_db_datetime(datetime.datetime.now())
+    admin_order = GroupMember._meta.get_field('admin_order').default
+    cursor = connection.cursor()
+    cursor.executemany("INSERT INTO %s (%s, %s, %s, %s, %s, %s) VALUES (%%s, %%s, %%s, %%s, %%s, %%s)" % (
+                           qn(GroupMember._meta.db_table), qn('group_id'), qn('user_id'), qn('is_admin'),
+                           qn('admin_title'), qn('admin_order'), qn('joined')),
+                       [[group.id, user_id, False, None, admin_order, joined] for user_id in new_ids])
+    
+    record_member_rows([[group.id, user_id, False, None, admin_order, joined, joined, False]
+                        for user_id in new_ids])
+    adjust_group_count(group.id, 'member_count', len(new_ids))
+    for user_id in new_ids:
+        invalidate_user_group_caches(user_id)
+    return new_ids
+
+def merge_bulk_user(bulk_user, user):
+    """
+    Hands a bulk (mailing list only) user's group memberships over to the
+    real user who has verified the same address, then deletes the bulk user.
+    
+    Works on whole sets rather than membership by membership: memberships in
+    groups the user is not already in are re-pointed with one UPDATE, the
+    rest are deleted with one DELETE, and the history records for the moved
+    memberships are written as one batch.  Must be run inside a transaction
+    (the request's, or see the merge_bulk_users command).
+    """
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    
+    existing_group_ids = list(user.member_groups.values_list('group', flat=True))
+    moving = GroupMember.objects.filter(user=bulk_user).exclude(group__in=existing_group_ids)
+    moving = list(moving.values_list('id', 'group', 'is_admin', 'admin_title', 'admin_order', 'joined'))
+    duplicate_group_ids = list(GroupMember.objects.filter(user=bulk_user, group__in=existing_group_ids)
+                                                  .values_list('group', flat=True))
+    
+    if moving:
+        GroupMember.objects.filter(id__in=[m[0] for m in moving]).update(user=user)
+        ops = connection.ops
+        now = ops.value_to_db_datetime(datetime.datetime.now())
+        record_member_rows([[group_id, user.id, is_admin, admin_title, admin_order,
+                             ops.value_to_db_datetime(joined), now, False]
+                            for id, group_id, is_admin, admin_title, admin_order, joined in moving])
+    
+    if duplicate_group_ids:
+        cursor.execute("DELETE FROM %s WHERE %s = %%s" % (qn(GroupMember._meta.db_table), qn('user_id')),
+                       [bulk_user.id])
+        cursor.execute("UPDATE %s SET %s = %s - 1 WHERE %s IN (%s)" % (
+                           qn(GroupCounts._meta.db_table), qn('member_count'), qn('member_count'),
+                           qn(GroupCounts._meta.pk.column), ", ".join(["%s"] * len(duplicate_group_ids))),
+                       duplicate_group_ids)
+    
+    # the bulk user's history goes with it; clearing it here keeps the
+    # cascade below from loading it row by row
+    for model in (GroupMemberRecord, GroupMembershipInterval):
+        cursor.execute("DELETE FROM %s WHERE %s = %%s" % (qn(model._meta.db_table), qn('user_id')),
+                       [bulk_user.id])
+    
+    for user_id in (bulk_user.id, user.id):
+        invalidate_user_group_caches(user_id)
+    
+    bulk_user.delete()
+
 def clean_up_bulk_users(sender, instance, created, **kwargs):
     if instance.verified:
         # XXX Warning! This only works because get_email_user returns
@@ -373,14 +1357,8 @@ def clean_up_bulk_users(sender, instance, created, **kwargs):
         # users with EmailAddress's with the argument
         email_user = get_email_user(instance.email)
         user = instance.user
-        # a 
-        if not email_user == user:
-            for membership in email_user.member_groups.all():
-                if not user.member_groups.filter(group=membership.group):
-                    membership.user = instance.user
-                    membership.save()
-            # delete old bulk user - should delete GroupMember objects as well
-            email_user.delete()
+        if email_user is not None and email_user != user and email_user.is_bulk:
+            merge_bulk_user(email_user, user)
 
 post_save.connect(clean_up_bulk_users, sender=EmailAddress)
 
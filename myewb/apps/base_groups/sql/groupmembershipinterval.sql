@@ -0,0 +1,4 @@
+-- as-of and time-bucketed membership queries scan a group's intervals by start time
+CREATE INDEX base_groups_groupmembershipinterval_group_started ON base_groups_groupmembershipinterval (group_id, started, ended);
+-- finding a user's open interval in a group when a record is written
+CREATE INDEX base_groups_groupmembershipinterval_user_group ON base_groups_groupmembershipinterval (user_id, group_id, ended);
@@ -11,6 +11,7 @@ Last modified on 2009-07-29
 from django import template
 from django.contrib.contenttypes.models import ContentType
 from group_topics.models import GroupTopic
+from base_groups.helpers import preload_group_memberships
 
 register = template.Library()
 
@@ -46,7 +47,11 @@ class AdminsNode(template.Node):
         except template.VariableDoesNotExist:
             return u''
             
-        admins = group.members.filter(is_admin=True)
+        batch = getattr(group, '_listing_batch', None)
+        if batch is not None:
+            admins = batch.get_admins(group)
+        else:
+            admins = group.members.filter(is_admin=True)
         context[self.context_name] = admins
         return u''
 
@@ -77,13 +82,11 @@ class MembershipNode(template.Node):
             return u''
             
         # membership status
-        if group.user_is_member(user):
-            member = group.members.get(user=user)
-        elif group.user_is_pending_member(user):
-            member = group.pending_members.get(user=user)
+        batch = getattr(group, '_listing_batch', None)
+        if batch is not None and batch.user == user:
+            context[self.context_name] = batch.get_membership(group)
         else:
-            member = None
-        context[self.context_name] = member
+            context[self.context_name] = group.get_membership(user)
         return u''
 
 def do_get_membership(parser, token):
@@ -99,6 +102,40 @@ def do_get_membership(parser, token):
 
 register.tag('get_membership', do_get_membership)
 
+class PreloadMembershipsNode(template.Node):
+    def __init__(self, groups_name, user):
+        self.groups_name = groups_name
+        self.groups = template.Variable(groups_name)
+        self.user = template.Variable(user)
+
+    def render(self, context):
+        try:
+            groups = self.groups.resolve(context)
+            user = self.user.resolve(context)
+        except template.VariableDoesNotExist:
+            return u''
+        
+        # replaces the (paginated) queryset with the evaluated list, so the
+        # groups later tags see are the ones carrying the preloaded data
+        context[self.groups_name] = preload_group_memberships(groups, user)
+        return u''
+
+def do_preload_group_memberships(parser, token):
+    """
+    Provides the template tag {% preload_group_memberships GROUPS USER %}
+    
+    Use after autopaginate on group listings: get_admins and get_membership
+    for the groups on the page then read from memory.
+    """
+    try:
+        _tagname, groups_name, user = token.split_contents()
+    except ValueError:
+        raise template.TemplateSyntaxError(u'%(tagname)r tag syntax is as follows: '
+            '{%% %(tagname)r GROUPS USER %%}' % {'tagname': token.contents.split()[0]})
+    return PreloadMembershipsNode(groups_name, user)
+
+register.tag('preload_group_memberships', do_preload_group_memberships)
+
 # Copied and modified from pinax/apps/topics/templatetags/topics_tags.py
 # (only change is to return list of GroupTopic objects instead of Topic -
 #  needed for tagging to work)
@@ -113,7 +150,8 @@ class GroupTopicsForGroupNode(template.Node):
         except template.VariableDoesNotExist:
             return u''
         content_type = ContentType.objects.get_for_model(group)
-        context[self.context_name] = GroupTopic.objects.get_for_group(group)
+        context[self.context_name] = GroupTopic.objects.sorted_for(context.get('user', None),
+                                                                   GroupTopic.objects.get_for_group(group))
         return u''
 
 def do_get_grouptopics_for_group(parser, token):
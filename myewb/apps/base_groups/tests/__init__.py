@@ -1,11 +1,18 @@
-from django.test import TestCase
+import datetime
 
+from django.test import TestCase
+from django.conf import settings
+from django.core.management import call_command
 from django.contrib.auth.models import User
 
-from base_groups.models import BaseGroup, GroupMember, GroupMemberRecord
+from base_groups.models import BaseGroup, GroupMember, GroupMemberRecord, GroupMembershipInterval, MemberRecordBatch, \
+        start_member_record_buffer, flush_member_records, discard_member_records
 from regression import *
 from visibility import *
 from membership import *
+from ancestry import *
+from counts import *
+from intervals import *
 
 class TestMembershipHistory(TestCase):
     """
@@ -79,3 +86,80 @@ class TestUserDuckPunches(TestCase):
     def test_bulk_user(self):
         u = User.extras.create_bulk_user(username='fred', email='fred@ewb.ca')
         self.assertTrue(u.is_bulk)
+
+class TestBufferedMembershipHistory(TestCase):
+    """
+    Snapshots taken while a buffer is active are only written on flush,
+    with the time of the change rather than the time of the flush.
+    """
+
+    def setUp(self):
+        group_creator = User.objects.create_user('creator', 'c@ewb.ca')
+        self.bg = BaseGroup.objects.create(slug='bg', name='generic base group', creator=group_creator)
+        self.user = User.objects.create_user('user', 'user@ewb.ca')
+
+    def tearDown(self):
+        MemberRecordBatch.objects.all().delete()
+        GroupMembershipInterval.objects.all().delete()
+        GroupMemberRecord.objects.all().delete()
+        GroupMember.objects.all().delete()
+        BaseGroup.objects.all().delete()
+        User.objects.all().delete()
+
+    def test_flush(self):
+        start_member_record_buffer()
+        gm = GroupMember.objects.create(user=self.user, group=self.bg)
+        gm.delete()
+        self.assertEquals(0, GroupMemberRecord.objects.filter(user=self.user, group=self.bg).count())
+        before_flush = datetime.datetime.now()
+        flush_member_records()
+
+        records = GroupMemberRecord.objects.filter(user=self.user, group=self.bg).order_by('id')
+        self.assertEquals(2, records.count())
+        self.assertFalse(records[0].membership_end)
+        self.assertTrue(records[1].membership_end)
+        self.assertTrue(records[1].datetime <= before_flush)
+
+    def test_discard(self):
+        start_member_record_buffer()
+        GroupMember.objects.create(user=self.user, group=self.bg)
+        discard_member_records()
+        flush_member_records()
+        self.assertEquals(0, GroupMemberRecord.objects.filter(user=self.user, group=self.bg).count())
+
+    def test_deferred(self):
+        original = settings.GROUP_MEMBER_RECORDS_DEFERRED
+        settings.GROUP_MEMBER_RECORDS_DEFERRED = True
+        try:
+            start_member_record_buffer()
+            GroupMember.objects.create(user=self.user, group=self.bg)
+            flush_member_records()
+        finally:
+            settings.GROUP_MEMBER_RECORDS_DEFERRED = original
+        self.assertEquals(0, GroupMemberRecord.objects.filter(user=self.user, group=self.bg).count())
+        self.assertEquals(1, MemberRecordBatch.objects.count())
+
+        call_command('drain_member_records')
+        self.assertEquals(1, GroupMemberRecord.objects.filter(user=self.user, group=self.bg).count())
+        self.assertEquals(0, MemberRecordBatch.objects.count())
+
+    def test_deferred_unbuffered(self):
+        # changes made outside a buffer are queued behind the earlier ones
+        original = settings.GROUP_MEMBER_RECORDS_DEFERRED
+        settings.GROUP_MEMBER_RECORDS_DEFERRED = True
+        try:
+            start_member_record_buffer()
+            gm = GroupMember.objects.create(user=self.user, group=self.bg)
+            flush_member_records()
+            gm.delete()
+        finally:
+            settings.GROUP_MEMBER_RECORDS_DEFERRED = original
+        self.assertEquals(0, GroupMemberRecord.objects.filter(user=self.user, group=self.bg).count())
+        self.assertEquals(2, MemberRecordBatch.objects.count())
+
+        call_command('drain_member_records')
+        records = GroupMemberRecord.objects.filter(user=self.user, group=self.bg).order_by('id')
+        self.assertEquals([False, True], [r.membership_end for r in records])
+        intervals = GroupMembershipInterval.objects.filter(user=self.user, group=self.bg)
+        self.assertEquals(1, intervals.count())
+        self.assertNotEquals(None, intervals[0].ended)
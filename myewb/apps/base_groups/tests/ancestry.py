@@ -0,0 +1,39 @@
+from django.test import TestCase
+from django.contrib.auth.models import User
+
+from base_groups.models import BaseGroup, GroupMember, GroupAncestor
+
+class TestGroupAncestry(TestCase):
+    """
+    Tests that GroupAncestor rows follow the parent chain, and that admins
+    of any ancestor are treated as admins of the groups below it.
+    """
+    
+    def setUp(self):
+        self.creator = User.objects.create_user('creator', 'creator@ewb.ca')
+        self.admin = User.objects.create_user('admin', 'admin@ewb.ca')
+        self.national = BaseGroup.objects.create(slug='national', name='national', creator=self.creator)
+        self.chapter = BaseGroup.objects.create(slug='chapter', name='chapter', creator=self.creator,
+                                                parent=self.national)
+        self.community = BaseGroup.objects.create(slug='community', name='community', creator=self.creator,
+                                                  parent=self.chapter, visibility='M')
+
+    def test_ancestor_ids(self):
+        self.assertEquals([self.chapter.id, self.national.id], self.community.get_ancestor_ids())
+        self.assertEquals([], self.national.get_ancestor_ids())
+        self.assertEquals(3, GroupAncestor.objects.filter(ancestor=self.national).count())
+
+    def test_admin_of_grandparent(self):
+        self.assertFalse(self.community.user_is_admin(self.admin))
+        self.assertFalse(self.community.is_visible(self.admin))
+        GroupMember.objects.create(user=self.admin, group=self.national, is_admin=True)
+        self.assertTrue(self.community.user_is_admin(self.admin))
+        self.assertTrue(self.community.is_visible(self.admin))
+
+    def test_move_subtree(self):
+        other = BaseGroup.objects.create(slug='other', name='other', creator=self.creator)
+        self.chapter.parent = other
+        self.chapter.save()
+        community = BaseGroup.objects.get(id=self.community.id)
+        self.assertEquals([self.chapter.id, other.id], community.get_ancestor_ids())
+        self.assertFalse(GroupAncestor.objects.filter(group=self.community, ancestor=self.national))
@@ -0,0 +1,42 @@
+from django.test import TestCase
+from django.contrib.auth.models import User
+
+from base_groups.models import BaseGroup, GroupMember, GroupCounts
+from base_groups.helpers import get_counts
+from group_topics.models import GroupTopic
+
+class TestGroupCounts(TestCase):
+    """
+    Tests that the denormalized member and topic totals follow
+    membership and topic changes.
+    """
+    
+    def setUp(self):
+        self.creator = User.objects.create_user('creator', 'creator@ewb.ca')
+        self.user = User.objects.create_user('user', 'user@ewb.ca')
+        self.bg = BaseGroup.objects.create(slug='bg', name='a base group', creator=self.creator)
+
+    def get_listed(self):
+        return get_counts(BaseGroup.objects.filter(id=self.bg.id), BaseGroup)[0]
+
+    def test_member_count(self):
+        # creator is added automatically
+        self.assertEquals(1, self.get_listed().member_count)
+        gm = self.bg.add_member(self.user)
+        self.assertEquals(2, self.get_listed().member_count)
+        gm.delete()
+        self.assertEquals(1, self.get_listed().member_count)
+
+    def test_topic_count(self):
+        self.assertEquals(0, self.get_listed().topic_count)
+        topic = GroupTopic.objects.create(title='test', body='some test text.',
+                                          group=self.bg, creator=self.creator)
+        self.assertEquals(1, self.get_listed().topic_count)
+        topic.delete()
+        self.assertEquals(0, self.get_listed().topic_count)
+
+    def test_saving_group_keeps_counts(self):
+        self.bg.add_member(self.user)
+        self.bg.description = 'changed'
+        self.bg.save()
+        self.assertEquals(2, GroupCounts.objects.get(pk=self.bg.id).member_count)
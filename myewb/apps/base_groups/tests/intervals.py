@@ -0,0 +1,66 @@
+import datetime
+
+from django.test import TestCase
+from django.core.management import call_command
+from django.contrib.auth.models import User
+
+from base_groups.models import BaseGroup, GroupMember, GroupMembershipInterval
+
+class TestMembershipIntervals(TestCase):
+    """
+    Tests the point-in-time membership queries and the intervals behind them.
+    """
+
+    def setUp(self):
+        self.creator = User.objects.create_user('creator', 'creator@ewb.ca')
+        self.user = User.objects.create_user('user', 'user@ewb.ca')
+        self.bg = BaseGroup.objects.create(slug='bg', name='a base group', creator=self.creator)
+
+    def set_interval(self, started, ended=None):
+        interval = GroupMembershipInterval.objects.get(group=self.bg, user=self.user, ended__isnull=True)
+        interval.started = started
+        interval.ended = ended
+        interval.save()
+
+    def test_intervals_follow_membership(self):
+        gm = GroupMember.objects.create(user=self.user, group=self.bg)
+        gm.is_admin = True
+        gm.save()
+        self.assertEquals(1, GroupMembershipInterval.objects.filter(user=self.user).count())
+        gm.delete()
+        self.assertEquals(0, GroupMembershipInterval.objects.filter(user=self.user, ended__isnull=True).count())
+
+        GroupMember.objects.create(user=self.user, group=self.bg)
+        self.assertEquals(2, GroupMembershipInterval.objects.filter(user=self.user).count())
+
+    def test_as_of(self):
+        GroupMember.objects.create(user=self.user, group=self.bg)
+        self.set_interval(datetime.datetime(2008, 3, 15), datetime.datetime(2009, 1, 10))
+
+        self.assertFalse(self.user in self.bg.members_as_of(datetime.datetime(2008, 1, 1)))
+        self.assertTrue(self.user in self.bg.members_as_of(datetime.datetime(2008, 6, 1)))
+        self.assertFalse(self.user in self.bg.members_as_of(datetime.datetime(2009, 6, 1)))
+        # the creator is still a member
+        self.assertEquals(1, self.bg.member_count_as_of(datetime.datetime.now()))
+
+    def test_monthly_counts(self):
+        GroupMember.objects.create(user=self.user, group=self.bg)
+        self.set_interval(datetime.datetime(2008, 3, 15), datetime.datetime(2008, 5, 10))
+        interval = GroupMembershipInterval.objects.get(group=self.bg, user=self.creator)
+        interval.started = datetime.datetime(2008, 1, 1)
+        interval.save()
+
+        counts = self.bg.monthly_member_counts(datetime.date(2008, 1, 1), datetime.date(2008, 6, 1))
+        self.assertEquals([1, 1, 1, 2, 2, 1], [count for month, count in counts])
+        self.assertEquals(datetime.date(2008, 4, 1), counts[3][0])
+
+    def test_rebuild(self):
+        gm = GroupMember.objects.create(user=self.user, group=self.bg)
+        gm.delete()
+        GroupMember.objects.create(user=self.user, group=self.bg)
+        GroupMembershipInterval.objects.all().delete()
+
+        call_command('rebuild_membership_intervals')
+        self.assertEquals(2, GroupMembershipInterval.objects.filter(user=self.user).count())
+        self.assertEquals(1, GroupMembershipInterval.objects.filter(user=self.user, ended__isnull=True).count())
+        self.assertEquals(1, GroupMembershipInterval.objects.filter(user=self.creator).count())
@@ -2,6 +2,10 @@ from django.test import TestCase
 from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
 
+from emailconfirmation.models import EmailAddress
+
+from base_groups.helpers import preload_group_memberships
+
 from base_groups.models import BaseGroup, GroupMember, PendingMember, \
         InvitationToJoinGroup, RequestToJoinGroup, GroupMemberRecord
 
@@ -74,3 +78,118 @@ class TestRequests(TestCase):
         self.assertFalse(pm.is_invited)
         self.assertTrue(pm.is_requested)
 
+
+class TestMembershipCache(TestCase):
+    """
+    Tests that the per-user membership cache used for permission checks
+    notices changes made after it was loaded.
+    """
+    
+    def setUp(self):
+        self.creator = User.objects.create_user(username='creator', email='creator@ewb.ca')
+        self.bg = BaseGroup.objects.create(slug='bg', description='a test base_group', creator=self.creator)
+        self.user = User.objects.create_user(username='user', email='user@ewb.ca')
+
+    def test_join_and_leave(self):
+        self.assertFalse(self.bg.user_is_member(self.user))
+        self.assertEquals(None, self.bg.get_membership(self.user))
+
+        gm = GroupMember.objects.create(user=self.user, group=self.bg)
+        self.assertTrue(self.bg.user_is_member(self.user))
+        self.assertEquals(gm.id, self.bg.get_membership(self.user).id)
+        self.assertFalse(self.bg.user_is_admin(self.user))
+
+        gm.is_admin = True
+        gm.save()
+        self.assertTrue(self.bg.user_is_admin(self.user))
+
+        gm.delete()
+        self.assertFalse(self.bg.user_is_member(self.user))
+        self.assertFalse(self.bg.user_is_admin(self.user))
+
+    def test_pending(self):
+        self.assertFalse(self.bg.user_is_member_or_pending(self.user))
+        RequestToJoinGroup.objects.create(user=self.user, group=self.bg, message='let me in')
+        self.assertTrue(self.bg.user_is_pending_member(self.user))
+        self.assertTrue(self.bg.user_is_member_or_pending(self.user))
+        self.assertTrue(isinstance(self.bg.get_membership(self.user), PendingMember))
+
+class TestMemberEmails(TestCase):
+    """
+    Tests the member address expansion used for group mail.
+    """
+
+    def setUp(self):
+        self.creator = User.objects.create_user('creator', 'creator@ewb.ca')
+        self.bg = BaseGroup.objects.create(slug='bg', name='a base group', creator=self.creator)
+
+    def test_prefers_primary_address(self):
+        user = User.objects.create_user('user', 'old@ewb.ca')
+        EmailAddress.objects.create(user=user, email='new@ewb.ca', verified=True, primary=True)
+        self.bg.add_member(user)
+        self.assertEquals(['creator@ewb.ca', 'new@ewb.ca'], self.bg.get_member_emails())
+
+    def test_bulk_and_duplicates(self):
+        bulk = User.extras.create_bulk_user(username='bulk', email='bulk@ewb.ca')
+        self.bg.add_member(bulk)
+        # same address under different case
+        other = User.objects.create_user('other', 'Creator@ewb.ca')
+        self.bg.add_member(other)
+        self.assertEquals(['bulk@ewb.ca', 'creator@ewb.ca'],
+                          [email.lower() for email in self.bg.get_member_emails()])
+
+class TestBulkUserMerge(TestCase):
+    """
+    Tests handing a bulk user's memberships over to the real user who
+    verifies the same address.
+    """
+
+    def setUp(self):
+        self.creator = User.objects.create_user('creator', 'creator@ewb.ca')
+        self.bg = BaseGroup.objects.create(slug='bg', name='a base group', creator=self.creator)
+        self.bg2 = BaseGroup.objects.create(slug='bg2', name='another base group', creator=self.creator)
+        self.bulk = User.extras.create_bulk_user(username='bulk', email='bulk@ewb.ca')
+        self.bg.add_member(self.bulk)
+        self.bg2.add_member(self.bulk)
+        self.user = User.objects.create_user('user', 'user@ewb.ca')
+        self.bg2.add_member(self.user)
+
+    def test_merge_on_verify(self):
+        EmailAddress.objects.create(user=self.user, email='bulk@ewb.ca', verified=True, primary=False)
+
+        self.assertRaises(User.DoesNotExist, User.objects.get, id=self.bulk.id)
+        self.assertTrue(self.bg.user_is_member(self.user))
+        self.assertEquals(1, self.bg2.members.filter(user=self.user).count())
+        # the moved membership is recorded for the real user
+        self.assertEquals(1, GroupMemberRecord.objects.filter(user=self.user, group=self.bg).count())
+        self.assertEquals(2, self.bg.members.count())
+        self.assertEquals(2, self.bg2.members.count())
+
+    def test_real_users_not_merged(self):
+        other = User.objects.create_user('other', 'other@ewb.ca')
+        EmailAddress.objects.create(user=self.user, email='other@ewb.ca', verified=True, primary=False)
+        self.assertTrue(User.objects.filter(id=other.id).count())
+
+class TestGroupListingBatch(TestCase):
+    """
+    Tests the shared membership data attached to a page of groups.
+    """
+
+    def setUp(self):
+        self.creator = User.objects.create_user('creator', 'creator@ewb.ca')
+        self.user = User.objects.create_user('user', 'user@ewb.ca')
+        self.bg = BaseGroup.objects.create(slug='bg', name='a base group', creator=self.creator)
+        self.bg2 = BaseGroup.objects.create(slug='bg2', name='another base group', creator=self.user)
+        self.bg.add_member(self.user)
+
+    def test_batch(self):
+        groups = preload_group_memberships(BaseGroup.objects.filter(id__in=[self.bg.id, self.bg2.id]),
+                                           self.user)
+        by_slug = dict([(group.slug, group) for group in groups])
+        batch = by_slug['bg']._listing_batch
+        self.assertTrue(batch is by_slug['bg2']._listing_batch)
+
+        self.assertEquals([self.creator], [admin.user for admin in batch.get_admins(by_slug['bg'])])
+        self.assertEquals([self.user], [admin.user for admin in batch.get_admins(by_slug['bg2'])])
+        self.assertFalse(batch.get_membership(by_slug['bg']).is_admin)
+        self.assertTrue(batch.get_membership(by_slug['bg2']).is_admin)
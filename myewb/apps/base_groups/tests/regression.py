@@ -1,7 +1,7 @@
 from django.test import TestCase
 from django.contrib.auth.models import User, AnonymousUser
 
-from base_groups.models import BaseGroup
+from base_groups.models import BaseGroup, allocate_group_slug
 
 class TestAddCreatorToGroup(TestCase):
     """
@@ -49,3 +49,26 @@ class TestAddBulkMemberToGroup(TestCase):
         group.add_member(u)
         new_member = group.members.get(user=u)
         self.assertTrue(new_member.is_accepted)
+
+class TestSlugAllocation(TestCase):
+    """
+    New groups get the first free numeric suffix when their slug is taken,
+    regardless of which group model holds the clashing slug.
+    """
+
+    def setUp(self):
+        self.u = User.objects.create_user('user', 'user@ewb.ca', 'password')
+
+    def test_suffixes(self):
+        first = BaseGroup.objects.create(slug='ewb', name='one', creator=self.u)
+        second = BaseGroup.objects.create(slug='ewb', name='two', creator=self.u)
+        third = BaseGroup.objects.create(slug='ewb', name='three', creator=self.u)
+        self.assertEquals(['ewb', 'ewb1', 'ewb2'], [first.slug, second.slug, third.slug])
+
+    def test_similar_slugs_ignored(self):
+        BaseGroup.objects.create(slug='ewb-uwaterloo', name='waterloo', creator=self.u)
+        BaseGroup.objects.create(slug='myewb', name='myewb', creator=self.u)
+        self.assertEquals('ewb', allocate_group_slug('ewb'))
+
+    def test_exclude(self):
+        self.assertEquals('ewb1', allocate_group_slug('ewb', exclude=['ewb']))
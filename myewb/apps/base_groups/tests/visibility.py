@@ -1,7 +1,9 @@
 from django.test import TestCase
 from django.contrib.auth.models import User, AnonymousUser
+from django.core.cache import cache
 
-from base_groups.models import BaseGroup
+from base_groups.models import BaseGroup, VISIBLE_GROUPS_GENERATION_KEY
+from base_groups.helpers import enforce_visibility
 
 class TestVisibility(TestCase):
     def setUp(self):
@@ -38,3 +40,53 @@ class TestVisibility(TestCase):
         self.assertTrue(self.bg.is_visible(self.u), 'Creator should be able to see private group.')
         self.assertTrue(self.bg.is_visible(self.u2), 'Member should be able to see private group.')
         self.assertFalse(self.bg.is_visible(self.u3), 'Non-member should not be able to see private group.')
+
+class TestEnforceVisibility(TestCase):
+    """
+    Tests enforce_visibility, and when the cached visible-group sets are
+    dropped.
+    """
+
+    def setUp(self):
+        self.u = User.objects.create_user('user', 'user@ewb.ca', 'password')
+        self.u2 = User.objects.create_user('user2', 'user2@ewb.ca', 'password')
+        self.parent = BaseGroup.objects.create(slug='parent', name='a parent group', creator=self.u)
+        self.private = BaseGroup.objects.create(slug='private', name='a private group', creator=self.u,
+                                                visibility='M', parent=self.parent)
+
+    def visible_to(self, user):
+        return list(enforce_visibility(BaseGroup.objects.all(), user))
+
+    def test_membership_changes(self):
+        self.assertFalse(self.private in self.visible_to(self.u2))
+        member = self.private.add_member(self.u2)
+        self.assertTrue(self.private in self.visible_to(self.u2))
+        member.delete()
+        self.assertFalse(self.private in self.visible_to(self.u2))
+
+    def test_visibility_changes(self):
+        self.parent.add_member(self.u2)
+        self.assertFalse(self.private in self.visible_to(self.u2))
+        self.private.visibility = 'P'
+        self.private.save()
+        self.assertTrue(self.private in self.visible_to(self.u2))
+
+    def test_parent_admin(self):
+        self.parent.add_member(self.u2)
+        self.assertFalse(self.private in self.visible_to(self.u2))
+        member = self.parent.members.get(user=self.u2)
+        member.is_admin = True
+        member.save()
+        self.assertTrue(self.private in self.visible_to(self.u2))
+
+    def test_anonymous(self):
+        self.assertEquals([self.parent], self.visible_to(AnonymousUser()))
+
+    def test_unrelated_saves_keep_cache(self):
+        generation = cache.get(VISIBLE_GROUPS_GENERATION_KEY, 0)
+        self.private.name = 'a renamed private group'
+        self.private.save()
+        self.assertEquals(generation, cache.get(VISIBLE_GROUPS_GENERATION_KEY, 0))
+        self.private.visibility = 'P'
+        self.private.save()
+        self.assertNotEquals(generation, cache.get(VISIBLE_GROUPS_GENERATION_KEY, 0))
@@ -28,7 +28,6 @@ if "notification" in settings.INSTALLED_APPS:
 else:
     notification = None
     
-from wiki.models import Article
 
 def groups_index(request, model=None, member_model=None, form_class=None,
                  template_name='base_groups/groups_index.html',
@@ -152,26 +151,14 @@ def group_detail(request, group_slug, model=None, member_model=None,
     # get group
     group = get_object_or_404(model, slug=group_slug)
 
-    # membership status
-    if group.user_is_member(request.user):
-        member = group.members.get(user=request.user)
-    elif group.user_is_pending_member(request.user):
-        member = group.pending_members.get(user=request.user)
-    else:
-        member = None
-        
-    # retrieve whiteboard (create if needed)
-    if group.whiteboard == None:
-        wb = Article(title="Whiteboard", content="")
-        group.associate(wb, commit=False)
-        wb.save()
-        group.whiteboard = wb
-        group.save()
+    # the whiteboard isn't created until someone first edits it
+    # (see BaseGroup.get_whiteboard)
         
     # see if any admin tasks are outstanding
     # (should this only trigger for oustanding requets, instead of requests & invitations?)
     requests_outstanding = False
-    if group.user_is_admin(request.user):
+    is_admin = group.user_is_admin(request.user)
+    if is_admin:
         if group.num_pending_members() > 0:
             requests_outstanding = True
     
@@ -181,7 +168,7 @@ def group_detail(request, group_slug, model=None, member_model=None,
         {
             'group': group,                
             'children': group.get_visible_children(request.user),
-            'is_admin': group.user_is_admin(request.user),
+            'is_admin': is_admin,
             'requests_outstanding': requests_outstanding
         },
         context_instance=RequestContext(request)
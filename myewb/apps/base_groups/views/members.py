@@ -18,10 +18,12 @@ from django.contrib.contenttypes.models import ContentType
 from django.utils.datastructures import SortedDict
 from django.utils.translation import ugettext_lazy as _
 from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
+from django.db.models import Q
 
 from base_groups.models import BaseGroup, GroupMember, PendingMember, InvitationToJoinGroup, RequestToJoinGroup
 from base_groups.forms import GroupMemberForm, EditGroupMemberForm
 from base_groups.decorators import own_member_object_required, group_admin_required, visibility_required
+from search_index.models import tokenize, matching_ids
 
 @visibility_required()
 def members_index(request, group_slug, group_model=None, form_class=None,
@@ -52,10 +54,22 @@ def members_index(request, group_slug, group_model=None, form_class=None,
     # filter by search terms if rovided
     search_terms = request.GET.get('search', '')
     if search_terms:
-        members = members.filter(user__profile__name__icontains=search_terms) | \
-                        members.filter(user__username__icontains=search_terms) | \
-                        members.filter(is_admin=True, admin_title__icontains=search_terms) | \
-                        members.filter(user__email__icontains=search_terms)
+        # every word has to match the member's name or username, or their
+        # admin title in this group; or the search is part of their email
+        # (not indexed, so that the public profile search can't be used to
+        # look up addresses; the scan is limited to this group's members)
+        matches = Q(user__email__icontains=search_terms)
+        by_name = None
+        for term in tokenize(search_terms):
+            term_matches = Q(user__in=matching_ids(User, term)) | \
+                           Q(id__in=matching_ids(GroupMember, term, scope=group.id))
+            if by_name is None:
+                by_name = term_matches
+            else:
+                by_name = by_name & term_matches
+        if by_name is not None:
+            matches = matches | by_name
+        members = members.filter(matches)
                         
     # show listing
     return render_to_response(
@@ -226,11 +240,8 @@ def member_detail(request, group_slug, username, group_model=None,
     # retrieve basic objects
     group = get_object_or_404(group_model, slug=group_slug)
     other_user = get_object_or_404(User, username=username)
-    if group.user_is_member(other_user):
-        member = get_object_or_404(GroupMember, group=group, user=other_user)
-    elif group.user_is_pending_member(other_user):
-        member = get_object_or_404(PendingMember, group=group, user=other_user)
-    else:
+    member = group.get_membership(other_user)
+    if member is None:
         raise Http404
 
     user = request.user
@@ -291,14 +302,10 @@ def delete_member(request, group_slug, username, group_model=None):
         # load up objects
         group = get_object_or_404(group_model, slug=group_slug)
         user = get_object_or_404(User, username=username)
-        was_pending = False
-        if group.user_is_member(user):
-            member = get_object_or_404(GroupMember, group=group, user=user)
-        elif group.user_is_pending_member(user):
-            member = get_object_or_404(PendingMember, group=group, user=user)
-            was_pending = True
-        else:
+        member = group.get_membership(user)
+        if member is None:
             raise Http404
+        was_pending = isinstance(member, PendingMember)
         
         # delete it.  how, that was hard...
         member.delete()
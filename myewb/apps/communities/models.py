@@ -8,8 +8,9 @@ Created on 2009-07-30
 @author Joshua Gorner, Benjamin Best
 """
 from django.core.urlresolvers import reverse
-from django.db.models.signals import post_save
-from base_groups.models import BaseGroup, GroupMember, add_creator_to_group
+from django.db.models.signals import post_save, post_delete
+from base_groups.models import BaseGroup, GroupMember, add_creator_to_group, update_group_ancestry, \
+        invalidate_all_visible_groups
 
 class Community(BaseGroup):
     def get_absolute_url(self):
@@ -21,5 +22,8 @@ class Community(BaseGroup):
         
     class Meta:
         verbose_name_plural = "communities"
-# use same add_creator_to_group from base_groups
+# use same add_creator_to_group, update_group_ancestry and invalidate_all_visible_groups from base_groups
 post_save.connect(add_creator_to_group, sender=Community)
+post_save.connect(update_group_ancestry, sender=Community)
+post_save.connect(invalidate_all_visible_groups, sender=Community)
+post_delete.connect(invalidate_all_visible_groups, sender=Community)
@@ -25,6 +25,7 @@ from base_groups.models import BaseGroup, GroupMember, GroupLocation
 from base_groups.forms import GroupMemberForm, GroupInviteForm, EditGroupMemberForm, GroupLocationForm
 from base_groups.helpers import *
 from base_groups.decorators import group_admin_required
+from siteutils.pagecache import anonymous_page_cache
 
 INDEX_TEMPLATE = 'communities/communities_index.html'
 NEW_TEMPLATE = 'communities/new_community.html'
@@ -52,6 +53,7 @@ def new_community(request, form_class=CommunityForm, template_name=NEW_TEMPLATE,
     parent = request.GET.get('parent', None)
     return new_group(request, Community, GroupMember, form_class, template_name, index_template_name, DEFAULT_OPTIONS, parent)
 
+@anonymous_page_cache('group:%(group_slug)s')
 def community_detail(request, group_slug, form_class=CommunityForm, template_name=DETAIL_TEMPLATE,
         edit_template_name=EDIT_TEMPLATE):
     return group_detail(request, group_slug, Community, GroupMember, form_class, template_name, edit_template_name, DEFAULT_OPTIONS)
@@ -6,6 +6,7 @@ from django.contrib.contenttypes import generic
 from django.utils.translation import ugettext_lazy as _
 
 from wiki.models import Article
+from whiteboard.helpers import empty_whiteboard
 
 class Event(models.Model):
     ''' Simple event-tag with owner and content_object + meta_data '''
@@ -30,6 +31,13 @@ class Event(models.Model):
     def __unicode__(self):
         return "%s, %s" % (self.slug, self.start.date())
 
+    def get_whiteboard(self):
+        """
+        The event's whiteboard, or an empty unsaved one if nobody has written
+        it yet (it is created on first edit).
+        """
+        return self.whiteboard or empty_whiteboard("Event%d" % self.id)
+
     @models.permalink
     def get_absolute_url(self):
         ''' should be /events/<id>/slug/'''
@@ -12,7 +12,6 @@ from django.template import RequestContext
 from base_groups.models import BaseGroup
 from events.models import Event
 from events.forms import EventForm#, EventAddForm
-from wiki.models import Article
 
 from django.contrib.auth.models import User
 
@@ -90,23 +89,10 @@ def detail(request, id, slug):
     if not helpers.is_visible(request.user, parent):
         return render_to_response('denied.html', context_instance=RequestContext(request))
 
-    # create whiteboard if needed
-    member = False
-    if event.whiteboard == None:
-        # this will fail if the event's parent is not a group... 
-        # so, only events attached to a group can have a whiteboard.
-        try:
-            method = getattr(event.content_object, "associate")
-            wb = Article(title="Event%d" % (event.id), content="")
-            event.content_object.associate(wb, commit=False)
-            wb.save()
-            event.whiteboard = wb
-            event.save()
-            
-            # FIXME: we assume if you can see the event, you can edit it
-            member = True
-        except:
-            pass
+    # only events attached to a group can have a whiteboard, which is
+    # created the first time someone edits it (see Event.get_whiteboard)
+    # FIXME: we assume if you can see the event, you can edit it
+    member = hasattr(parent, "associate")
 
     return render_to_response("events/event_detail.html",
                                { 'object': event,
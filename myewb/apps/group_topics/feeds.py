@@ -21,9 +21,44 @@ from datetime import datetime
 from friends.models import friend_set_for
 from django.contrib.contenttypes.models import ContentType
 from base_groups.urls import bridge as temp_bridge
+from profiles.models import MemberProfile
 
 ITEMS_PER_FEED = getattr(settings, 'PINAX_ITEMS_PER_FEED', 20)
 
+# We return an arbitrary date if there are no results, because there
+# must be a feed_updated field as per the Atom specifications, however
+# there is no real data to go by, and an arbitrary date can be static.
+EMPTY_FEED_UPDATED = datetime(year=2008, month=7, day=1)
+
+def with_author_names(topics):
+    """
+    Loads a feed's posts, along with their authors' names in one query
+    rather than a profile lookup per post.
+    """
+    topics = list(topics)
+    names = dict(MemberProfile.objects.filter(user__in=set([t.creator_id for t in topics]))
+                                      .values_list('user', 'name'))
+    for topic in topics:
+        topic.author_name = names.get(topic.creator_id, None)
+    return topics
+
+def latest_created(topics):
+    created = list(topics.order_by('-created').values_list('created', flat=True)[:1])
+    if not created:
+        return EMPTY_FEED_UPDATED
+    return created[0]
+
+_group_models = {}
+
+def group_model(name):
+    """
+    The model class for a BaseGroup.model name, looked up once.
+    """
+    name = name.lower()
+    if name not in _group_models:
+        _group_models[name] = ContentType.objects.get(model=name).model_class()
+    return _group_models[name]
+
 class BaseTopicFeed(Feed):
     def item_id(self, topic):
         return "http://%s%s" % (
@@ -47,7 +82,10 @@ class BaseTopicFeed(Feed):
         return [{"href" : self.item_id(topic)}]
     
     def item_authors(self, topic):
-        return [{"name" : topic.creator.get_profile().name}]
+        name = getattr(topic, 'author_name', None)
+        if name is None:
+            name = topic.creator.get_profile().name
+        return [{"name" : name}]
 
 class TopicFeedAll(BaseTopicFeed):
     def feed_id(self):
@@ -58,13 +96,7 @@ class TopicFeedAll(BaseTopicFeed):
         return 'Post feed for all groups'
 
     def feed_updated(self):
-        qs = GroupTopic.objects.filter(parent_group__visibility='E')
-        # We return an arbitrary date if there are no results, because there
-        # must be a feed_updated field as per the Atom specifications, however
-        # there is no real data to go by, and an arbitrary date can be static.
-        if qs.count() == 0:
-            return datetime(year=2008, month=7, day=1)
-        return qs.latest('created').created
+        return latest_created(GroupTopic.objects.filter(parent_group__visibility='E'))
 
     def feed_links(self):
         absolute_url = reverse('home')
@@ -75,7 +107,7 @@ class TopicFeedAll(BaseTopicFeed):
         return ({'href': complete_url},)
 
     def items(self):
-        return GroupTopic.objects.filter(parent_group__visibility='E').order_by("-created")[:ITEMS_PER_FEED]
+        return with_author_names(GroupTopic.objects.filter(parent_group__visibility='E').order_by("-created")[:ITEMS_PER_FEED])
 
 class TopicFeedGroup(BaseTopicFeed):
     def get_object(self, params):
@@ -89,18 +121,13 @@ class TopicFeedGroup(BaseTopicFeed):
         return 'Post feed for %s %s' % (group.model.lower(), group.slug)
 
     def feed_updated(self, group):
-        qs = GroupTopic.objects.filter(object_id=group.id)
-        # We return an arbitrary date if there are no results, because there
-        # must be a feed_updated field as per the Atom specifications, however
-        # there is no real data to go by, and an arbitrary date can be static.
-        if qs.count() == 0:
-            return datetime(year=2008, month=7, day=1)
-        return qs.latest('created').created
+        return latest_created(GroupTopic.objects.filter(object_id=group.id))
 
     def feed_links(self, group):
-        model = ContentType.objects.get(model=group.model.lower()).model_class()
-        group = model.objects.get(slug=group.slug)
-        absolute_url = group.content_bridge.reverse("topic_list", group)
+        # the bridge belongs to the group's own model (Network etc.), but
+        # only needs the slug, so group itself can stay a BaseGroup
+        model = group_model(group.model)
+        absolute_url = model.content_bridge.reverse("topic_list", group)
         complete_url = "http://%s%s" % (
                 Site.objects.get_current().domain,
                 absolute_url,
@@ -110,4 +137,4 @@ class TopicFeedGroup(BaseTopicFeed):
     def items(self, group):
         # NOTE: security needs to be handled elsewhere!!!
         # (ie, currently, in group_topics.views.feed())
-        return GroupTopic.objects.filter(object_id=group.id).order_by("-created")[:ITEMS_PER_FEED]
+        return with_author_names(GroupTopic.objects.filter(object_id=group.id).order_by("-created")[:ITEMS_PER_FEED])
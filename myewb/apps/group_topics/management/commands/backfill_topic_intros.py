@@ -0,0 +1,30 @@
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from group_topics.models import GroupTopic, make_intro
+
+# posts loaded and updated per transaction
+BATCH_SIZE = 200
+
+
+class Command(NoArgsCommand):
+    help = "Stores the listing intro of posts saved before intros were stored."
+
+    def handle_noargs(self, **options):
+        done = 0
+        while True:
+            topic_ids = list(GroupTopic.objects.filter(intro_html__isnull=True)
+                                               .values_list('id', flat=True)[:BATCH_SIZE])
+            if not topic_ids:
+                break
+            self.backfill(topic_ids)
+            done += len(topic_ids)
+        return 'Stored intros for %d posts.' % done
+
+    @transaction.commit_on_success
+    def backfill(self, topic_ids):
+        for id, body in GroupTopic.objects.filter(id__in=topic_ids).values_list('id', 'body'):
+            intro_html, intro_truncated = make_intro(body)
+            # update() rather than save(), so that the posts aren't bumped
+            # or re-cleaned
+            GroupTopic.objects.filter(id=id).update(intro_html=intro_html, intro_truncated=intro_truncated)
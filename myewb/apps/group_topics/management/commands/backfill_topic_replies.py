@@ -0,0 +1,34 @@
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from group_topics.models import GroupTopic, topic_reply_stats
+
+# posts loaded and updated per transaction
+BATCH_SIZE = 200
+
+
+class Command(NoArgsCommand):
+    help = "Recomputes the latest reply time, reply count and latest replier of every post, " \
+           "for posts saved before these were stored."
+
+    def handle_noargs(self, **options):
+        done = 0
+        last_id = 0
+        while True:
+            topic_ids = list(GroupTopic.objects.filter(id__gt=last_id).order_by('id')
+                                               .values_list('id', flat=True)[:BATCH_SIZE])
+            if not topic_ids:
+                break
+            self.backfill(topic_ids)
+            done += len(topic_ids)
+            last_id = topic_ids[-1]
+        return 'Stored reply details for %d posts.' % done
+
+    @transaction.commit_on_success
+    def backfill(self, topic_ids):
+        for id, created in GroupTopic.objects.filter(id__in=topic_ids).values_list('id', 'created'):
+            last_reply_at, reply_count, last_replier_id = topic_reply_stats(id)
+            # update() rather than save(), so that the posts aren't bumped
+            GroupTopic.objects.filter(id=id).update(last_reply_at=last_reply_at or created,
+                                                    reply_count=reply_count,
+                                                    last_replier=last_replier_id)
@@ -0,0 +1,15 @@
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from group_topics.models import TopicTimeline, TopicTimelineEntry, build_public_timeline
+
+
+class Command(NoArgsCommand):
+    help = "Rebuilds the public front page timeline and marks every user's timeline as out of date."
+
+    @transaction.commit_on_success
+    def handle_noargs(self, **options):
+        build_public_timeline()
+        TopicTimeline.objects.all().delete()
+        TopicTimelineEntry.objects.filter(user__isnull=False).delete()
+        return 'Rebuilt the public timeline; user timelines will be rebuilt as they are read.'
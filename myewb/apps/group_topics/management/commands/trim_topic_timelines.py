@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.management.base import NoArgsCommand
+from django.db import connection, transaction
+
+from group_topics.models import TopicTimelineEntry
+
+
+class Command(NoArgsCommand):
+    help = "Cuts the stored front page timelines back to TOPIC_TIMELINE_LENGTH posts."
+
+    @transaction.commit_on_success
+    def handle_noargs(self, **options):
+        length = settings.TOPIC_TIMELINE_LENGTH
+        qn = connection.ops.quote_name
+        table = qn(TopicTimelineEntry._meta.db_table)
+        cursor = connection.cursor()
+        
+        cursor.execute("SELECT %s FROM %s GROUP BY %s HAVING COUNT(*) > %%s" % (
+                           qn('user_id'), table, qn('user_id')),
+                       [length])
+        user_ids = [row[0] for row in cursor.fetchall()]
+        
+        for user_id in user_ids:
+            entries = TopicTimelineEntry.objects.all()
+            if user_id is None:
+                entries = entries.filter(user__isnull=True)
+                where = "%s IS NULL" % qn('user_id')
+                params = []
+            else:
+                entries = entries.filter(user=user_id)
+                where = "%s = %%s" % qn('user_id')
+                params = [user_id]
+            cutoff = entries.order_by('-modified').values_list('modified', flat=True)[length - 1]
+            cursor.execute("DELETE FROM %s WHERE %s AND %s < %%s" % (table, where, qn('modified')),
+                           params + [connection.ops.value_to_db_datetime(cutoff)])
+        if user_ids:
+            # raw SQL, which commit_on_success can't see
+            transaction.set_dirty()
+        
+        return 'Trimmed %d timelines.' % len(user_ids)
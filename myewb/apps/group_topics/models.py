@@ -8,23 +8,91 @@ Created on: 2009-08-13
 @author: Joshua Gorner
 """
 
-from django.db import models
+import datetime
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import models, connection, transaction, IntegrityError
 from django.db.models import Q
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.utils.translation import ugettext_lazy as _
 from django.core.urlresolvers import reverse
 from django.template import Context, loader
+from django.utils.html import strip_tags
 
 from attachments.models import Attachment
-from base_groups.models import BaseGroup
+from attachments_extra.helpers import download_token
+from base_groups.models import BaseGroup, GroupMember, GroupMailing, adjust_group_count, get_visible_group_sets, \
+        visible_groups_q, memberships_changed
 from base_groups.helpers import user_can_adminovision, user_can_execovision
+from communities.models import Community
+from networks.models import Network
+from profiles.models import adjust_activity_count
+from search_index.models import register
+from siteutils.pagecache import invalidate_anonymous_pages
+from threadedcomments.models import ThreadedComment
 from topics.models import Topic
 from wiki.models import Article
+from whiteboard.helpers import empty_whiteboard
 
 from lxml.html.clean import clean_html, autolink_html, Cleaner
 
+# listings show the first INTRO_LENGTH characters of a post
+INTRO_LENGTH = 600
+
+# disable it all except page_structure, as proper cleaning is done on save;
+# here we just want to fix any dangling tags caused by truncation
+INTRO_CLEANER = Cleaner(scripts=False,
+                        javascript=False,
+                        comments=False,
+                        links=False,
+                        meta=False,
+                        #page_stricture=True,
+                        embedded=False,
+                        frames=False,
+                        forms=False,
+                        annoying_tags=False,
+                        remove_unknown_tags=False,
+                        safe_attrs_only=False)
+
+def make_intro(body):
+    """
+    Returns the excerpt of a (cleaned) post body shown in listings, and
+    whether it was cut short.
+    """
+    if len(body) < INTRO_LENGTH:
+        return body, False
+
+    # thanks http://stackoverflow.com/questions/250357/smart-truncate-in-python
+    intro = body[:INTRO_LENGTH].rsplit(' ', 1)[0]
+    intro = INTRO_CLEANER.clean_html(intro)
+    intro += "..."
+    return intro, True
+
 class GroupTopicManager(models.Manager):
 
+    def member_group_sets(self, user):
+        """
+        The names of the get_visible_group_sets sets whose posts user sees
+        on top of public groups' ones (none for anonymous users), or None if
+        they see every post (admin-o-vision).
+        """
+        if user is None or user.is_anonymous():
+            return ()
+        
+        # admins with admin-o-vision on automatically see everything
+        if user_can_adminovision(user) and user.get_profile().adminovision == 1:
+            return None
+        
+        # everyone else only sees stuff from their own groups, and similar
+        # for exec-o-vision, except only for your own chapter's groups (and
+        # anything nested below them)
+        if user_can_execovision(user) and user.get_profile().adminovision == 1:
+            return ('member', 'admin_descendant')
+        return ('member',)
+
     def visible(self, user=None):
         """
         Returns visible posts by group visibility. Takes an optional
@@ -32,24 +100,53 @@ class GroupTopicManager(models.Manager):
         member is a part of. Handles AnonymousUser instances
         transparently
         """
+        names = self.member_group_sets(user)
+        if names is None:
+            return self.get_query_set()
+        
         filter_q = Q(parent_group__visibility='E')
+        if names:
+            filter_q |= visible_groups_q(user, names, field='parent_group')
+
+        # both conditions are on the topic's own parent_group, so no
+        # distinct() is needed
+        return self.get_query_set().filter(filter_q)
+    
+    def visible_groups(self, user=None):
+        """
+        The groups whose posts visible() returns, as a (values) queryset of
+        ids for use as a subquery, or None for all of them: for narrowing
+        down things filed by group, such as the search index.
+        """
+        names = self.member_group_sets(user)
+        if names is None:
+            return None
+        filter_q = Q(visibility='E')
+        if names:
+            filter_q |= visible_groups_q(user, names)
+        return BaseGroup.objects.filter(filter_q).values('id')
+    
+    def timeline(self, user=None):
+        """
+        Returns the same posts as visible(), but read from the stored
+        timelines (see TopicTimelineEntry) rather than worked out from the
+        user's groups.  The user's own and the public timeline are read in a
+        subquery, so the page is limited in SQL; trim_topic_timelines keeps
+        them to about TOPIC_TIMELINE_LENGTH posts each.
+        Admin-o-vision and exec-o-vision are not kept in timelines, so users
+        with either turned on get visible() instead.
+        """
+        entries = TopicTimelineEntry.objects.filter(user__isnull=True)
         if user is not None and not user.is_anonymous():
+            if user.get_profile().adminovision == 1 and \
+                    (user_can_adminovision(user) or user_can_execovision(user)):
+                return self.visible(user)
             
-            # admins with admin-o-vision on automatically see everything
-            if user_can_adminovision(user) and user.get_profile().adminovision == 1:
-                return self.get_query_set()
-            
-            # and similar for exec-o-vision, except only for your own chapter's groups
-            if user_can_execovision(user) and user.get_profile().adminovision == 1:
-                filter_q |= Q(parent_group__parent__members__user=user,
-                              parent_group__parent__members__is_admin=True)
-            
-            # everyone else only sees stuff from their own groups
-            filter_q |= Q(parent_group__member_users=user)
-
-        # would it be more efficient to remove the OR query above and just write
-        # two different queries, instead of using distinct() here?
-        return self.get_query_set().filter(filter_q).distinct()
+            if not TopicTimeline.objects.filter(user=user).count():
+                build_topic_timeline(user)
+            entries = TopicTimelineEntry.objects.filter(Q(user=user) | Q(user__isnull=True))
+        
+        return self.get_query_set().filter(id__in=entries.values('topic'))
     
     def get_for_group(self, group):
         """
@@ -65,6 +162,17 @@ class GroupTopicManager(models.Manager):
         if qs == None:
             qs = self.get_query_set()
         return qs.filter(creator=user)
+    
+    def sorted_for(self, user, qs):
+        """
+        Orders a queryset of posts the way the user likes their listings:
+        by latest reply if their profile says so, otherwise as it is.
+        last_reply_at is stored on the post, so this costs no more than the
+        default ordering.
+        """
+        if user is not None and user.is_authenticated() and user.get_profile().sort_by_last_reply:
+            return qs.order_by('-last_reply_at')
+        return qs
 
 class GroupTopic(Topic):
     """
@@ -74,6 +182,18 @@ class GroupTopic(Topic):
     parent_group = models.ForeignKey(BaseGroup, related_name="topics", verbose_name=_('parent'))
     send_as_email = models.BooleanField(_('send as email'), default=False)
     whiteboard = models.ForeignKey(Article, related_name="topic", verbose_name=_('whiteboard'), null=True)
+    intro_html = models.TextField(_('intro'), null=True, editable=False)
+    intro_truncated = models.BooleanField(_('intro is truncated'), default=False, editable=False)
+    mailing = models.ForeignKey(GroupMailing, related_name="topics", verbose_name=_('mailing'),
+                                null=True, editable=False)
+    # kept up to date from the replies (see update_topic_replies); a post
+    # with no replies counts as last replied to when it was posted, so that
+    # last_reply_at is never null and listings can be paged on it.  Posts
+    # from before these were stored are filled in by backfill_topic_replies
+    last_reply_at = models.DateTimeField(_('last reply'), editable=False)
+    reply_count = models.IntegerField(_('reply count'), default=0, editable=False)
+    last_replier = models.ForeignKey(User, related_name="last_replied_topics", verbose_name=_('last replier'),
+                                     null=True, editable=False)
 
     objects = GroupTopicManager()
     
@@ -90,33 +210,82 @@ class GroupTopic(Topic):
     def is_editable(self, user):
         return user == self.creator or self.parent_group.user_is_admin(user)
         
+    def __init__(self, *args, **kwargs):
+        super(GroupTopic, self).__init__(*args, **kwargs)
+        # bodies loaded from the database have already been cleaned
+        self._cleaned_body = self.pk and self.body or None
+    
     def save(self, force_insert=False, force_update=False):
-        # validate HTML content
+        # validate HTML content, and work out the intro shown in listings;
+        # skipped when the body hasn't changed (e.g. saves from new comments)
         # Additional options at http://codespeak.net/lxml/lxmlhtml.html#cleaning-up-html
-        self.body = clean_html(self.body)
-        self.body = autolink_html(self.body)
+        if self.body != self._cleaned_body or self.intro_html is None:
+            self.body = clean_html(self.body)
+            self.body = autolink_html(self.body)
+            self.intro_html, self.intro_truncated = make_intro(self.body)
+        
+        if self.last_reply_at is None:
+            self.last_reply_at = self.created
         
         # set parent group
-        group = BaseGroup.objects.get(id=self.object_id)
-        self.parent_group = group
+        if self.parent_group_id != self.object_id:
+            self.parent_group = BaseGroup.objects.get(id=self.object_id)
         
         super(GroupTopic, self).save(force_insert, force_update)
-        post_save.send(sender=Topic, instance=GroupTopic.objects.get(id=self.id))
+        self._cleaned_body = self.body
+        post_save.send(sender=Topic, instance=self)
     
     def send_email(self):
+        """
+        Queues this post to be emailed to the group's members (see
+        GroupMailing).  The message is rendered here, once.  With
+        GROUP_MAIL_PERSONAL_FOOTERS, each recipient's copy also gets an
+        unsubscribe footer with their address, at the cost of one message
+        per recipient rather than one per batch.
+        """
         if self.send_as_email:
-            attachments = Attachment.objects.attachments_for_object(self)
+            # links in the email work without logging in
+            attachments = list(Attachment.objects.attachments_for_object(self))
+            for attachment in attachments:
+                attachment.download_token = download_token(attachment.id)
             
+            personal_footer = getattr(settings, 'GROUP_MAIL_PERSONAL_FOOTERS', False)
             tmpl = loader.get_template("email_template.html")
             c = Context({'group': self.group,
                          'title': self.title,
                          'body': self.body,
                          'topic_id': self.pk,
-                         'attachments': attachments
+                         'attachments': attachments,
+                         'personal_footer': personal_footer,
                          })
             message = tmpl.render(c)
+            footer = ''
+            if personal_footer:
+                footer = loader.render_to_string("email_footer.html")
+    
+            self.mailing = self.group.send_mail_to_members(self.title, message, footer=footer)
+            # update() rather than save(), which would bump the post
+            GroupTopic.objects.filter(id=self.id).update(mailing=self.mailing)
     
-            self.group.send_mail_to_members(self.title, message)
+    def email_status(self):
+        """
+        Returns the number of batches of this post's email that have been
+        sent, have failed for good, and in total (0 until the recipients
+        have been split into batches), or None if it wasn't emailed.
+        """
+        if self.mailing_id is None:
+            return None
+        status = self.mailing.delivery_status()
+        return {'sent': status.get('S', 0),
+                'failed': status.get('F', 0),
+                'total': sum(status.values())}
+        
+    def get_whiteboard(self):
+        """
+        The post's whiteboard, or an empty unsaved one if nobody has written
+        it yet (it is created on first edit).
+        """
+        return self.whiteboard or empty_whiteboard("Post%d" % self.id)
         
     def num_whiteboard_edits(self):
         if self.whiteboard:
@@ -125,31 +294,281 @@ class GroupTopic(Topic):
             return 0
             
     def intro(self):
-        if len(self.body) < 600:
-            return self.body
-
-        # thanks http://stackoverflow.com/questions/250357/smart-truncate-in-python
-        intro = self.body[:600].rsplit(' ', 1)[0]
-
-        intro = Cleaner(scripts=False,      # disable it all except page_structure
-                        javascript=False,   # as proper cleaning is done on save;
-                        comments=False,     # here we just want to fix any
-                        links=False,        # dangling tags caused by truncation
-                        meta=False,
-                        #page_stricture=True,
-                        embedded=False,
-                        frames=False,
-                        forms=False,
-                        annoying_tags=False,
-                        remove_unknown_tags=False,
-                        safe_attrs_only=False).clean_html(intro)
-        
-        intro += "..."
-        return intro
+        if self.intro_html is None:
+            # not saved since intros were stored
+            return make_intro(self.body)[0]
+        return self.intro_html
     
     def intro_has_more(self):
-        return (len(self.body) >= 600)
+        if self.intro_html is None:
+            return make_intro(self.body)[1]
+        return self.intro_truncated
 
     class Meta:
         ordering = ('-modified', )
-        
+
+def count_new_topic(sender, instance, created, **kwargs):
+    if created:
+        adjust_group_count(instance.parent_group_id, 'topic_count', 1)
+        adjust_activity_count(instance.creator_id, 'topic_count', 1)
+post_save.connect(count_new_topic, sender=GroupTopic, dispatch_uid='grouptopiccount')
+
+def count_removed_topic(sender, instance, **kwargs):
+    adjust_group_count(instance.parent_group_id, 'topic_count', -1)
+    adjust_activity_count(instance.creator_id, 'topic_count', -1)
+post_delete.connect(count_removed_topic, sender=GroupTopic, dispatch_uid='grouptopicdeletecount')
+
+def _is_topic_reply(comment):
+    return comment.content_type.model_class() in (GroupTopic, Topic)
+
+def topic_reply_stats(topic_id):
+    """
+    Returns (last_reply_at, reply_count, last_replier_id) worked out from a
+    post's replies, with last_reply_at None if there are none.
+    """
+    replies = ThreadedComment.objects.filter(content_type__in=[ContentType.objects.get_for_model(GroupTopic),
+                                                               ContentType.objects.get_for_model(Topic)],
+                                             object_id=topic_id)
+    latest = list(replies.order_by('-date_submitted').values_list('date_submitted', 'user')[:1])
+    if not latest:
+        return None, 0, None
+    return latest[0][0], replies.count(), latest[0][1]
+
+def update_topic_replies(sender, instance, **kwargs):
+    if not _is_topic_reply(instance):
+        return
+    last_reply_at, reply_count, last_replier_id = topic_reply_stats(instance.object_id)
+    topics = GroupTopic.objects.filter(id=instance.object_id)
+    if last_reply_at is None:
+        # back to the time of posting
+        created = topics.values_list('created', flat=True)
+        if not created:
+            return
+        last_reply_at = created[0]
+    # update() rather than save(), so that only the reply fields change
+    topics.update(last_reply_at=last_reply_at, reply_count=reply_count, last_replier=last_replier_id)
+post_save.connect(update_topic_replies, sender=ThreadedComment, dispatch_uid='threadedcommenttopicreplies')
+post_delete.connect(update_topic_replies, sender=ThreadedComment, dispatch_uid='threadedcommentdeletetopicreplies')
+
+# rendered Atom feeds (see group_topics.views.feed) are kept until a post in
+# them is saved or deleted, or for this long
+TOPIC_FEED_CACHE_TIME = 60 * 60
+
+def topic_feed_cache_key(group_id=None):
+    """
+    Cache key of a group's feed, or of the feed of all public groups.
+    """
+    return 'topic_feed_%s' % (group_id or 'all')
+
+def invalidate_topic_feeds(sender, instance, **kwargs):
+    cache.delete(topic_feed_cache_key(instance.parent_group_id))
+    cache.delete(topic_feed_cache_key())
+post_save.connect(invalidate_topic_feeds, sender=GroupTopic, dispatch_uid='grouptopicfeeds')
+post_delete.connect(invalidate_topic_feeds, sender=GroupTopic, dispatch_uid='grouptopicdeletefeeds')
+
+class TopicTimelineEntry(models.Model):
+    """
+    A post on one user's front page.  Entries without a user make up the
+    public timeline, holding the posts of public groups, which everyone sees
+    along with their own.
+    
+    Written when a post is made (pushed to the timeline of every member of a
+    private group who has one), so that listing the front page is a range
+    read on (user, modified) instead of a search through the user's groups.
+    """
+    user = models.ForeignKey(User, null=True, related_name="topic_timeline_entries", verbose_name=_('user'))
+    topic = models.ForeignKey(GroupTopic, related_name="timeline_entries", verbose_name=_('topic'))
+    modified = models.DateTimeField(_('modified'))
+
+class TopicTimeline(models.Model):
+    """
+    Marks a user's timeline as up to date.  Removed when their memberships
+    change; the timeline is then rebuilt from their groups the next time the
+    front page is read.
+    """
+    user = models.ForeignKey(User, unique=True, related_name="topic_timeline", verbose_name=_('user'))
+    built = models.DateTimeField(_('built'), default=datetime.datetime.now)
+
+def _insert_timeline_entries(rows):
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    cursor.executemany("INSERT INTO %s (%s, %s, %s) VALUES (%%s, %%s, %%s)" % (
+                           qn(TopicTimelineEntry._meta.db_table), qn('user_id'), qn('topic_id'), qn('modified')),
+                       rows)
+
+def _clear_timeline(user_id):
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    if user_id is None:
+        cursor.execute("DELETE FROM %s WHERE %s IS NULL" % (
+                           qn(TopicTimelineEntry._meta.db_table), qn('user_id')))
+    else:
+        cursor.execute("DELETE FROM %s WHERE %s = %%s" % (
+                           qn(TopicTimelineEntry._meta.db_table), qn('user_id')),
+                       [user_id])
+
+def build_topic_timeline(user):
+    """
+    (Re)builds a user's timeline from the newest posts in their private
+    groups, and marks it as up to date.
+    """
+    _clear_timeline(user.id)
+    
+    group_ids = list(get_visible_group_sets(user)['member'])
+    if group_ids:
+        topics = GroupTopic.objects.filter(parent_group__in=group_ids).exclude(parent_group__visibility='E')
+        topics = topics.order_by('-modified').values_list('id', 'modified')[:settings.TOPIC_TIMELINE_LENGTH]
+        to_db = connection.ops.value_to_db_datetime
+        _insert_timeline_entries([[user.id, id, to_db(modified)] for id, modified in topics])
+    
+    # two requests may rebuild the same timeline at once; the duplicate
+    # entries this can leave are harmless, as posts are listed by id
+    sid = transaction.savepoint()
+    try:
+        TopicTimeline.objects.create(user=user)
+    except IntegrityError:
+        transaction.savepoint_rollback(sid)
+    else:
+        transaction.savepoint_commit(sid)
+
+def build_public_timeline():
+    """
+    Rebuilds the public timeline from the newest posts in public groups.
+    """
+    _clear_timeline(None)
+    topics = GroupTopic.objects.filter(parent_group__visibility='E')
+    topics = topics.order_by('-modified').values_list('id', 'modified')[:settings.TOPIC_TIMELINE_LENGTH]
+    to_db = connection.ops.value_to_db_datetime
+    _insert_timeline_entries([[None, id, to_db(modified)] for id, modified in topics])
+
+def push_topic_to_timelines(topic):
+    """
+    Adds a new post to the public timeline if its group is public, or else
+    to the timeline of each of the group's members who has one (the rest
+    will pick it up when theirs is built).
+    """
+    modified = connection.ops.value_to_db_datetime(topic.modified)
+    if topic.parent_group.visibility == 'E':
+        _insert_timeline_entries([[None, topic.id, modified]])
+    else:
+        qn = connection.ops.quote_name
+        cursor = connection.cursor()
+        cursor.execute("""INSERT INTO %s (%s, %s, %s)
+                          SELECT m.%s, %%s, %%s FROM %s m
+                          INNER JOIN %s t ON t.%s = m.%s
+                          WHERE m.%s = %%s""" % (
+                           qn(TopicTimelineEntry._meta.db_table), qn('user_id'), qn('topic_id'), qn('modified'),
+                           qn('user_id'), qn(GroupMember._meta.db_table),
+                           qn(TopicTimeline._meta.db_table), qn('user_id'), qn('user_id'),
+                           qn('group_id')),
+                       [topic.id, modified, topic.parent_group_id])
+
+def drop_topic_timelines(user_ids):
+    """
+    Marks the given users' timelines as out of date.
+    """
+    if user_ids:
+        TopicTimeline.objects.filter(user__in=user_ids).delete()
+
+def update_topic_timelines(sender, instance, created, **kwargs):
+    if created:
+        push_topic_to_timelines(instance)
+    else:
+        # posts are bumped up the front page when commented on
+        TopicTimelineEntry.objects.filter(topic=instance).update(modified=instance.modified)
+post_save.connect(update_topic_timelines, sender=GroupTopic, dispatch_uid='grouptopictimelines')
+
+def drop_new_member_timeline(sender, instance, created, **kwargs):
+    # only joining or leaving a group changes what a user sees
+    if created:
+        drop_topic_timelines([instance.user_id])
+post_save.connect(drop_new_member_timeline, sender=GroupMember, dispatch_uid='groupmembertimeline')
+
+def drop_removed_member_timeline(sender, instance, **kwargs):
+    drop_topic_timelines([instance.user_id])
+post_delete.connect(drop_removed_member_timeline, sender=GroupMember, dispatch_uid='groupmemberdeletetimeline')
+
+def drop_changed_member_timeline(sender, user_id, **kwargs):
+    drop_topic_timelines([user_id])
+memberships_changed.connect(drop_changed_member_timeline, dispatch_uid='membershipstimeline')
+
+def refresh_group_timelines(sender, instance, **kwargs):
+    """
+    Moves a group's posts between the public timeline and its members'
+    timelines when the group is made public or private.
+    """
+    public_entries = TopicTimelineEntry.objects.filter(user__isnull=True, topic__parent_group=instance)
+    in_public_timeline = bool(public_entries.values_list('id', flat=True)[:1])
+    if instance.visibility == 'E' and not in_public_timeline:
+        topics = GroupTopic.objects.filter(parent_group=instance)
+        topics = list(topics.order_by('-modified').values_list('id', 'modified')[:settings.TOPIC_TIMELINE_LENGTH])
+        if topics:
+            to_db = connection.ops.value_to_db_datetime
+            _insert_timeline_entries([[None, id, to_db(modified)] for id, modified in topics])
+            drop_topic_timelines(list(instance.members.values_list('user', flat=True)))
+    elif instance.visibility != 'E' and in_public_timeline:
+        public_entries.delete()
+        drop_topic_timelines(list(instance.members.values_list('user', flat=True)))
+post_save.connect(refresh_group_timelines, sender=BaseGroup, dispatch_uid='basegrouptimelines')
+post_save.connect(refresh_group_timelines, sender=Network, dispatch_uid='networktimelines')
+post_save.connect(refresh_group_timelines, sender=Community, dispatch_uid='communitytimelines')
+
+# cached pages of guests (see siteutils.pagecache): the front page, group
+# pages and post pages are dropped when something shown on them changes
+
+def _group_slug(group_id):
+    slugs = BaseGroup.objects.filter(id=group_id).values_list('slug', flat=True)
+    return slugs and slugs[0] or ''
+
+def invalidate_topic_pages(sender, instance, **kwargs):
+    invalidate_anonymous_pages('frontpage', 'topic:%s' % instance.id,
+                               'group:%s' % _group_slug(instance.parent_group_id))
+post_save.connect(invalidate_topic_pages, sender=GroupTopic, dispatch_uid='grouptopicpages')
+post_delete.connect(invalidate_topic_pages, sender=GroupTopic, dispatch_uid='grouptopicdeletepages')
+
+def invalidate_comment_pages(sender, instance, **kwargs):
+    if not _is_topic_reply(instance):
+        return
+    topic_groups = GroupTopic.objects.filter(id=instance.object_id).values_list('parent_group', flat=True)
+    if topic_groups:
+        invalidate_anonymous_pages('frontpage', 'topic:%s' % instance.object_id,
+                                   'group:%s' % _group_slug(topic_groups[0]))
+post_save.connect(invalidate_comment_pages, sender=ThreadedComment, dispatch_uid='threadedcommentpages')
+post_delete.connect(invalidate_comment_pages, sender=ThreadedComment, dispatch_uid='threadedcommentdeletepages')
+
+def invalidate_group_pages(sender, instance, **kwargs):
+    # 'groups' covers post pages, which show their group (and whether a
+    # guest may see them at all depends on its visibility)
+    invalidate_anonymous_pages('frontpage', 'groups', 'group:%s' % instance.slug)
+for model, name in ((BaseGroup, 'basegroup'), (Network, 'network'), (Community, 'community')):
+    post_save.connect(invalidate_group_pages, sender=model, dispatch_uid='%spages' % name)
+    post_delete.connect(invalidate_group_pages, sender=model, dispatch_uid='%sdeletepages' % name)
+
+def invalidate_member_pages(sender, instance, **kwargs):
+    invalidate_anonymous_pages('group:%s' % _group_slug(instance.group_id))
+post_save.connect(invalidate_member_pages, sender=GroupMember, dispatch_uid='groupmemberpages')
+post_delete.connect(invalidate_member_pages, sender=GroupMember, dispatch_uid='groupmemberdeletepages')
+
+# posts and their replies are searched within the groups a user can see
+# (see group_topics.search)
+
+def topic_search_fields(topic):
+    return [(topic.title, 3), (strip_tags(topic.body), 1)]
+
+def topic_search_scope(topic):
+    return topic.parent_group_id
+
+register(GroupTopic, topic_search_fields, scope=topic_search_scope)
+
+def comment_search_fields(comment):
+    if not _is_topic_reply(comment):
+        return []
+    return [(strip_tags(comment.comment), 1)]
+
+def comment_search_scope(comment):
+    if not _is_topic_reply(comment):
+        return None
+    groups = GroupTopic.objects.filter(id=comment.object_id).values_list('parent_group', flat=True)
+    return groups and groups[0] or None
+
+register(ThreadedComment, comment_search_fields, scope=comment_search_scope)
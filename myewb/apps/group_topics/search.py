@@ -0,0 +1,64 @@
+"""myEWB post search
+
+Searches posts and their replies through the search index (see
+search_index.models), limited to what the user could see in
+GroupTopic.objects.visible().
+
+This file is part of myEWB
+Copyright 2009 Engineers Without Borders (Canada) Organisation and/or volunteer contributors
+"""
+
+from threadedcomments.models import ThreadedComment
+
+from group_topics.models import GroupTopic
+from search_index.models import search_scores, highlight
+
+# at most this many posts and replies are shown for a search
+SEARCH_RESULTS = 50
+
+class SearchHit(object):
+    """
+    A post, or a reply to one, matching a search; comment is None for posts.
+    """
+    def __init__(self, topic, comment, score, search_terms):
+        self.topic = topic
+        self.comment = comment
+        self.score = score
+        self.title = highlight(topic.title, search_terms)
+        if comment is None:
+            self.snippet = highlight(topic.body, search_terms)
+        else:
+            self.snippet = highlight(comment.comment, search_terms)
+
+def search_posts(user, search_terms, limit=SEARCH_RESULTS):
+    """
+    Returns SearchHits for the posts and replies user can see that contain
+    every word of search_terms, best first.  Posts and replies are indexed
+    under their group, so the visibility rules are applied by the index
+    lookup itself rather than by checking each hit.
+    """
+    # a subquery, so the SQL doesn't grow with the number of groups
+    scope = GroupTopic.objects.visible_groups(user)
+    
+    ranked = [(score, 0, id) for id, score in search_scores(GroupTopic, search_terms, scope, limit)]
+    ranked += [(score, 1, id) for id, score in search_scores(ThreadedComment, search_terms, scope, limit)]
+    # newer posts first among equal scores
+    ranked.sort(key=lambda hit: (-hit[0], hit[1], -hit[2]))
+    ranked = ranked[:limit]
+    
+    comments = ThreadedComment.objects.in_bulk([id for score, is_comment, id in ranked if is_comment])
+    topic_ids = [id for score, is_comment, id in ranked if not is_comment]
+    topic_ids.extend([comment.object_id for comment in comments.values()])
+    topics = GroupTopic.objects.in_bulk(topic_ids)
+    
+    hits = []
+    for score, is_comment, id in ranked:
+        comment = None
+        if is_comment:
+            comment = comments.get(id, None)
+            if comment is None:
+                continue
+            id = comment.object_id
+        if id in topics:
+            hits.append(SearchHit(topics[id], comment, score, search_terms))
+    return hits
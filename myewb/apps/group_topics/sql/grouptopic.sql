@@ -0,0 +1,2 @@
+-- group listings sorted by last reply (MemberProfile.sort_by_last_reply)
+CREATE INDEX group_topics_grouptopic_parent_group_last_reply_at ON group_topics_grouptopic (parent_group_id, last_reply_at);
@@ -0,0 +1,2 @@
+-- the front page reads the newest entries of one timeline
+CREATE INDEX group_topics_topictimelineentry_user_modified ON group_topics_topictimelineentry (user_id, modified);
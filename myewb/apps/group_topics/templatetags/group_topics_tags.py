@@ -8,10 +8,20 @@ Created on: 2009-12-10
 """
 from django import template
 from django.contrib.auth.models import User
-from group_topics.models import GroupTopic
+from profiles.models import get_activity_counts
 
 register = template.Library()
 
+# these read the user's stored totals (see profiles.models.ActivityCounts)
+
 @register.simple_tag
 def num_topics_for_user(user):
-    return GroupTopic.objects.get_for_user(user).count()
\ No newline at end of file
+    return get_activity_counts(user).topic_count
+
+@register.simple_tag
+def num_replies_for_user(user):
+    return get_activity_counts(user).comment_count
+
+@register.simple_tag
+def num_whiteboard_edits_for_user(user):
+    return get_activity_counts(user).whiteboard_edit_count
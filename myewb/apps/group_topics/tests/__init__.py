@@ -1,2 +1,6 @@
 from regression import *
 from visibility import *
+from timeline import *
+from feeds import *
+from pagecache import *
+from search import *
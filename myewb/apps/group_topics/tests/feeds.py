@@ -0,0 +1,36 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from base_groups.models import BaseGroup
+from group_topics.models import GroupTopic
+
+class TestTopicFeeds(TestCase):
+    """
+    Feeds are cached, answer conditional GETs, and change when a post does
+    """
+    
+    def setUp(self):
+        self.creator = User.objects.create_user('creator', 'creator@ewb.ca', 'password')
+        self.group = BaseGroup.objects.create(slug='feedgrp', name='feed group', creator=self.creator,
+                                              model='Network', visibility='E')
+        GroupTopic.objects.create(title="firstpost", body="text", group=self.group, creator=self.creator)
+    
+    def tearDown(self):
+        GroupTopic.objects.all().delete()
+        BaseGroup.objects.all().delete()
+        User.objects.all().delete()
+    
+    def test_conditional_get(self):
+        for url in ('/feeds/posts/all/', '/feeds/posts/feedgrp/'):
+            response = self.client.get(url)
+            self.assertContains(response, "firstpost")
+            etag = response['ETag']
+            
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEquals(response.status_code, 304)
+            
+            GroupTopic.objects.create(title="newpost %s" % url, body="text", group=self.group, creator=self.creator)
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEquals(response.status_code, 200)
+            self.assertContains(response, "newpost %s" % url)
+            self.assertNotEquals(response['ETag'], etag)
@@ -0,0 +1,59 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from base_groups.models import BaseGroup
+from group_topics.models import GroupTopic
+
+class TestAnonymousPageCache(TestCase):
+    """
+    Guests get cached pages, which are dropped when a post or group on them
+    changes; the login form is still rendered on every request
+    """
+    
+    def setUp(self):
+        self.creator = User.objects.create_user('creator', 'creator@ewb.ca', 'password')
+        self.group = BaseGroup.objects.create(slug='cachegrp', name='cache group', creator=self.creator,
+                                              model='Network', visibility='E')
+        self.topic = GroupTopic.objects.create(title="firstpost", body="text", group=self.group,
+                                               creator=self.creator)
+    
+    def tearDown(self):
+        GroupTopic.objects.all().delete()
+        BaseGroup.objects.all().delete()
+        User.objects.all().delete()
+    
+    def test_front_page(self):
+        response = self.client.get('/')
+        self.assertContains(response, "firstpost")
+        self.assertContains(response, 'class="toolbarlogin"')
+        self.assertNotContains(response, 'per-request:')
+        
+        # update() sends no signals, so the cached page stays
+        GroupTopic.objects.filter(id=self.topic.id).update(title="renamedpost")
+        response = self.client.get('/')
+        self.assertContains(response, "firstpost")
+        self.assertContains(response, 'class="toolbarlogin"')
+        
+        # save() does
+        GroupTopic.objects.create(title="secondpost", body="text", group=self.group, creator=self.creator)
+        response = self.client.get('/')
+        self.assertContains(response, "renamedpost")
+        self.assertContains(response, "secondpost")
+    
+    def test_topic_page(self):
+        url = '/posts/%d/' % self.topic.id
+        self.assertContains(self.client.get(url), "firstpost")
+        
+        # made private: guests are turned away straight away
+        self.group.visibility = 'M'
+        self.group.save()
+        self.assertEquals(self.client.get(url).status_code, 403)
+    
+    def test_members_not_cached(self):
+        self.client.get('/')
+        GroupTopic.objects.filter(id=self.topic.id).update(title="renamedpost")
+        
+        self.client.login(username='creator', password='password')
+        response = self.client.get('/')
+        self.assertContains(response, "renamedpost")
+        self.assertNotContains(response, 'class="toolbarlogin"')
@@ -1,10 +1,16 @@
+import datetime
+
 from django.test import TestCase
 from django.contrib.auth.models import User
+from django.core.management import call_command
 from django.core.urlresolvers import reverse
 
 from base_groups.models import BaseGroup
 from networks.models import Network
 from group_topics.models import GroupTopic
+from threadedcomments.models import ThreadedComment
+from whiteboard.helpers import attach_whiteboard
+from wiki.models import Article
 
 
 class CreateTopics(TestCase):
@@ -137,4 +143,127 @@ class DanglingTags(TestCase):
 
     def test_dangling_tags(self):
         self.assertEquals(self.topic.intro()[-9:], "</div>...")
-        
\ No newline at end of file
+        
+class StoredIntro(TestCase):
+
+    def setUp(self):
+        self.creator = User.objects.create_user('creator', 'creator@ewb.ca', 'password')
+        self.base_group = BaseGroup.objects.create(slug='bg', creator=self.creator)
+
+    def tearDown(self):
+        BaseGroup.objects.all().delete()
+        User.objects.all().delete()
+
+    def test_intro_stored_on_save(self):
+        body = "<p>%s</p>" % ("words " * 200)
+        gt = GroupTopic.objects.create(creator=self.creator, group=self.base_group, title='long', body=body)
+        gt = GroupTopic.objects.get(id=gt.id)
+        self.assertTrue(gt.intro_truncated)
+        self.assertTrue(gt.intro_has_more())
+        self.assertEquals(gt.intro()[-7:], "</p>...")
+
+        gt.body = "<p>short</p>"
+        gt.save()
+        gt = GroupTopic.objects.get(id=gt.id)
+        self.assertFalse(gt.intro_has_more())
+        self.assertEquals(gt.intro(), gt.body)
+
+    def test_backfill(self):
+        gt = GroupTopic.objects.create(creator=self.creator, group=self.base_group, title='t', body='<p>text</p>')
+        GroupTopic.objects.filter(id=gt.id).update(intro_html=None)
+        call_command('backfill_topic_intros')
+        self.assertEquals(GroupTopic.objects.get(id=gt.id).intro_html, gt.body)
+
+class LastReply(TestCase):
+    """
+    Posts keep their latest reply time, reply count and latest replier up
+    to date, for sorting by last reply.
+    """
+
+    def setUp(self):
+        self.creator = User.objects.create_user('creator', 'creator@ewb.ca', 'password')
+        self.replier = User.objects.create_user('replier', 'replier@ewb.ca', 'password')
+        self.base_group = BaseGroup.objects.create(slug='bg', creator=self.creator, visibility='E')
+        self.older = GroupTopic.objects.create(creator=self.creator, group=self.base_group, title='older', body='words')
+        self.newer = GroupTopic.objects.create(creator=self.creator, group=self.base_group, title='newer', body='words')
+
+    def tearDown(self):
+        ThreadedComment.objects.all().delete()
+        GroupTopic.objects.all().delete()
+        BaseGroup.objects.all().delete()
+        User.objects.all().delete()
+
+    def test_replies(self):
+        self.assertEquals(self.older.last_reply_at, self.older.created)
+        
+        comment = ThreadedComment.objects.create(content_object=self.older, user=self.replier, comment='reply')
+        older = GroupTopic.objects.get(id=self.older.id)
+        self.assertEquals(older.reply_count, 1)
+        self.assertEquals(older.last_replier, self.replier)
+        self.assertEquals(older.last_reply_at, comment.date_submitted)
+        
+        comment.delete()
+        older = GroupTopic.objects.get(id=self.older.id)
+        self.assertEquals(older.reply_count, 0)
+        self.assertEquals(older.last_replier, None)
+        self.assertEquals(older.last_reply_at, older.created)
+
+    def test_sort_preference(self):
+        ThreadedComment.objects.create(content_object=self.older, user=self.replier, comment='reply')
+        # leave modified alone, so only the reply ordering moves older up
+        GroupTopic.objects.filter(id=self.older.id).update(modified=self.older.created)
+        topics = GroupTopic.objects.get_for_group(self.base_group)
+        
+        self.assertEquals(GroupTopic.objects.sorted_for(self.creator, topics)[0].title, 'newer')
+        profile = self.creator.get_profile()
+        profile.sort_by_last_reply = True
+        profile.save()
+        self.assertEquals(GroupTopic.objects.sorted_for(self.creator, topics)[0].title, 'older')
+
+    def test_backfill(self):
+        ThreadedComment.objects.create(content_object=self.older, user=self.replier, comment='reply')
+        GroupTopic.objects.all().update(last_reply_at=datetime.datetime(2000, 1, 1), reply_count=0)
+        call_command('backfill_topic_replies')
+        self.assertEquals(GroupTopic.objects.get(id=self.older.id).reply_count, 1)
+        newer = GroupTopic.objects.get(id=self.newer.id)
+        self.assertEquals(newer.last_reply_at, newer.created)
+
+class LazyWhiteboard(TestCase):
+    """
+    Viewing a post shouldn't write anything; its whiteboard is created the
+    first time it is edited.
+    """
+
+    def setUp(self):
+        self.creator = User.objects.create_user('creator', 'creator@ewb.ca', 'password')
+        self.base_group = BaseGroup.objects.create(slug='bg', creator=self.creator, visibility='E')
+        self.topic = GroupTopic.objects.create(creator=self.creator, group=self.base_group, title='t', body='words')
+
+    def tearDown(self):
+        GroupTopic.objects.all().delete()
+        Article.objects.all().delete()
+        BaseGroup.objects.all().delete()
+        User.objects.all().delete()
+
+    def test_view_does_not_create(self):
+        articles = Article.objects.count()
+        response = self.client.get(self.topic.get_absolute_url())
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(articles, Article.objects.count())
+        self.assertEquals(None, GroupTopic.objects.get(id=self.topic.id).whiteboard)
+        self.assertEquals("Post%d" % self.topic.id, self.topic.get_whiteboard().title)
+
+    def test_attach_only_within_group(self):
+        other = BaseGroup.objects.create(slug='other', creator=self.creator, visibility='E')
+        title = "Post%d" % self.topic.id
+        article = Article.objects.create(title=title, content='words', creator=self.creator, group=other)
+        self.assertEquals(None, attach_whiteboard(article, other))
+        self.assertEquals(None, GroupTopic.objects.get(id=self.topic.id).whiteboard)
+
+        page = Article.objects.create(title='Minutes', content='words', creator=self.creator, group=other)
+        self.assertEquals(None, attach_whiteboard(page, other))
+        self.assertEquals(None, BaseGroup.objects.get(id=other.id).whiteboard)
+
+        article = Article.objects.create(title=title, content='words', creator=self.creator, group=self.base_group)
+        self.assertEquals(self.topic.id, attach_whiteboard(article, self.base_group).id)
+        self.assertEquals(article.id, GroupTopic.objects.get(id=self.topic.id).whiteboard_id)
@@ -0,0 +1,66 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from base_groups.models import BaseGroup
+from group_topics.models import GroupTopic
+from group_topics.search import search_posts
+from threadedcomments.models import ThreadedComment
+
+class TestPostSearch(TestCase):
+    """
+    Posts and replies are found by their words, but only in groups the
+    searcher can see
+    """
+    
+    def setUp(self):
+        self.creator = User.objects.create_user('creator', 'creator@ewb.ca', 'password')
+        self.outsider = User.objects.create_user('outsider', 'outsider@ewb.ca', 'password')
+        self.public = BaseGroup.objects.create(slug='public', name='public group', creator=self.creator,
+                                               model='Network', visibility='E')
+        self.private = BaseGroup.objects.create(slug='private', name='private group', creator=self.creator,
+                                                model='Network', visibility='M')
+        self.public_topic = GroupTopic.objects.create(title="Water projects", body="<p>Wells in Ghana</p>",
+                                                      group=self.public, creator=self.creator)
+        self.private_topic = GroupTopic.objects.create(title="Exec meeting", body="<p>Wells budget</p>",
+                                                       group=self.private, creator=self.creator)
+    
+    def tearDown(self):
+        ThreadedComment.objects.all().delete()
+        GroupTopic.objects.all().delete()
+        BaseGroup.objects.all().delete()
+        User.objects.all().delete()
+    
+    def titles(self, hits):
+        return set([hit.topic.title for hit in hits])
+    
+    def test_visibility(self):
+        self.assertEquals(self.titles(search_posts(self.creator, 'wells')),
+                          set(["Water projects", "Exec meeting"]))
+        self.assertEquals(self.titles(search_posts(self.outsider, 'wells')), set(["Water projects"]))
+        
+        self.private.visibility = 'E'
+        self.private.save()
+        self.assertEquals(self.titles(search_posts(self.outsider, 'wells')),
+                          set(["Water projects", "Exec meeting"]))
+    
+    def test_ranking_and_snippets(self):
+        hits = search_posts(self.creator, 'water')
+        self.assertEquals(len(hits), 1)
+        self.assertEquals(hits[0].title, '<strong class="highlight">Water</strong> projects')
+        
+        # a title match outranks a body match
+        GroupTopic.objects.create(title="Budget", body="<p>Water filters</p>", group=self.public,
+                                  creator=self.creator)
+        self.assertEquals([hit.topic.title for hit in search_posts(self.creator, 'water')],
+                          ["Water projects", "Budget"])
+    
+    def test_replies(self):
+        comment = ThreadedComment.objects.create(content_object=self.public_topic, user=self.outsider,
+                                                 comment='Boreholes are cheaper')
+        hits = search_posts(self.outsider, 'borehole')
+        self.assertEquals(len(hits), 1)
+        self.assertEquals(hits[0].comment, comment)
+        self.assertEquals(hits[0].topic, self.public_topic)
+        
+        comment.delete()
+        self.assertEquals(search_posts(self.outsider, 'borehole'), [])
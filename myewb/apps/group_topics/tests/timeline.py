@@ -0,0 +1,75 @@
+from django.contrib.auth.models import User, AnonymousUser
+from django.test import TestCase
+
+from base_groups.models import BaseGroup, GroupMember, add_members_in_bulk
+from group_topics.models import GroupTopic, TopicTimeline, TopicTimelineEntry
+
+class TestTopicTimeline(TestCase):
+    """
+    The front page listing read from stored timelines should match
+    GroupTopic.objects.visible()
+    """
+    
+    def setUp(self):
+        self.creator = User.objects.create_user('creator', 'creator@ewb.ca', 'password')
+        self.member = User.objects.create_user('member', 'member@ewb.ca', 'password')
+        self.other = User.objects.create_user('other', 'other@ewb.ca', 'password')
+        
+        self.publicgrp = BaseGroup.objects.create(slug='publicgrp', name='public', creator=self.creator,
+                                                  model='Network', visibility='E')
+        self.privategrp = BaseGroup.objects.create(slug='privategrp', name='private', creator=self.creator,
+                                                   model='Community', visibility='M')
+        GroupMember.objects.create(user=self.member, group=self.privategrp)
+        
+        self.publicpost = GroupTopic.objects.create(title="publicpost", body="text",
+                                                    group=self.publicgrp, creator=self.creator)
+        self.privatepost = GroupTopic.objects.create(title="privatepost", body="text",
+                                                     group=self.privategrp, creator=self.creator)
+    
+    def tearDown(self):
+        GroupTopic.objects.all().delete()
+        BaseGroup.objects.all().delete()
+        User.objects.all().delete()
+    
+    def listed(self, user):
+        return set(GroupTopic.objects.timeline(user).values_list('title', flat=True))
+    
+    def test_matches_visible(self):
+        for user in (self.member, self.other, AnonymousUser()):
+            self.assertEquals(self.listed(user),
+                              set(GroupTopic.objects.visible(user).values_list('title', flat=True)))
+        self.assertEquals(self.listed(self.member), set(['publicpost', 'privatepost']))
+        self.assertEquals(self.listed(self.other), set(['publicpost']))
+    
+    def test_new_topic_pushed(self):
+        self.listed(self.member)
+        post = GroupTopic.objects.create(title="newpost", body="text",
+                                         group=self.privategrp, creator=self.creator)
+        self.assertEquals(TopicTimelineEntry.objects.filter(user=self.member, topic=post).count(), 1)
+        self.assertTrue('newpost' in self.listed(self.member))
+    
+    def test_membership_changes(self):
+        self.assertEquals(self.listed(self.other), set(['publicpost']))
+        GroupMember.objects.create(user=self.other, group=self.privategrp)
+        self.assertEquals(TopicTimeline.objects.filter(user=self.other).count(), 0)
+        self.assertEquals(self.listed(self.other), set(['publicpost', 'privatepost']))
+        
+        GroupMember.objects.get(user=self.member, group=self.privategrp).delete()
+        self.assertEquals(self.listed(self.member), set(['publicpost']))
+        
+        third = User.objects.create_user('third', 'third@ewb.ca', 'password')
+        self.listed(third)
+        add_members_in_bulk(self.privategrp, [third.id])
+        self.assertTrue('privatepost' in self.listed(third))
+    
+    def test_group_made_public(self):
+        self.listed(self.member)
+        self.privategrp.visibility = 'E'
+        self.privategrp.save()
+        self.assertTrue('privatepost' in self.listed(self.other))
+        self.assertTrue('privatepost' in self.listed(self.member))
+        
+        self.privategrp.visibility = 'M'
+        self.privategrp.save()
+        self.assertFalse('privatepost' in self.listed(self.other))
+        self.assertTrue('privatepost' in self.listed(self.member))
@@ -19,6 +19,7 @@ urlpatterns = patterns('',
     url(r'^(?P<topic_id>\d+)/printreplies/$', 'group_topics.views.topic', {'template_name': 'topics/printablereplies.html'}, name="topic_printable_with_replies"),
     url(r'^(?P<topic_id>\d+)/$', 'group_topics.views.topic', name="topic_detail"),
     url(r'^user/(?P<username>[\w\._-]+)/$', 'group_topics.views.topics_by_user', name="topic_list_by_user"),
+    url(r'^search/$', 'group_topics.views.search', name="topic_search"),
     url(r'^admin/$', 'group_topics.views.adminovision_toggle', name="topic_adminovision"),
     url(r'^cloud/$', 'django.views.generic.simple.direct_to_template', {'template': 'topics/cloud.html'}, name="topic_cloud"),
 )
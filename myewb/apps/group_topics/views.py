@@ -9,7 +9,9 @@ Last modified: 2009-12-02
 @author: Joshua Gorner, Francis Kung
 """
 
-from django.http import HttpResponse, HttpResponseForbidden, HttpResponseRedirect, Http404
+from email.Utils import formatdate
+
+from django.http import HttpResponse, HttpResponseForbidden, HttpResponseRedirect, HttpResponseNotModified, Http404
 from django.utils.translation import ugettext as _
 from django.contrib.auth.models import User
 from django.contrib.syndication import feeds
@@ -17,24 +19,37 @@ from django.shortcuts import get_object_or_404, render_to_response
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.urlresolvers import reverse
 from django.template import RequestContext
+from django.template.loader import render_to_string
 from django.db.models import Q
+from django.core.cache import cache
+from django.utils.hashcompat import md5_constructor
 
 from groups import bridge
 
 from account_extra.forms import EmailLoginForm
 from base_groups.models import BaseGroup
 from base_groups.helpers import user_can_adminovision, user_can_execovision
-from group_topics.models import GroupTopic
+from group_topics.models import GroupTopic, topic_feed_cache_key, TOPIC_FEED_CACHE_TIME
 from group_topics.forms import GroupTopicForm
 from group_topics.feeds import TopicFeedAll, TopicFeedGroup
+from group_topics.search import search_posts
 from threadedcomments.models import ThreadedComment
 from profiles.models import MemberProfile
+from siteutils.pagecache import anonymous_page_cache
 
 from attachments.forms import AttachmentForm
+from attachments_extra.uploadhandler import hashing_uploads
 from attachments.models import Attachment
 from topics.models import Topic
-from wiki.models import Article
 
+def login_toolbar(request):
+    """
+    The front page's sign-in form, the one part of a guest's cached front
+    page that is rendered on every request.
+    """
+    return render_to_string("login_toolbar.html", {"login_form": EmailLoginForm()})
+
+@anonymous_page_cache('topic:%(topic_id)s', 'groups')
 def topic(request, topic_id, group_slug=None, edit=False, template_name="topics/topic.html", bridge=None):
 
     topic = get_object_or_404(GroupTopic, id=topic_id)
@@ -54,15 +69,8 @@ def topic(request, topic_id, group_slug=None, edit=False, template_name="topics/
             topic.save()
         return HttpResponseRedirect(topic.get_absolute_url())
 
-    # retrieve whiteboard (create if needed)
-    if topic.whiteboard == None:
-        # group_slug should always be valid - group never null!
-        wb = Article(title="Post%d" % (topic.id), content="")
-        if topic.group:
-            topic.group.associate(wb, commit=False)
-        wb.save()
-        topic.whiteboard = wb
-        topic.save()
+    # the whiteboard isn't created until someone first edits it
+    # (see GroupTopic.get_whiteboard)
         
     member = False
     if topic.group and topic.group.user_is_member(request.user):
@@ -77,6 +85,8 @@ def topic(request, topic_id, group_slug=None, edit=False, template_name="topics/
         "grpadmin": grpadmin,
     }, context_instance=RequestContext(request))
 
+@anonymous_page_cache('frontpage', 'group:%(group_slug)s', fragments={'login_toolbar': login_toolbar})
+@hashing_uploads
 def topics(request, group_slug=None, form_class=GroupTopicForm, attach_form_class=AttachmentForm, template_name="topics/topics.html", bridge=None):
     
     is_member = False
@@ -145,7 +155,8 @@ def topics(request, group_slug=None, form_class=GroupTopicForm, attach_form_clas
         # generic topic listing: show posts from groups you're in
         # also shows posts from public groups...
         # for guests, show posts from public groups only
-        topics = GroupTopic.objects.visible(user=request.user)
+        topics = GroupTopic.objects.timeline(user=request.user)
+    topics = GroupTopic.objects.sorted_for(request.user, topics)
 
     if request.user.is_authenticated():
         can_adminovision = user_can_adminovision(request.user)
@@ -166,27 +177,50 @@ def topics(request, group_slug=None, form_class=GroupTopicForm, attach_form_clas
         "can_adminovision": can_adminovision,
         "can_execovision": can_execovision,
         "adminovision": adminovision,
-        "login_form": EmailLoginForm(),                # for front-page toolbar
     }, context_instance=RequestContext(request))
 
 def feed(request, group_slug):
-    try:
-        if group_slug == 'all':
-            feedgen = TopicFeedAll(group_slug, request).get_feed()
-        else:
-            group = BaseGroup.objects.get(slug=group_slug)
-            
-            # concept of a RSS feed for a logged-in user is weird, but OK...
-            if group.is_visible(request.user):
-                feedgen = TopicFeedGroup(group_slug, request).get_feed(group_slug)
-            else:
-                return HttpResponseForbidden()
+    """
+    Atom feed of a group's posts, or of all public posts.  The rendered
+    document is cached until a post in it changes, and served with an ETag
+    and Last-Modified so that feed readers polling for changes mostly get a
+    304 Not Modified.
+    """
+    if group_slug == 'all':
+        group = None
+    else:
+        group = get_object_or_404(BaseGroup, slug=group_slug)
+        
+        # concept of a RSS feed for a logged-in user is weird, but OK...
+        if not group.is_visible(request.user):
+            return HttpResponseForbidden()
 
-    except feeds.FeedDoesNotExist:
-        raise Http404, _("Invalid feed parameters. Slug %r is valid, but other parameters, or lack thereof, are not.") % slug
+    key = topic_feed_cache_key(group and group.id)
+    document = cache.get(key)
+    if document is None:
+        try:
+            if group is None:
+                feedgen = TopicFeedAll(group_slug, request).get_feed()
+            else:
+                feedgen = TopicFeedGroup(group_slug, request).get_feed(group_slug)
+        except feeds.FeedDoesNotExist:
+            raise Http404, _("Invalid feed parameters. Slug %r is valid, but other parameters, or lack thereof, are not.") % group_slug
+        
+        response = HttpResponse(mimetype=feedgen.mime_type)
+        feedgen.write(response, 'utf-8')
+        document = {'content': response.content,
+                    'mime_type': feedgen.mime_type,
+                    'etag': '"%s"' % md5_constructor(response.content).hexdigest(),
+                    'last_modified': formatdate(usegmt=True)}
+        cache.set(key, document, TOPIC_FEED_CACHE_TIME)
+    
+    if request.META.get('HTTP_IF_NONE_MATCH', None) == document['etag'] or \
+            request.META.get('HTTP_IF_MODIFIED_SINCE', None) == document['last_modified']:
+        return HttpResponseNotModified()
 
-    response = HttpResponse(mimetype=feedgen.mime_type)
-    feedgen.write(response, 'utf-8')
+    response = HttpResponse(document['content'], mimetype=document['mime_type'])
+    response['ETag'] = document['etag']
+    response['Last-Modified'] = document['last_modified']
     return response
 
 def get_attachment_form(request, template_name="topics/attachment_form.html", form_class=AttachmentForm, group_slug=None, bridge=None):
@@ -252,12 +286,26 @@ def topics_by_user(request, username):
             
         # then restrict further to only ones by the given user
         topics = GroupTopic.objects.get_for_user(user, topics)
+    topics = GroupTopic.objects.sorted_for(request.user, topics)
             
     return render_to_response("topics/topics.html",
                               {"topics": topics},
                               context_instance=RequestContext(request)
                              )
 
+def search(request, template_name="topics/search.html"):
+    """
+    Posts and replies matching the words in q, out of those the user can see.
+    """
+    search_terms = request.GET.get('q', '').strip()
+    hits = []
+    if search_terms:
+        hits = search_posts(request.user, search_terms)
+    return render_to_response(template_name, {
+        "search_terms": search_terms,
+        "hits": hits,
+    }, context_instance=RequestContext(request))
+
 def adminovision_toggle(request, group_slug=None):
     """
     Toggles admin-o-vision for the current user.
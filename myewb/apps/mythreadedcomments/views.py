@@ -12,6 +12,7 @@ from mythreadedcomments.forms import MyThreadedCommentForm, MyFreeThreadedCommen
 
 from attachments.models import Attachment
 from attachments.forms import AttachmentForm
+from attachments_extra.uploadhandler import hashing_uploads
 
 from siteutils import helpers
 
@@ -67,6 +68,7 @@ def comment(*args, **kwargs):
     return free_comment(*args, **kwargs)
 comment = login_required(comment)
     
+@hashing_uploads
 def free_comment(request, content_type=None, object_id=None, edit_id=None, parent_id=None, add_messages=False, ajax=False, model=FreeThreadedComment, form_class=MyFreeThreadedCommentForm, attach_form_class=AttachmentForm, context_processors=[], extra_context={}):
     """
     Receives POST data and either creates a new ``ThreadedComment`` or 
@@ -0,0 +1,27 @@
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from networks.models import BulkImportJob, requeue_stalled_imports
+
+
+class Command(NoArgsCommand):
+    help = "Processes queued network bulk imports, picking up any that were interrupted."
+
+    def handle_noargs(self, **options):
+        requeue_stalled_imports()
+        
+        jobs = 0
+        for job in BulkImportJob.objects.filter(status='Q'):
+            # another worker may have got there first
+            if not job.claim():
+                continue
+            while self.run_chunk(job):
+                pass
+            jobs += 1
+        return 'Ran %d bulk imports.' % jobs
+
+    # each chunk is committed with its results, so a crash only repeats
+    # the chunk that was in progress
+    @transaction.commit_on_success
+    def run_chunk(self, job):
+        return job.run_chunk()
@@ -11,12 +11,24 @@ Last modified on 2009-07-29
 from django.core.urlresolvers import reverse
 from django.contrib.auth.models import  User
 from django.utils.translation import ugettext_lazy as _
-from django.db import models
-from django.db.models.signals import post_save
+from django.db import models, connection
+from django.db.models.signals import post_save, post_delete
+from datetime import datetime, timedelta
 
-from base_groups.models import BaseGroup, GroupMember, GroupLocation, add_creator_to_group
+from emailconfirmation.models import EmailAddress
+
+from base_groups.models import BaseGroup, GroupMember, GroupLocation, add_creator_to_group, update_group_ancestry, \
+        invalidate_all_visible_groups, add_members_in_bulk, claim_row
 from networks import emailforwards
 
+# addresses resolved and added per chunk (and per transaction, when run by
+# the run_bulk_imports command)
+BULK_IMPORT_CHUNK_SIZE = 500
+
+# a running job that hasn't finished a chunk in this many seconds has lost
+# its worker, and is queued again
+BULK_IMPORT_CLAIM_TIMEOUT = 30 * 60
+
 class Network(BaseGroup):
     
     TYPE_CHOICES = (
@@ -76,6 +88,184 @@ class EmailForward(models.Model):
         super(EmailForward, self).delete()
         
 
+class BulkImportJob(models.Model):
+    """
+    A pasted list of email addresses being added to a network as mailing
+    list (bulk) members.
+    
+    Small lists are processed straight away; larger ones are left for the
+    run_bulk_imports command.  Addresses are processed in chunks of
+    BULK_IMPORT_CHUNK_SIZE, each chunk committed along with its entries'
+    results, so an interrupted job carries on where it stopped.  A job is
+    claimed (moved from queued to running) before it is processed, so two
+    workers never run the same one.
+    """
+    group = models.ForeignKey(Network, related_name="bulk_imports", verbose_name=_('network'))
+    creator = models.ForeignKey(User, related_name="bulk_imports", verbose_name=_('creator'))
+    created = models.DateTimeField(_('created'), default=datetime.now)
+    finished = models.DateTimeField(_('finished'), null=True, blank=True)
+    
+    STATUS_CHOICES = (
+        ('Q', _("queued")),
+        ('R', _("running")),
+        ('D', _("done")),
+    )
+    status = models.CharField(_('status'), max_length=1, choices=STATUS_CHOICES, default='Q')
+    # when the job was claimed or last finished a chunk
+    claimed = models.DateTimeField(_('claimed'), null=True, blank=True)
+    total = models.PositiveIntegerField(_('total'), default=0)
+    processed = models.PositiveIntegerField(_('processed'), default=0)
+
+    class Meta:
+        ordering = ('created',)
+
+    def __unicode__(self):
+        return "%s: %d of %d" % (self.group, self.processed, self.total)
+    
+    def percent_done(self):
+        if not self.total:
+            return 100
+        return self.processed * 100 / self.total
+    
+    def add_emails(self, emails):
+        """
+        Queues addresses (duplicates are dropped) with a single multi-row
+        insert.
+        """
+        seen = set()
+        unique_emails = []
+        for email in emails:
+            if email not in seen:
+                seen.add(email)
+                unique_emails.append(email)
+        
+        qn = connection.ops.quote_name
+        cursor = connection.cursor()
+        cursor.executemany("INSERT INTO %s (%s, %s, %s) VALUES (%%s, %%s, %%s)" % (
+                               qn(BulkImportEntry._meta.db_table), qn('job_id'), qn('email'), qn('result')),
+                           [[self.id, email, 'P'] for email in unique_emails])
+        self.total = self.total + len(unique_emails)
+        self.save()
+    
+    def claim(self):
+        """
+        Marks a queued job as running.  Returns False if another worker
+        already took it.
+        """
+        if not claim_row(BulkImportJob, self.id, 'Q', 'R', claimed_field='claimed'):
+            return False
+        self.status = 'R'
+        return True
+    
+    def run(self):
+        """
+        Claims the job and processes every remaining address.  Returns False
+        if another worker already took it.
+        """
+        if not self.claim():
+            return False
+        while self.run_chunk():
+            pass
+        return True
+    
+    def run_chunk(self):
+        """
+        Processes the next chunk of pending addresses; returns False once
+        there are none left.
+        """
+        entries = list(self.entries.filter(result='P').order_by('id')
+                                   .values_list('id', 'email')[:BULK_IMPORT_CHUNK_SIZE])
+        if not entries:
+            self.status = 'D'
+            self.finished = datetime.now()
+            self.save()
+            return False
+        
+        emails = [email for id, email in entries]
+        
+        # like siteutils.helpers.get_email_user: an account with the address
+        # comes first, then anyone who has verified it
+        email_users = {}
+        for email, user_id in User.objects.filter(email__in=emails).order_by('-id') \
+                                          .values_list('email', 'id'):
+            email_users[email] = user_id
+        unknown = [email for email in emails if email not in email_users]
+        if unknown:
+            for email, user_id in EmailAddress.objects.filter(email__in=unknown, verified=True) \
+                                                      .order_by('-id').values_list('email', 'user'):
+                email_users[email] = user_id
+        
+        # everyone else gets a new bulk user
+        created = set()
+        unknown = [email for email in emails if email not in email_users]
+        for email, username in zip(unknown, random_usernames(len(unknown))):
+            email_users[email] = User.extras.create_bulk_user(username, email).id
+            created.add(email)
+        
+        added = set(add_members_in_bulk(self.group, [email_users[email] for email in emails]))
+        
+        results = []
+        for id, email in entries:
+            user_id = email_users[email]
+            if email in created:
+                result = 'C'
+            elif user_id in added:
+                result = 'A'
+            else:
+                result = 'M'
+            results.append([result, user_id, id])
+        qn = connection.ops.quote_name
+        cursor = connection.cursor()
+        cursor.executemany("UPDATE %s SET %s = %%s, %s = %%s WHERE %s = %%s" % (
+                               qn(BulkImportEntry._meta.db_table), qn('result'), qn('user_id'), qn('id')),
+                           results)
+        
+        self.status = 'R'
+        self.claimed = datetime.now()
+        # counted rather than added up, so that a chunk repeated after a
+        # crash isn't counted twice
+        self.processed = self.entries.exclude(result='P').count()
+        self.save()
+        return True
+
+def requeue_stalled_imports(timeout=BULK_IMPORT_CLAIM_TIMEOUT):
+    """
+    Puts running jobs that haven't finished a chunk in timeout seconds back
+    in the queue: their worker died.  Returns the number requeued.
+    """
+    cutoff = datetime.now() - timedelta(seconds=timeout)
+    return BulkImportJob.objects.filter(status='R') \
+                                .filter(models.Q(claimed__isnull=True) | models.Q(claimed__lt=cutoff)) \
+                                .update(status='Q')
+
+class BulkImportEntry(models.Model):
+    """
+    One address in a BulkImportJob, and what became of it.
+    """
+    job = models.ForeignKey(BulkImportJob, related_name="entries", verbose_name=_('job'))
+    email = models.CharField(_('email'), max_length=75)
+    user = models.ForeignKey(User, null=True, blank=True, verbose_name=_('user'))
+    
+    RESULT_CHOICES = (
+        ('P', _("pending")),
+        ('C', _("added as a new mailing list member")),
+        ('A', _("added")),
+        ('M', _("already a member")),
+    )
+    result = models.CharField(_('result'), max_length=1, choices=RESULT_CHOICES, default='P')
+
+def random_usernames(count):
+    """
+    Returns count unused random usernames for new bulk users (checked with
+    one query per round rather than one per name).
+    """
+    usernames = set()
+    while len(usernames) < count:
+        candidates = set([User.objects.make_random_password() for i in range(count - len(usernames))])
+        taken = set(User.objects.filter(username__in=candidates).values_list('username', flat=True))
+        usernames.update(candidates - taken)
+    return list(usernames)
+
 def add_users_to_default_networks(sender, instance=None, created=False, **kwargs):
     if created:
         try:
@@ -84,5 +274,8 @@ def add_users_to_default_networks(sender, instance=None, created=False, **kwargs
         except Network.DoesNotExist:
             pass
 post_save.connect(add_users_to_default_networks, sender=User)
-# use same add_creator_to_group from base_groups
+# use same add_creator_to_group, update_group_ancestry and invalidate_all_visible_groups from base_groups
 post_save.connect(add_creator_to_group, sender=Network)
+post_save.connect(update_group_ancestry, sender=Network)
+post_save.connect(invalidate_all_visible_groups, sender=Network)
+post_delete.connect(invalidate_all_visible_groups, sender=Network)
@@ -7,17 +7,23 @@ Last modified on 2009-07-29
 @author Joshua Gorner
 """
 
+import datetime
+
 from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
 from django.test import TestCase
+from django.conf import settings
 from django.test.client import Client
 from django.core import mail
+from django.core.management import call_command
+from django.utils.http import urlquote
 
 from emailconfirmation.models import EmailAddress
-from base_groups.models import GroupMember
+from base_groups.models import GroupMember, GroupMailBatch
 from base_groups.forms import GroupMemberForm
-from networks.models import Network
+from networks.models import Network, BulkImportJob, BULK_IMPORT_CLAIM_TIMEOUT
 from networks.forms import NetworkForm
+from group_topics.models import GroupTopic
 from siteutils.helpers import get_email_user
 
 # import regression tests
@@ -99,6 +105,9 @@ class TestNetworkMail(TestCase):
         body = 'Hi!\nAnd welcome!'
         subject = 'Welcome to the awesomeness of Django/Pinax powered MyEWB.'
         self.ewb.send_mail_to_members(subject, body)
+        # nothing is sent until the queue is processed
+        self.assertEquals(0, len(mail.outbox))
+        call_command('send_group_mail')
         self.assertEquals(1, len(mail.outbox))
         msg = mail.outbox[0]
         self.assertEquals(msg.body, body)
@@ -111,12 +120,55 @@ class TestNetworkMail(TestCase):
         body = 'Hi!\nAnd welcome!'
         subject = 'Welcome to the awesomeness of Django/Pinax powered MyEWB.'
         self.waterloo.send_mail_to_members(subject, body)
+        call_command('send_group_mail')
         self.assertEquals(1, len(mail.outbox))
         msg = mail.outbox[0]
         self.assertEquals(msg.to, [u'list-ewb-uwaterloo@ewb.ca'])
         self.assertEquals(msg.from_email, u'University of Waterloo Chapter <ewb-uwaterloo@ewb.ca>')
         self.assertEquals(len(msg.bcc), len(self.waterloo.get_member_emails()))
 
+    def test_batches(self):
+        original = settings.GROUP_MAIL_BATCH_SIZE
+        settings.GROUP_MAIL_BATCH_SIZE = 1
+        try:
+            mailing = self.ewb.send_mail_to_members('Batched', 'Hi!')
+            call_command('send_group_mail')
+        finally:
+            settings.GROUP_MAIL_BATCH_SIZE = original
+        emails = self.ewb.get_member_emails()
+        self.assertEquals(len(emails), len(mail.outbox))
+        self.assertEquals(emails, [msg.bcc[0] for msg in mail.outbox])
+        self.assertEquals({'S': len(emails)}, mailing.delivery_status())
+
+        # running the worker again sends nothing new
+        call_command('send_group_mail')
+        self.assertEquals(len(emails), len(mail.outbox))
+
+    def test_stalled_batch(self):
+        mailing = self.ewb.send_mail_to_members('Stalled', 'Hi!')
+        mailing.expand()
+        batch = mailing.batches.get()
+        # a worker claimed the batch and died before sending
+        an_hour_ago = datetime.datetime.now() - datetime.timedelta(seconds=settings.GROUP_MAIL_SEND_TIMEOUT + 60)
+        GroupMailBatch.objects.filter(id=batch.id).update(status='W', claimed=an_hour_ago)
+
+        call_command('send_group_mail')
+        self.assertEquals(1, len(mail.outbox))
+        batch = GroupMailBatch.objects.get(id=batch.id)
+        self.assertEquals('S', batch.status)
+        self.assertEquals(2, batch.attempts)
+
+    def test_batch_being_sent(self):
+        mailing = self.ewb.send_mail_to_members('Sending', 'Hi!')
+        mailing.expand()
+        batch = mailing.batches.get()
+        GroupMailBatch.objects.filter(id=batch.id).update(status='W', claimed=datetime.datetime.now())
+
+        # another worker is still on it
+        call_command('send_group_mail')
+        self.assertEquals(0, len(mail.outbox))
+        self.assertEquals('W', GroupMailBatch.objects.get(id=batch.id).status)
+
 
 class TestNetworkTopicMail(TestCase):
     """
@@ -134,11 +186,30 @@ class TestNetworkTopicMail(TestCase):
     def test_new_topic_with_email(self):
         response = self.client.post('/networks/ewb/posts/', {'title': 'first post', 'body':'Lets make a new topic.', 'send_as_email': True, 'tags':'first, post', 'attach_count':0,})
         self.assertEquals(response.status_code, 302)
+        call_command('send_group_mail')
         self.assertEquals(1, len(mail.outbox))
         self.assertEquals(len(self.ewb.get_member_emails()), len(mail.outbox[0].bcc))
+        topic = GroupTopic.objects.get(title='first post')
+        self.assertEquals({'sent': 1, 'failed': 0, 'total': 1}, topic.email_status())
+
+    def test_new_topic_with_personal_footers(self):
+        original = settings.GROUP_MAIL_PERSONAL_FOOTERS
+        settings.GROUP_MAIL_PERSONAL_FOOTERS = True
+        try:
+            response = self.client.post('/networks/ewb/posts/', {'title': 'first post', 'body':'Lets make a new topic.', 'send_as_email': True, 'tags':'first, post', 'attach_count':0,})
+            call_command('send_group_mail')
+        finally:
+            settings.GROUP_MAIL_PERSONAL_FOOTERS = original
+        # each member gets their own copy, with their own unsubscribe link
+        emails = self.ewb.get_member_emails()
+        self.assertEquals(emails, [msg.to[0] for msg in mail.outbox])
+        for msg in mail.outbox:
+            self.assertEquals(msg.bcc, [])
+            self.assertTrue('?email=%s"' % urlquote(msg.to[0]) in msg.body)
 
     def test_new_topic_without_email(self):
         response = self.client.post('/networks/ewb/topics/', {'title': 'second post', 'body':'But no email this time', 'send_as_email': False, 'tags':'second, post'})
+        call_command('send_group_mail')
         self.assertEquals(0, len(mail.outbox))
 
 class TestBulkMembers(TestCase):
@@ -173,6 +244,7 @@ class TestBulkMembers(TestCase):
         self.assertFalse(bulk_user in self.ewb.get_accepted_members())
 
         self.ewb.send_mail_to_members('Test', 'Mail')
+        call_command('send_group_mail')
         msg = mail.outbox[0]
         # bulk user should get an email
         self.assertTrue('test@server.com' in msg.bcc)
@@ -289,3 +361,65 @@ class TestCustomGroupMemberManager(TestCase):
         self.client.post('/networks/new-net/bulk/', {'emails':'bulk@test.ca'})
         self.assertTrue('bulk@test.ca' in [member.user.email for member in self.new_network.members.bulk()])
 
+
+class TestBulkImportJob(TestCase):
+    """
+    Tests the bulk import engine behind the bulk import view.
+    """
+    fixtures = ['test_networks.json']
+
+    def setUp(self):
+        self.superman = User.objects.get(username='superman')
+        self.joe = User.objects.get(username='joe')
+        self.network = Network.objects.create(slug='new-net', name='new network', creator=self.superman)
+
+    def test_results(self):
+        bob = User.objects.get(username='bob')
+        self.network.add_member(bob)
+        job = BulkImportJob.objects.create(group=self.network, creator=self.superman)
+        job.add_emails(['new@server.com', self.joe.email, 'new@server.com', bob.email])
+        self.assertEquals(3, job.total)
+        job.run()
+
+        self.assertEquals('D', job.status)
+        self.assertEquals(3, job.processed)
+        results = dict(job.entries.values_list('email', 'result'))
+        self.assertEquals('C', results['new@server.com'])
+        self.assertEquals('A', results[self.joe.email])
+        self.assertEquals('M', results[bob.email])
+        self.assertTrue(get_email_user('new@server.com').is_bulk)
+        self.assertTrue(self.network.user_is_member(self.joe))
+        self.assertEquals(4, self.network.members.count())
+
+    def test_resume(self):
+        job = BulkImportJob.objects.create(group=self.network, creator=self.superman)
+        job.add_emails(['one@server.com', 'two@server.com'])
+        # pretend the first address was done before a crash
+        job.run_chunk()
+        job.entries.filter(email='two@server.com').update(result='P', user=None)
+        # whose worker has been gone for longer than the claim timeout
+        BulkImportJob.objects.filter(id=job.id).update(status='R',
+                claimed=datetime.datetime.now() - datetime.timedelta(seconds=BULK_IMPORT_CLAIM_TIMEOUT + 60))
+
+        call_command('run_bulk_imports')
+        job = BulkImportJob.objects.get(id=job.id)
+        self.assertEquals('D', job.status)
+        self.assertEquals(0, job.entries.filter(result='P').count())
+        # the repeated address is only counted once
+        self.assertEquals(2, job.processed)
+        self.assertEquals(2, self.network.members.bulk().count())
+
+    def test_claimed(self):
+        job = BulkImportJob.objects.create(group=self.network, creator=self.superman)
+        job.add_emails(['one@server.com'])
+        # another worker is running it
+        self.assertTrue(BulkImportJob.objects.get(id=job.id).claim())
+        self.assertFalse(job.run())
+        call_command('run_bulk_imports')
+        self.assertEquals(1, job.entries.filter(result='P').count())
+
+        # ...or was, until it died
+        BulkImportJob.objects.filter(id=job.id).update(claimed=datetime.datetime.now() - datetime.timedelta(days=1))
+        call_command('run_bulk_imports')
+        self.assertEquals('D', BulkImportJob.objects.get(id=job.id).status)
+        self.assertEquals(0, job.entries.filter(result='P').count())
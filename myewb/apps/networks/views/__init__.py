@@ -18,7 +18,7 @@ from django.contrib.auth.models import User
 from django.utils.translation import ugettext as _
 from emailconfirmation.models import EmailAddress
 
-from networks.models import Network
+from networks.models import Network, BulkImportJob
 from networks.forms import NetworkForm, NetworkBulkImportForm, NetworkUnsubscribeForm
 from siteutils.helpers import get_email_user
 
@@ -28,6 +28,7 @@ from base_groups.models import BaseGroup, GroupMember, GroupLocation
 from base_groups.forms import GroupMemberForm, GroupInviteForm, EditGroupMemberForm, GroupLocationForm
 from base_groups.helpers import *
 from base_groups.decorators import group_admin_required
+from siteutils.pagecache import anonymous_page_cache
 
 INDEX_TEMPLATE = 'networks/networks_index.html'
 NEW_TEMPLATE = 'networks/new_network.html'
@@ -43,6 +44,9 @@ MEM_INVITE_TEMPLATE = 'networks/invite_member.html'
 MEM_EDIT_TEMPLATE = 'networks/edit_member.html'
 MEM_DETAIL_TEMPLATE = 'networks/member_detail.html'
 
+# bulk imports of up to this many addresses are done within the request
+BULK_IMPORT_INLINE_LIMIT = 200
+
 
 DEFAULT_OPTIONS = {"check_create": True}
 
@@ -55,6 +59,7 @@ def new_network(request, form_class=NetworkForm, template_name=NEW_TEMPLATE,
         index_template_name=INDEX_TEMPLATE):
     return new_group(request, Network, GroupMember, form_class, template_name, index_template_name, DEFAULT_OPTIONS)
 
+@anonymous_page_cache('group:%(group_slug)s')
 def network_detail(request, group_slug, form_class=NetworkForm, template_name=DETAIL_TEMPLATE,
         edit_template_name=EDIT_TEMPLATE):
     network = get_object_or_404(Network, slug=group_slug)
@@ -125,19 +130,16 @@ def bulk_import(request, group_slug, form_class=NetworkBulkImportForm, template_
             raw_emails = form.cleaned_data['emails']
             emails = raw_emails.split()   # splits by whitespace characters
             
-            for email in emails:
-                email_user = get_email_user(email)
-                if email_user is None:
-                    username = User.objects.make_random_password()     # not a password per se, just a random string
-                    while User.objects.filter(username=username).count() > 0:   # ensure uniqueness
-                        username = User.objects.make_random_password()
-                    email_user = User.extras.create_bulk_user(username, email)      # sets "unusable" password
-                
-                existing_members = group.members.filter(user=email_user)
-                if existing_members.count() == 0:              
-                    nm = group.add_member(email_user)
-            # redirect to network home page on success
-            return HttpResponseRedirect(reverse('network_detail', kwargs={'group_slug': group.slug}))
+            job = BulkImportJob.objects.create(group=group, creator=request.user)
+            job.add_emails(emails)
+            
+            # short lists are handled right away; longer ones are left for the
+            # run_bulk_imports command, and we show its progress instead
+            if job.total <= BULK_IMPORT_INLINE_LIMIT and job.run():
+                # redirect to network home page on success
+                return HttpResponseRedirect(reverse('network_detail', kwargs={'group_slug': group.slug}))
+            return HttpResponseRedirect(reverse('network_bulk_import_status',
+                                                kwargs={'group_slug': group.slug, 'job_id': job.id}))
     else:
         form = form_class()
     return render_to_response(template_name, {
@@ -145,10 +147,20 @@ def bulk_import(request, group_slug, form_class=NetworkBulkImportForm, template_
         "form": form,
     }, context_instance=RequestContext(request))
 
+@group_admin_required()
+def bulk_import_status(request, group_slug, job_id, template_name='networks/bulk_import_status.html'):
+    group = get_object_or_404(Network, slug=group_slug)
+    job = get_object_or_404(BulkImportJob, id=job_id, group=group)
+    return render_to_response(template_name, {
+        "group": group,
+        "job": job,
+        "entries": job.entries.exclude(result='P').select_related('user'),
+    }, context_instance=RequestContext(request))
+
 def unsubscribe(request, form_class=NetworkUnsubscribeForm, template_name='networks/unsubscribe.html'):
+    message = None
     if request.method == 'POST':
         form = form_class(request.POST)
-        message = None
         if form.is_valid():
             email = form.cleaned_data['email']            
             email_user = get_email_user(email)
@@ -159,7 +171,8 @@ def unsubscribe(request, form_class=NetworkUnsubscribeForm, template_name='netwo
             else:
                 message = _("The email address you entered is not listed in our records as a mailing list recipient. Please ensure you entered the address correctly, or enter another email address.")
     
-    form = form_class()
+    # the footer of group emails links here with the recipient's address
+    form = form_class(initial={'email': request.GET.get('email', '')})
     return render_to_response(template_name, {
         "form": form,
         "message": message,
@@ -0,0 +1,46 @@
+from django.contrib.auth.models import User
+from django.core.management.base import NoArgsCommand
+from django.db import connection, transaction
+
+from group_topics.models import GroupTopic
+from profiles.models import ActivityCounts
+from threadedcomments.models import ThreadedComment
+from wiki.models import ChangeSet
+
+
+class Command(NoArgsCommand):
+    help = "Recomputes the post, reply and whiteboard edit totals shown on profiles."
+
+    def handle_noargs(self, **options):
+        cursor = connection.cursor()
+        qn = connection.ops.quote_name
+        
+        def totals(model, field):
+            field = model._meta.get_field(field)
+            column = 't.%s' % qn(field.column)
+            sql = "SELECT %s, COUNT(*) FROM %s t" % (column, qn(field.model._meta.db_table))
+            if field.model is not model:
+                # an inherited field (ie GroupTopic's creator, stored with
+                # the Topic): only count rows of the subclass
+                sql += " INNER JOIN %s sub ON sub.%s = t.%s" % (
+                           qn(model._meta.db_table), qn(model._meta.pk.column), qn(field.model._meta.pk.column))
+            cursor.execute(sql + " GROUP BY %s" % column)
+            return dict(cursor.fetchall())
+        
+        topic_counts = totals(GroupTopic, 'creator')
+        comment_counts = totals(ThreadedComment, 'user')
+        edit_counts = totals(ChangeSet, 'editor')
+        
+        existing = dict((c.pk, c) for c in ActivityCounts.objects.all())
+        fixed = 0
+        for user_id in User.objects.values_list('id', flat=True):
+            counts = existing.get(user_id, None) or ActivityCounts(pk=user_id)
+            new_counts = (topic_counts.get(user_id, 0), comment_counts.get(user_id, 0), edit_counts.get(user_id, 0))
+            if (counts.topic_count, counts.comment_count, counts.whiteboard_edit_count) != new_counts \
+                    or user_id not in existing:
+                counts.topic_count, counts.comment_count, counts.whiteboard_edit_count = new_counts
+                counts.save()
+                fixed += 1
+        
+        transaction.commit_unless_managed()
+        return 'Fixed totals for %d users.' % fixed
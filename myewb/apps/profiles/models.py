@@ -10,10 +10,10 @@ Last modified: 2009-07-31
 """
 
 
-from django.db import models
+from django.db import models, connection, transaction
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_save, pre_save, post_delete
 from django.utils.translation import ugettext_lazy as _
 from django.contrib.localflavor.ca.forms import CASocialInsuranceNumberField
 from django.contrib.contenttypes import generic
@@ -28,6 +28,8 @@ from networks.models import Network
 from datetime import date, datetime
 from siteutils.countries import CountryField
 from siteutils.models import Address, PhoneNumber
+from threadedcomments.models import ThreadedComment
+from wiki.models import ChangeSet
 
 class Passport(models.Model):
   profile = models.ForeignKey(Profile, related_name="passports", blank=True)
@@ -236,6 +238,89 @@ def set_primary_email(sender, instance=None, **kwargs):
 
 post_save.connect(set_primary_email, sender=EmailAddress)
     
+class ActivityCounts(models.Model):
+    """
+    Denormalized totals of a user's posts, replies and whiteboard edits,
+    for profiles and bylines.
+    
+    Like GroupCounts, these live in their own table so that saving a user
+    or profile can never write stale totals back over them.  Kept up to
+    date by adjust_activity_count; the recount_activity management command
+    repairs any drift.
+    """
+    user = models.OneToOneField(User, primary_key=True, related_name="activity_counts", verbose_name=_('user'))
+    topic_count = models.PositiveIntegerField(_('topic count'), default=0)
+    comment_count = models.PositiveIntegerField(_('comment count'), default=0)
+    whiteboard_edit_count = models.PositiveIntegerField(_('whiteboard edit count'), default=0)
+
+    def __unicode__(self):
+        return "%s (%d posts, %d replies, %d whiteboard edits)" % (
+            self.user, self.topic_count, self.comment_count, self.whiteboard_edit_count)
+
+def recount_activity(user_id):
+    """
+    Recomputes a user's totals from scratch.
+    """
+    # imported here: group_topics imports this module
+    from group_topics.models import GroupTopic
+    
+    counts, created = ActivityCounts.objects.get_or_create(pk=user_id)
+    counts.topic_count = GroupTopic.objects.filter(creator=user_id).count()
+    counts.comment_count = ThreadedComment.objects.filter(user=user_id).count()
+    counts.whiteboard_edit_count = ChangeSet.objects.filter(editor=user_id).count()
+    counts.save()
+    return counts
+
+def get_activity_counts(user):
+    """
+    A user's totals: one primary key lookup, or a recount the first time.
+    """
+    try:
+        return ActivityCounts.objects.get(pk=user.id)
+    except ActivityCounts.DoesNotExist:
+        return recount_activity(user.id)
+
+def adjust_activity_count(user_id, field, amount):
+    """
+    Atomically adds amount (which may be negative) to one of a user's
+    totals.  field is 'topic_count', 'comment_count' or
+    'whiteboard_edit_count'.
+    """
+    if user_id is None:
+        return
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    cursor.execute("UPDATE %s SET %s = %s + %%s WHERE %s = %%s" % (
+                       qn(ActivityCounts._meta.db_table), qn(field), qn(field),
+                       qn(ActivityCounts._meta.pk.column)),
+                   [amount, user_id])
+    updated = cursor.rowcount
+    transaction.commit_unless_managed()
+    
+    if not updated and User.objects.filter(id=user_id).count():
+        # no totals yet for this user (and they aren't being deleted)
+        recount_activity(user_id)
+
+# posts are counted from group_topics.models
+
+def count_new_comment(sender, instance, created, **kwargs):
+    if created:
+        adjust_activity_count(instance.user_id, 'comment_count', 1)
+post_save.connect(count_new_comment, sender=ThreadedComment, dispatch_uid='threadedcommentactivity')
+
+def count_removed_comment(sender, instance, **kwargs):
+    adjust_activity_count(instance.user_id, 'comment_count', -1)
+post_delete.connect(count_removed_comment, sender=ThreadedComment, dispatch_uid='threadedcommentdeleteactivity')
+
+def count_new_changeset(sender, instance, created, **kwargs):
+    if created:
+        adjust_activity_count(instance.editor_id, 'whiteboard_edit_count', 1)
+post_save.connect(count_new_changeset, sender=ChangeSet, dispatch_uid='changesetactivity')
+
+def count_removed_changeset(sender, instance, **kwargs):
+    adjust_activity_count(instance.editor_id, 'whiteboard_edit_count', -1)
+post_delete.connect(count_removed_changeset, sender=ChangeSet, dispatch_uid='changesetdeleteactivity')
+    
 class StudentRecordManager(models.Manager):
     def get_from_view_args(self, *args, **kwargs):
         username = kwargs.get('username') or (len(args) > 0 and args[0])
@@ -13,6 +13,7 @@ import re
 
 from django.contrib.auth.models import User
 from django.core import mail
+from django.core.management import call_command
 from django.core.urlresolvers import reverse
 from django.test import TestCase
 from django.test.client import Client
@@ -23,7 +24,10 @@ from emailconfirmation.models import EmailAddress
 from mailer import engine 
 
 from profiles.forms import ProfileForm, StudentRecordForm
-from profiles.models import MemberProfile, StudentRecord
+from base_groups.models import BaseGroup
+from group_topics.models import GroupTopic
+from profiles.models import MemberProfile, StudentRecord, ActivityCounts, get_activity_counts
+from threadedcomments.models import ThreadedComment
 
 
 class TestMemberProfile(TestCase):
@@ -266,3 +270,37 @@ class TestEmailVerification(TestCase):
         self.assertEquals(email_address.primary, False)
 
 
+
+class TestActivityCounts(TestCase):
+    """
+    A user's post and reply totals follow their posts and replies, and can
+    be recounted from scratch
+    """
+    
+    def setUp(self):
+        self.user = User.objects.create_user('poster', 'poster@ewb.ca', 'password')
+        self.group = BaseGroup.objects.create(slug='countgrp', name='count group', creator=self.user,
+                                              model='Network', visibility='E')
+    
+    def tearDown(self):
+        ThreadedComment.objects.all().delete()
+        GroupTopic.objects.all().delete()
+        BaseGroup.objects.all().delete()
+        User.objects.all().delete()
+    
+    def test_counts(self):
+        topic = GroupTopic.objects.create(title="post", body="text", group=self.group, creator=self.user)
+        comment = ThreadedComment.objects.create(content_object=topic, user=self.user, comment='reply')
+        counts = get_activity_counts(self.user)
+        self.assertEquals((counts.topic_count, counts.comment_count), (1, 1))
+        
+        comment.delete()
+        topic.delete()
+        counts = get_activity_counts(self.user)
+        self.assertEquals((counts.topic_count, counts.comment_count), (0, 0))
+    
+    def test_recount(self):
+        GroupTopic.objects.create(title="post", body="text", group=self.group, creator=self.user)
+        ActivityCounts.objects.filter(pk=self.user.id).update(topic_count=5)
+        call_command('recount_activity')
+        self.assertEquals(get_activity_counts(self.user).topic_count, 1)
@@ -26,6 +26,7 @@ from profiles.forms import StudentRecordForm, WorkRecordForm, MembershipForm
 
 from networks.models import Network
 from base_groups.models import GroupMember
+from search_index.models import filter_by_search
 from creditcard.forms import PaymentForm
 from creditcard.models import Payment, Product
 from friends_app.forms import InviteFriendForm
@@ -33,8 +34,7 @@ from friends_app.forms import InviteFriendForm
 def profiles(request, template_name="profiles/profiles.html"):
     search_terms = request.GET.get('search', '')
     if search_terms:
-        users = User.objects.filter(profile__name__icontains=search_terms) | \
-                        User.objects.filter(username__icontains=search_terms)
+        users = filter_by_search(User.objects.all(), search_terms)
     else:
         users = User.objects.all()
     users = users.order_by("profile__name")
@@ -0,0 +1,61 @@
+"""myEWB search index registrations
+
+Which models are searchable, and what is searched for each.
+
+This file is part of myEWB
+Copyright 2009 Engineers Without Borders (Canada) Organisation and/or volunteer contributors
+"""
+
+from django.contrib.auth.models import User
+from django.db.models.signals import post_init, post_save
+
+from pinax.apps.profiles.models import Profile
+
+from base_groups.models import BaseGroup, GroupMember
+from networks.models import Network
+from communities.models import Community
+from profiles.models import MemberProfile
+from search_index.models import register, index_object
+
+def group_fields(group):
+    return [(group.name, 3), (group.slug, 2), (group.description, 1)]
+
+# subclasses are indexed as BaseGroup, so one lookup covers every kind of group
+for model in (BaseGroup, Network, Community):
+    register(model, group_fields, index_model=BaseGroup)
+
+# email addresses are left out, so that the public profile search can't be
+# used to find out whether an address has an account
+def user_fields(user):
+    fields = [(user.username, 3), (user.first_name, 3), (user.last_name, 3)]
+    fields.extend([(name, 3) for name in Profile.objects.filter(user=user).values_list('name', flat=True)])
+    return fields
+
+# not re-indexed on saves that don't touch these (ie last_login, on every login)
+register(User, user_fields, watch=('username', 'first_name', 'last_name'))
+
+def remember_profile_name(sender, instance, **kwargs):
+    instance._indexed_name = instance.name
+post_init.connect(remember_profile_name, sender=MemberProfile)
+
+def reindex_profile_user(sender, instance, created=False, **kwargs):
+    """
+    The profile holds the user's display name, so a changed name means
+    re-indexing its user.  Other profile saves (ie the login count, on every
+    login) leave the index alone.
+    """
+    if created or instance.name != getattr(instance, '_indexed_name', None):
+        instance._indexed_name = instance.name
+        index_object(instance.user)
+post_save.connect(reindex_profile_user, sender=MemberProfile)
+
+def member_fields(member):
+    if member.is_admin:
+        return [(member.admin_title, 2)]
+    return []
+
+def member_scope(member):
+    return member.group_id
+
+# admin titles, searchable within their group
+register(GroupMember, member_fields, scope=member_scope)
@@ -0,0 +1,24 @@
+from django.core.management.base import NoArgsCommand
+from django.db import connection, transaction
+
+from search_index.models import SearchToken, index_object, _registry
+
+
+class Command(NoArgsCommand):
+    help = "Rebuilds the search index from scratch."
+
+    @transaction.commit_on_success
+    def handle_noargs(self, **options):
+        cursor = connection.cursor()
+        cursor.execute("DELETE FROM %s" % connection.ops.quote_name(SearchToken._meta.db_table))
+        
+        indexed = 0
+        for model, (index_model, fields, scope, watch) in _registry.items():
+            # subclasses indexed under a base model (ie Network) are already
+            # covered by the base model's manager
+            if index_model is not model:
+                continue
+            for instance in model._default_manager.all().iterator():
+                index_object(instance)
+                indexed += 1
+        return 'Indexed %d objects.' % indexed
@@ -0,0 +1,250 @@
+"""myEWB search index
+
+A small inverted index kept in the database: every indexed object is
+broken into lowercase word tokens, stored one row per (token, object), so
+that searches are range scans on the token index instead of
+LIKE '%...%' scans over the searched tables.
+
+Models are added with register(); the index is updated from their save and
+delete signals and can be rebuilt with the rebuild_search_index command.
+
+This file is part of myEWB
+Copyright 2009 Engineers Without Borders (Canada) Organisation and/or volunteer contributors
+"""
+
+import re
+import unicodedata
+
+from django.db import models, connection, transaction
+from django.db.models.query import QuerySet
+from django.db.models.signals import post_init, post_save, post_delete
+from django.contrib.contenttypes.models import ContentType
+from django.utils.html import escape, strip_tags
+from django.utils.safestring import mark_safe
+
+# longer words are indexed (and matched) by their first TOKEN_LENGTH characters
+TOKEN_LENGTH = 40
+
+class SearchToken(models.Model):
+    """
+    One word of one indexed object.  scope narrows a search down, ie to the
+    members of a single group.
+    """
+    token = models.CharField(max_length=TOKEN_LENGTH, db_index=True)
+    content_type = models.ForeignKey(ContentType)
+    object_id = models.PositiveIntegerField()
+    weight = models.PositiveSmallIntegerField(default=1)
+    scope = models.PositiveIntegerField(null=True, blank=True)
+
+    def __unicode__(self):
+        return "%s: %s %d" % (self.token, self.content_type, self.object_id)
+
+def tokenize(text):
+    """
+    Splits text into lowercase ASCII words (accents are dropped, as in
+    group slugs).
+    """
+    if not text:
+        return []
+    text = unicodedata.normalize('NFKD', unicode(text)).encode('ASCII', 'ignore').lower()
+    return [word[:TOKEN_LENGTH] for word in re.findall(r'[a-z0-9]+', text)]
+
+def prefix_range(token):
+    """
+    Bounds for tokens starting with token: every token character sorts
+    below '{', so [token, token + '{') is exactly the words it begins.
+    """
+    return token, token + '{'
+
+# model -> (index model, fields function, scope function, watched attributes)
+_registry = {}
+
+def register(model, fields, index_model=None, scope=None, watch=None):
+    """
+    Indexes instances of model.  fields(instance) returns a list of
+    (text, weight) pairs; scope(instance), if given, returns the instance's
+    scope.  Subclasses (ie Network) can share a base model's entries by
+    passing it as index_model.
+    
+    If watch lists the attributes fields() reads, a saved instance is only
+    re-indexed when one of them has changed since it was loaded (anything
+    else fields() depends on has to call index_object itself).
+    """
+    _registry[model] = (index_model or model, fields, scope, watch)
+    if watch:
+        post_init.connect(remember_indexed_values, sender=model)
+    post_save.connect(update_index, sender=model)
+    post_delete.connect(remove_from_index, sender=model)
+
+def _indexed_values(instance, watch):
+    return [getattr(instance, name) for name in watch]
+
+def index_object(instance):
+    """
+    Replaces the tokens stored for instance.
+    """
+    index_model, fields, scope, watch = _registry[instance.__class__]
+    content_type = ContentType.objects.get_for_model(index_model)
+    
+    weights = {}
+    for text, weight in fields(instance):
+        for token in tokenize(text):
+            weights[token] = max(weight, weights.get(token, 0))
+    object_scope = scope and scope(instance) or None
+    
+    qn = connection.ops.quote_name
+    table = qn(SearchToken._meta.db_table)
+    cursor = connection.cursor()
+    cursor.execute("DELETE FROM %s WHERE %s = %%s AND %s = %%s" % (
+                       table, qn('content_type_id'), qn('object_id')),
+                   [content_type.id, instance.pk])
+    if weights:
+        cursor.executemany("INSERT INTO %s (%s, %s, %s, %s, %s) VALUES (%%s, %%s, %%s, %%s, %%s)" % (
+                               table, qn('token'), qn('content_type_id'), qn('object_id'),
+                               qn('weight'), qn('scope')),
+                           [[token, content_type.id, instance.pk, weight, object_scope]
+                            for token, weight in weights.items()])
+    transaction.commit_unless_managed()
+
+def remember_indexed_values(sender, instance, **kwargs):
+    instance._indexed_values = _indexed_values(instance, _registry[sender][3])
+
+def update_index(sender, instance, created=False, **kwargs):
+    watch = _registry[sender][3]
+    if watch:
+        values = _indexed_values(instance, watch)
+        if not created and values == getattr(instance, '_indexed_values', None):
+            return
+        instance._indexed_values = values
+    index_object(instance)
+
+def remove_from_index(sender, instance, **kwargs):
+    index_model = _registry[sender][0]
+    SearchToken.objects.filter(content_type=ContentType.objects.get_for_model(index_model),
+                               object_id=instance.pk).delete()
+
+def matching_ids(model, term, scope=None):
+    """
+    Returns a (values) queryset of the ids of model instances with a word
+    starting with term, for use as an id__in filter.
+    """
+    low, high = prefix_range(term)
+    tokens = SearchToken.objects.filter(content_type=ContentType.objects.get_for_model(model),
+                                        token__gte=low, token__lt=high)
+    if scope is not None:
+        tokens = tokens.filter(scope=scope)
+    return tokens.values('object_id')
+
+def filter_by_search(queryset, search_terms, field='id', model=None, scope=None):
+    """
+    Narrows queryset down to the objects matching every word in
+    search_terms (each as a prefix).  field is the queryset's field holding
+    the indexed object's id, and model the indexed model if it differs
+    from the queryset's.
+    """
+    model = model or queryset.model
+    for term in tokenize(search_terms):
+        queryset = queryset.filter(**{'%s__in' % field: matching_ids(model, term, scope)})
+    return queryset
+
+def _scope_sql(scope, qn):
+    """
+    SQL condition (and params) restricting tokens to a scope, or to any of
+    a list of scopes, or to the scopes selected by a (values) queryset.
+    """
+    if scope is None:
+        return '', []
+    if isinstance(scope, (int, long)):
+        return ' AND %s = %%s' % qn('scope'), [scope]
+    if isinstance(scope, QuerySet):
+        sql, params = scope.order_by().query.as_sql()
+        return ' AND %s IN (%s)' % (qn('scope'), sql), list(params)
+    scope = list(scope)
+    return ' AND %s IN (%s)' % (qn('scope'), ', '.join(['%s'] * len(scope))), scope
+
+def search_scores(model, search_terms, scope=None, limit=None):
+    """
+    Returns (id, score) for the model instances matching every word in
+    search_terms, best matches first.  An object's score is the sum, over
+    the search words, of the weight of the best field each word matched in.
+    scope is a single scope, a list of them, or a (values) queryset
+    selecting them, which is run as a subquery.
+    
+    The matching and ranking are done by the database in one query, so
+    only the ids asked for come back, however common the words.
+    """
+    terms = tokenize(search_terms)
+    if not terms or (isinstance(scope, (list, tuple, set)) and not scope):
+        return []
+    
+    qn = connection.ops.quote_name
+    content_type = ContentType.objects.get_for_model(model)
+    scope_sql, scope_params = _scope_sql(scope, qn)
+    
+    # the best weight of each object for each word, then summed over words;
+    # objects missing a word have fewer rows than there are words
+    term_sql = "SELECT %s, MAX(%s) AS best FROM %s WHERE %s = %%s AND %s >= %%s AND %s < %%s%s GROUP BY %s" % (
+                   qn('object_id'), qn('weight'), qn(SearchToken._meta.db_table), qn('content_type_id'),
+                   qn('token'), qn('token'), scope_sql, qn('object_id'))
+    sql = "SELECT %s, SUM(best) AS score FROM (%s) matches GROUP BY %s HAVING COUNT(*) = %%s " \
+          "ORDER BY score DESC, %s" % (qn('object_id'), ' UNION ALL '.join([term_sql] * len(terms)),
+                                       qn('object_id'), qn('object_id'))
+    params = []
+    for term in terms:
+        params.extend([content_type.id] + list(prefix_range(term)) + scope_params)
+    params.append(len(terms))
+    if limit:
+        sql += " LIMIT %d" % limit
+    
+    cursor = connection.cursor()
+    cursor.execute(sql, params)
+    return [(int(id), int(score)) for id, score in cursor.fetchall()]
+
+def search(model, search_terms, scope=None, limit=None):
+    """
+    Returns the ids of model instances matching every word in search_terms,
+    best matches first (see search_scores).
+    """
+    return [id for id, score in search_scores(model, search_terms, scope, limit)]
+
+def highlight(text, search_terms, length=200):
+    """
+    A plain-text excerpt of about length characters of text (HTML tags are
+    stripped), around the first word matching a search word, with the
+    matching words wrapped in <strong class="highlight">.
+    """
+    terms = tokenize(search_terms)
+    text = ' '.join(strip_tags(text or '').split())
+    
+    def matches(word):
+        return [t for t in tokenize(word) for term in terms if t.startswith(term)]
+    
+    words = list(re.finditer(r'\w+', text, re.UNICODE))
+    first = [w.start() for w in words if matches(w.group())]
+    start = first and max(0, first[0] - length / 4) or 0
+    if start:
+        # don't start halfway through a word
+        space = text.find(' ', start)
+        start = space == -1 and start or space + 1
+    end = min(len(text), start + length)
+    
+    parts = []
+    position = start
+    for word in words:
+        if word.start() < start or word.end() > end:
+            continue
+        if matches(word.group()):
+            parts.append(escape(text[position:word.start()]))
+            parts.append(u'<strong class="highlight">%s</strong>' % escape(word.group()))
+            position = word.end()
+    parts.append(escape(text[position:end]))
+    
+    excerpt = u''.join(parts)
+    if start > 0:
+        excerpt = u'...' + excerpt
+    if end < len(text):
+        excerpt += u'...'
+    return mark_safe(excerpt)
+
+# what we index
+from search_index import indexes
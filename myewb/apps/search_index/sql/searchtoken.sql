@@ -0,0 +1,3 @@
+-- searches read a token range of one model (optionally within scopes), and
+-- need only the object and weight of each row
+CREATE INDEX search_index_searchtoken_lookup ON search_index_searchtoken (content_type_id, token, scope, object_id, weight);
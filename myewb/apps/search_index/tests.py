@@ -0,0 +1,91 @@
+import datetime
+
+from django.test import TestCase
+from django.contrib.auth.models import User
+
+from base_groups.models import BaseGroup, GroupMember
+from networks.models import Network
+from search_index.models import SearchToken, tokenize, search, filter_by_search, highlight
+
+class TestSearchIndex(TestCase):
+    """
+    Tests that the index follows changes to indexed objects and that prefix
+    searches find them.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('jsmith', 'john.smith@ewb.ca')
+        self.other = User.objects.create_user('other', 'other@ewb.ca')
+        self.network = Network.objects.create(slug='ewb-uwaterloo', name='University of Waterloo Chapter',
+                                              description='Waterloo, ON', creator=self.user)
+
+    def test_tokenize(self):
+        self.assertEquals(['montreal', 'qc', 'john', 'smith', 'ewb', 'ca'],
+                          tokenize(u'Montr\xe9al, QC john.smith@ewb.ca'))
+
+    def test_highlight(self):
+        self.assertEquals(u'The <strong class="highlight">Waterloo</strong> chapter',
+                          highlight('<p>The Waterloo chapter</p>', 'water'))
+        excerpt = highlight(' '.join(['word'] * 100 + ['Waterloo'] + ['word'] * 100), 'waterloo', length=40)
+        self.assertTrue(excerpt.startswith('...') and excerpt.endswith('...'))
+        self.assertTrue('<strong class="highlight">Waterloo</strong>' in excerpt)
+
+    def test_prefix_search(self):
+        groups = BaseGroup.objects.all()
+        self.assertEquals([self.network.id], [g.id for g in filter_by_search(groups, 'waterl', model=BaseGroup)])
+        self.assertEquals([self.network.id], [g.id for g in filter_by_search(groups, 'univ chap', model=BaseGroup)])
+        self.assertEquals([], list(filter_by_search(groups, 'univ toronto', model=BaseGroup)))
+
+    def test_updates(self):
+        self.network.name = 'Grand River Professional Chapter'
+        self.network.save()
+        self.assertEquals([self.network.id], search(BaseGroup, 'grand'))
+        self.assertEquals([], search(BaseGroup, 'university'))
+
+        self.network.delete()
+        self.assertEquals([], search(BaseGroup, 'grand'))
+
+    def test_users(self):
+        self.user.first_name = 'John'
+        self.user.last_name = 'Smith'
+        self.user.save()
+        self.assertEquals([self.user.id], search(User, 'john smi'))
+        # email addresses aren't searchable
+        self.assertEquals([], search(User, 'ewb'))
+        profile = self.other.get_profile()
+        profile.first_name = 'Johnny'
+        profile.save()
+        self.assertEquals(set([self.user.id, self.other.id]), set(search(User, 'john')))
+
+    def test_unchanged_user_not_reindexed(self):
+        SearchToken.objects.all().delete()
+        user = User.objects.get(id=self.user.id)
+        user.last_login = datetime.datetime.now()
+        user.save()
+        self.assertEquals([], search(User, 'jsmith'))
+        user.first_name = 'John'
+        user.save()
+        self.assertEquals([self.user.id], search(User, 'jsmith'))
+
+    def test_login_not_reindexed(self):
+        self.user.set_password('passw0rd')
+        self.user.save()
+        SearchToken.objects.all().delete()
+        response = self.client.post('/account/login/', {'login_name': 'jsmith', 'password': 'passw0rd'})
+        self.assertEquals(response.status_code, 302)
+        self.assertEquals(0, SearchToken.objects.count())
+
+    def test_ranking(self):
+        # a name match counts for more than a description match
+        ottawa = Network.objects.create(slug='ewb-ottawa', name='Ottawa', description='The capital chapter',
+                                        creator=self.user)
+        self.assertEquals([self.network.id, ottawa.id], search(BaseGroup, 'chapter'))
+
+    def test_admin_titles_scoped(self):
+        member = self.network.members.get(user=self.user)
+        member.admin_title = 'President'
+        member.save()
+        self.assertEquals([member.id], search(GroupMember, 'pres', scope=self.network.id))
+        self.assertEquals([], search(GroupMember, 'pres', scope=self.network.id + 1))
+        self.assertEquals([member.id], search(GroupMember, 'pres', scope=[self.network.id + 1, self.network.id]))
+        self.assertEquals([], search(GroupMember, 'pres', scope=[]))
@@ -0,0 +1,55 @@
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import NoArgsCommand
+from django.db import connection, transaction
+
+from tagging.models import TaggedItem
+
+from base_groups.models import BaseGroup
+from group_topics.models import GroupTopic
+from tag_app.models import TagPosting, TagCount, _insert_tag_counts
+
+
+class Command(NoArgsCommand):
+    help = "Rebuilds the tag postings and tag counts from the tagged posts."
+
+    @transaction.commit_on_success
+    def handle_noargs(self, **options):
+        qn = connection.ops.quote_name
+        cursor = connection.cursor()
+        # straight SQL, so that the counts aren't adjusted row by row
+        cursor.execute("DELETE FROM %s" % qn(TagCount._meta.db_table))
+        cursor.execute("DELETE FROM %s" % qn(TagPosting._meta.db_table))
+        
+        modified = GroupTopic._meta.get_field('modified')
+        cursor.execute("INSERT INTO %(postings)s (%(tag)s, %(topic)s, %(group)s, %(public)s, %(modified)s) "
+                       "SELECT i.%(item_tag)s, gt.%(topic_pk)s, gt.%(parent_group)s, "
+                       "CASE WHEN g.%(visibility)s = %%s THEN %%s ELSE %%s END, t.%(topic_modified)s "
+                       "FROM %(items)s i "
+                       "INNER JOIN %(grouptopics)s gt ON gt.%(topic_pk)s = i.%(object_id)s "
+                       "INNER JOIN %(topics)s t ON t.%(modified_pk)s = gt.%(topic_pk)s "
+                       "INNER JOIN %(groups)s g ON g.%(group_pk)s = gt.%(parent_group)s "
+                       "WHERE i.%(content_type)s = %%s" % {
+                           'postings': qn(TagPosting._meta.db_table),
+                           'tag': qn('tag_id'), 'topic': qn('topic_id'), 'group': qn('group_id'),
+                           'public': qn('public'), 'modified': qn('modified'),
+                           'item_tag': qn(TaggedItem._meta.get_field('tag').column),
+                           'topic_pk': qn(GroupTopic._meta.pk.column),
+                           'parent_group': qn(GroupTopic._meta.get_field('parent_group').column),
+                           'visibility': qn('visibility'),
+                           'topic_modified': qn(modified.column),
+                           'items': qn(TaggedItem._meta.db_table),
+                           'grouptopics': qn(GroupTopic._meta.db_table),
+                           'topics': qn(modified.model._meta.db_table),
+                           'modified_pk': qn(modified.model._meta.pk.column),
+                           'groups': qn(BaseGroup._meta.db_table),
+                           'group_pk': qn(BaseGroup._meta.pk.column),
+                           'object_id': qn(TaggedItem._meta.get_field('object_id').column),
+                           'content_type': qn(TaggedItem._meta.get_field('content_type').column),
+                       },
+                       ['E', True, False, ContentType.objects.get_for_model(GroupTopic).id])
+        _insert_tag_counts()
+        # all raw SQL, which commit_on_success can't see
+        transaction.set_dirty()
+        
+        return 'Indexed %d tagged posts under %d tags.' % (
+            TagPosting.objects.count(), TagCount.objects.values('tag').distinct().count())
@@ -1,7 +1,15 @@
-from django.db import models
+from django.contrib.contenttypes.models import ContentType
+from django.db import models, connection, transaction
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
 from django.utils.translation import ugettext_lazy as _
 
-from tagging.models import Tag
+from tagging.models import Tag, TaggedItem
+
+from base_groups.models import BaseGroup, visible_groups_q
+from communities.models import Community
+from group_topics.models import GroupTopic
+from networks.models import Network
 
 class TagAlias(models.Model):
     """A simple class to hold aliased tags.  The idea is to link similar tags:
@@ -13,4 +21,194 @@ class TagAlias(models.Model):
 
     def __unicode__(self):
         return "%s => %s" % (self.alias, self.tag)
-    
\ No newline at end of file
+    
+class TagPostingManager(models.Manager):
+
+    def visible(self, user=None):
+        """
+        Postings of the posts that GroupTopic.objects.visible(user) shows,
+        decided from the group and public flag copied into each posting
+        rather than by joining through to the groups.
+        """
+        names = GroupTopic.objects.member_group_sets(user)
+        if names is None:
+            return self.get_query_set()
+        filter_q = Q(public=True)
+        if names:
+            filter_q |= visible_groups_q(user, names, field='group')
+        return self.get_query_set().filter(filter_q)
+
+class TagPosting(models.Model):
+    """
+    One tag on one post: the tag's TaggedItem, with what listing the tag's
+    posts needs (the post's group, whether that group is public, and when
+    the post was last modified) copied in, so that a tag page is a range
+    read on (tag, modified) with no visibility join.
+    
+    Kept up to date from TaggedItem, GroupTopic and group saves; the
+    rebuild_tag_index management command builds it from scratch.
+    """
+    tag = models.ForeignKey(Tag, related_name="postings", verbose_name=_('tag'))
+    topic = models.ForeignKey(GroupTopic, related_name="tag_postings", verbose_name=_('topic'))
+    group = models.ForeignKey(BaseGroup, related_name="tag_postings", verbose_name=_('group'))
+    public = models.BooleanField(_('public'))
+    modified = models.DateTimeField(_('modified'))
+
+    objects = TagPostingManager()
+
+    class Meta:
+        ordering = ('-modified', )
+        unique_together = (('tag', 'topic'), )
+
+    def __unicode__(self):
+        return "%s: %s" % (self.tag, self.topic)
+
+class TagCount(models.Model):
+    """
+    The number of posts carrying a tag, per visibility class: one row
+    (with no group) for the posts in public groups, and one for each
+    non-public group with posts carrying it.  A user's count for a tag is
+    the public row plus the rows of their groups.
+    """
+    tag = models.ForeignKey(Tag, related_name="counts", verbose_name=_('tag'))
+    group = models.ForeignKey(BaseGroup, related_name="tag_counts", verbose_name=_('group'), null=True)
+    count = models.PositiveIntegerField(_('count'), default=0)
+
+    class Meta:
+        unique_together = (('tag', 'group'), )
+
+    def __unicode__(self):
+        return "%s (%s): %d" % (self.tag, self.group or 'public', self.count)
+
+def _insert_tag_counts(where_sql='', params=[]):
+    """
+    Counts postings into TagCount (which must have no rows for the tags
+    counted), optionally only those matching where_sql.
+    """
+    qn = connection.ops.quote_name
+    postings = qn(TagPosting._meta.db_table)
+    counts = qn(TagCount._meta.db_table)
+    where_sql = where_sql and ' AND %s' % where_sql
+    cursor = connection.cursor()
+    cursor.execute("INSERT INTO %s (%s, %s, %s) SELECT %s, NULL, COUNT(*) FROM %s WHERE %s = %%s%s GROUP BY %s" % (
+                       counts, qn('tag_id'), qn('group_id'), qn('count'),
+                       qn('tag_id'), postings, qn('public'), where_sql, qn('tag_id')),
+                   [True] + params)
+    cursor.execute("INSERT INTO %s (%s, %s, %s) SELECT %s, %s, COUNT(*) FROM %s WHERE %s = %%s%s GROUP BY %s, %s" % (
+                       counts, qn('tag_id'), qn('group_id'), qn('count'),
+                       qn('tag_id'), qn('group_id'), postings, qn('public'), where_sql,
+                       qn('tag_id'), qn('group_id')),
+                   [False] + params)
+
+def recount_tags(tag_ids):
+    """
+    Recomputes the counts of the given tags from their postings.
+    """
+    tag_ids = list(tag_ids)
+    if not tag_ids:
+        return
+    TagCount.objects.filter(tag__in=tag_ids).delete()
+    _insert_tag_counts('%s IN (%s)' % (connection.ops.quote_name('tag_id'), ', '.join(['%s'] * len(tag_ids))),
+                       tag_ids)
+    transaction.commit_unless_managed()
+
+def adjust_tag_count(tag_id, group_id, amount):
+    """
+    Atomically adds amount (which may be negative) to a tag's count for a
+    non-public group, or for public groups if group_id is None.
+    """
+    qn = connection.ops.quote_name
+    if group_id is None:
+        group_sql, params = 'IS NULL', []
+    else:
+        group_sql, params = '= %s', [group_id]
+    cursor = connection.cursor()
+    cursor.execute("UPDATE %s SET %s = %s + %%s WHERE %s = %%s AND %s %s" % (
+                       qn(TagCount._meta.db_table), qn('count'), qn('count'),
+                       qn('tag_id'), qn('group_id'), group_sql),
+                   [amount, tag_id] + params)
+    updated = cursor.rowcount
+    transaction.commit_unless_managed()
+    
+    if not updated:
+        # first post of the tag in this class (or counts not built yet)
+        recount_tags([tag_id])
+
+def visible_tag_counts(user=None):
+    """
+    Returns {tag id: number of posts with the tag that user can see}.
+    """
+    names = GroupTopic.objects.member_group_sets(user)
+    counts = TagCount.objects.all()
+    if names is not None:
+        filter_q = Q(group__isnull=True)
+        if names:
+            filter_q |= visible_groups_q(user, names, field='group')
+        counts = counts.filter(filter_q)
+    
+    totals = {}
+    for tag_id, count in counts.filter(count__gt=0).values_list('tag', 'count'):
+        totals[tag_id] = totals.get(tag_id, 0) + count
+    return totals
+
+def _count_class(posting):
+    return not posting.public and posting.group_id or None
+
+def count_new_posting(sender, instance, created, **kwargs):
+    if created:
+        adjust_tag_count(instance.tag_id, _count_class(instance), 1)
+post_save.connect(count_new_posting, sender=TagPosting, dispatch_uid='tagpostingcount')
+
+def count_removed_posting(sender, instance, **kwargs):
+    adjust_tag_count(instance.tag_id, _count_class(instance), -1)
+post_delete.connect(count_removed_posting, sender=TagPosting, dispatch_uid='tagpostingdeletecount')
+
+def _is_public(group_id):
+    return BaseGroup.objects.filter(id=group_id, visibility='E').count() > 0
+
+def _is_topic_item(item):
+    return item.content_type_id == ContentType.objects.get_for_model(GroupTopic).id
+
+def add_posting(sender, instance, created, **kwargs):
+    if not created or not _is_topic_item(instance):
+        return
+    topics = GroupTopic.objects.filter(id=instance.object_id).values_list('parent_group', 'modified')
+    if topics:
+        group_id, modified = topics[0]
+        if not TagPosting.objects.filter(tag=instance.tag_id, topic=instance.object_id).count():
+            TagPosting.objects.create(tag_id=instance.tag_id, topic_id=instance.object_id, group_id=group_id,
+                                      public=_is_public(group_id), modified=modified)
+post_save.connect(add_posting, sender=TaggedItem, dispatch_uid='taggeditemposting')
+
+def remove_posting(sender, instance, **kwargs):
+    if _is_topic_item(instance):
+        # one at a time, so that the counts follow
+        for posting in TagPosting.objects.filter(tag=instance.tag_id, topic=instance.object_id):
+            posting.delete()
+post_delete.connect(remove_posting, sender=TaggedItem, dispatch_uid='taggeditemdeleteposting')
+
+def update_topic_postings(sender, instance, created, **kwargs):
+    if created:
+        return
+    postings = TagPosting.objects.filter(topic=instance)
+    moved = list(postings.exclude(group=instance.parent_group_id).values_list('tag', flat=True))
+    postings.update(modified=instance.modified)
+    if moved:
+        # the post changed groups
+        postings.update(group=instance.parent_group_id, public=_is_public(instance.parent_group_id))
+        recount_tags(moved)
+post_save.connect(update_topic_postings, sender=GroupTopic, dispatch_uid='grouptopictagpostings')
+
+def update_group_postings(sender, instance, **kwargs):
+    """
+    Moves a group's postings (and counts) between the public and the
+    group's own visibility class when the group is made public or private.
+    """
+    public = instance.visibility == 'E'
+    postings = TagPosting.objects.filter(group=instance).exclude(public=public)
+    tag_ids = list(postings.values_list('tag', flat=True).distinct())
+    if tag_ids:
+        postings.update(public=public)
+        recount_tags(tag_ids)
+for model, name in ((BaseGroup, 'basegroup'), (Network, 'network'), (Community, 'community')):
+    post_save.connect(update_group_postings, sender=model, dispatch_uid='%stagpostings' % name)
@@ -0,0 +1,2 @@
+-- a tag page reads one tag's postings, newest first
+CREATE INDEX tag_app_tagposting_tag_modified ON tag_app_tagposting (tag_id, modified);
@@ -1,6 +1,12 @@
+from django import template
 from django.template import Library
 from django.conf import settings
 
+from tagging.models import Tag
+from tagging.utils import calculate_cloud
+
+from tag_app.models import visible_tag_counts
+
 register = Library()
 
 @register.inclusion_tag("tag_app/tag_list.html")
@@ -12,4 +18,45 @@ def show_tags_for(obj):
 
 @register.inclusion_tag("tag_app/tag_count_list.html")
 def show_tag_counts(tag_counts):
-    return {"tag_counts": tag_counts}
\ No newline at end of file
+    return {"tag_counts": tag_counts}
+
+class VisibleTagCloudNode(template.Node):
+    def __init__(self, user_var, context_name, steps):
+        self.user_var = template.Variable(user_var)
+        self.context_name = context_name
+        self.steps = steps
+
+    def render(self, context):
+        try:
+            user = self.user_var.resolve(context)
+        except template.VariableDoesNotExist:
+            user = None
+        counts = visible_tag_counts(user)
+        tags = list(Tag.objects.filter(id__in=counts.keys()).order_by('name'))
+        for tag in tags:
+            tag.count = counts[tag.id]
+        context[self.context_name] = calculate_cloud(tags, steps=self.steps)
+        return u''
+
+def do_visible_tag_cloud(parser, token):
+    """
+    The tags of the posts a user can see, with their counts (from the
+    stored TagCounts) and cloud font sizes, like tagging's
+    tag_cloud_for_model; usable with show_tag_counts too.
+    
+        {% visible_tag_cloud user as topic_cloud %}   (or ... with steps=6)
+    """
+    bits = token.split_contents()
+    steps = 4
+    if len(bits) == 6 and bits[4] == 'with' and bits[5].startswith('steps='):
+        try:
+            steps = int(bits[5][len('steps='):])
+        except ValueError:
+            raise template.TemplateSyntaxError("%r tag's steps must be a number" % bits[0])
+        bits = bits[:4]
+    if len(bits) != 4 or bits[2] != 'as':
+        raise template.TemplateSyntaxError(u'%(tagname)r tag syntax is as follows: '
+            '{%% %(tagname)r USER as VARIABLE [with steps=N] %%}' % {'tagname': bits[0]})
+    return VisibleTagCloudNode(bits[1], bits[3], steps)
+
+register.tag('visible_tag_cloud', do_visible_tag_cloud)
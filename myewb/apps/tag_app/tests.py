@@ -0,0 +1,70 @@
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+
+from tagging.models import Tag
+
+from base_groups.models import BaseGroup
+from group_topics.models import GroupTopic
+from tag_app.models import TagPosting, visible_tag_counts
+
+class TestTagIndex(TestCase):
+    """
+    Tag postings and counts follow tagged posts, and are filtered by the
+    visibility of the posts' groups
+    """
+
+    def setUp(self):
+        self.creator = User.objects.create_user('creator', 'creator@ewb.ca', 'password')
+        self.outsider = User.objects.create_user('outsider', 'outsider@ewb.ca', 'password')
+        self.public = BaseGroup.objects.create(slug='public', name='public group', creator=self.creator,
+                                               model='Network', visibility='E')
+        self.private = BaseGroup.objects.create(slug='private', name='private group', creator=self.creator,
+                                                model='Network', visibility='M')
+        self.public_topic = GroupTopic.objects.create(title="wells", body="text", tags="water, ghana",
+                                                      group=self.public, creator=self.creator)
+        self.private_topic = GroupTopic.objects.create(title="budget", body="text", tags="water",
+                                                       group=self.private, creator=self.creator)
+        self.water = Tag.objects.get(name='water')
+        self.ghana = Tag.objects.get(name='ghana')
+
+    def tearDown(self):
+        GroupTopic.objects.all().delete()
+        BaseGroup.objects.all().delete()
+        User.objects.all().delete()
+        Tag.objects.all().delete()
+
+    def titles(self, user, tag):
+        return set([p.topic.title for p in TagPosting.objects.visible(user).filter(tag=tag)])
+
+    def test_visibility(self):
+        self.assertEquals(self.titles(self.creator, self.water), set(["wells", "budget"]))
+        self.assertEquals(self.titles(self.outsider, self.water), set(["wells"]))
+        self.assertEquals(visible_tag_counts(self.creator), {self.water.id: 2, self.ghana.id: 1})
+        self.assertEquals(visible_tag_counts(self.outsider), {self.water.id: 1, self.ghana.id: 1})
+
+        self.private.visibility = 'E'
+        self.private.save()
+        self.assertEquals(self.titles(self.outsider, self.water), set(["wells", "budget"]))
+        self.assertEquals(visible_tag_counts(self.outsider)[self.water.id], 2)
+
+    def test_retagging(self):
+        self.public_topic.tags = "ghana"
+        self.public_topic.save()
+        self.assertEquals(self.titles(self.outsider, self.water), set())
+        self.assertEquals(visible_tag_counts(self.creator)[self.water.id], 1)
+
+        self.private_topic.delete()
+        self.assertEquals(visible_tag_counts(self.creator), {self.ghana.id: 1})
+
+    def test_rebuild(self):
+        counts = visible_tag_counts(self.creator)
+        TagPosting.objects.all().delete()
+        call_command('rebuild_tag_index')
+        self.assertEquals(visible_tag_counts(self.creator), counts)
+        self.assertEquals(self.titles(self.outsider, self.water), set(["wells"]))
+
+    def test_tag_page(self):
+        response = self.client.get('/tags/water/')
+        self.assertContains(response, "wells")
+        self.assertNotContains(response, "budget")
@@ -1,22 +1,19 @@
-from django.db.models import Q
 from django.shortcuts import render_to_response, get_object_or_404
 from django.template import RequestContext
 
-from group_topics.models import GroupTopic
-from tagging.models import Tag, TaggedItem
+from tag_app.models import TagPosting
+from tagging.models import Tag
 
 def tags(request, tag, template_name='tags/index.html'):
     tag = get_object_or_404(Tag, name=tag)
     
-    # Get topics that match this tag
-    # filter to visible topics first
-    topics = GroupTopic.objects.visible(request.user)
-
-    topictags = TaggedItem.objects.get_by_model(topics, tag)
+    # Get topics that match this tag, out of the visible ones; read from
+    # the tag's postings (see TagPosting), newest first
+    postings = TagPosting.objects.visible(request.user).filter(tag=tag).select_related('topic')
 
     return render_to_response(template_name, {
         'tag': tag,
-        'topictags': topictags,
+        'postings': postings,
     }, context_instance=RequestContext(request))
 
     # NOTE there was a lot more stuff here before, checking tags against
@@ -0,0 +1,59 @@
+"""myEWB whiteboard helpers
+
+Whiteboards (wiki Articles) belong to a group, a post or an event, and are
+only created the first time someone saves one; until then, detail pages
+show an empty, unsaved stand-in so that viewing a page never writes.
+
+This file is part of myEWB
+Copyright 2009 Engineers Without Borders (Canada) Organisation and/or volunteer contributors
+"""
+
+import re
+
+from wiki.models import Article
+
+GROUP_WHITEBOARD_TITLE = "Whiteboard"
+
+# whiteboards of posts and events are titled Post<id> and Event<id>
+WHITEBOARD_TITLE_RE = re.compile(r'^(Post|Event)(\d+)$')
+
+def empty_whiteboard(title):
+    """
+    An unsaved, empty whiteboard with the given title, for rendering (and
+    linking to the edit page of) a whiteboard nobody has written yet.
+    """
+    return Article(title=title, content="")
+
+def attach_whiteboard(article, group):
+    """
+    Points the owner of a newly created whiteboard at it: the post or event
+    of group named by its title, or group itself for a GROUP_WHITEBOARD_TITLE
+    article.  Returns the owner, or None if the title names nothing in
+    group (any other wiki page, or a post or event of another group).
+    update() is used rather than save(), so that posts aren't bumped up the
+    front page.
+    """
+    from django.contrib.contenttypes.models import ContentType
+    from base_groups.models import BaseGroup
+    from events.models import Event
+    from group_topics.models import GroupTopic
+
+    if article.title == GROUP_WHITEBOARD_TITLE:
+        BaseGroup.objects.filter(id=group.id, whiteboard__isnull=True).update(whiteboard=article)
+        return group
+
+    match = WHITEBOARD_TITLE_RE.match(article.title)
+    if not match:
+        return None
+
+    if match.group(1) == 'Post':
+        owners = GroupTopic.objects.filter(parent_group=group)
+    else:
+        owners = Event.objects.filter(content_type=ContentType.objects.get_for_model(group),
+                                      object_id=group.id)
+    owners = owners.filter(id=int(match.group(2)))
+    owners.filter(whiteboard__isnull=True).update(whiteboard=article)
+    try:
+        return owners.get()
+    except owners.model.DoesNotExist:
+        return None
@@ -0,0 +1,40 @@
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+from django.db.models import Q
+
+from base_groups.models import BaseGroup
+from events.models import Event
+from group_topics.models import GroupTopic
+from whiteboard.helpers import attach_whiteboard, GROUP_WHITEBOARD_TITLE
+from wiki.models import Article
+
+OWNER_MODELS = (BaseGroup, GroupTopic, Event)
+
+
+class Command(NoArgsCommand):
+    help = "Removes the empty whiteboards that detail pages used to create when viewed, and links up " \
+           "whiteboards that were saved without being attached to their post, event or group."
+
+    @transaction.commit_on_success
+    def handle_noargs(self, **options):
+        whiteboards = Article.objects.filter(Q(title=GROUP_WHITEBOARD_TITLE) |
+                                             Q(title__regex=r'^(Post|Event)[0-9]+$'))
+
+        # never written to: no content and no edits
+        empty_ids = list(whiteboards.filter(content='', changeset__isnull=True).values_list('id', flat=True))
+        if empty_ids:
+            # unlink first, or deleting the articles would take their
+            # owners with them
+            for model in OWNER_MODELS:
+                model.objects.filter(whiteboard__in=empty_ids).update(whiteboard=None)
+            Article.objects.filter(id__in=empty_ids).delete()
+
+        attached = 0
+        for model in OWNER_MODELS:
+            whiteboards = whiteboards.exclude(id__in=model.objects.filter(whiteboard__isnull=False)
+                                                                  .values('whiteboard'))
+        for article in whiteboards:
+            if article.group is not None and attach_whiteboard(article, article.group) is not None:
+                attached += 1
+
+        return 'Removed %d empty whiteboards and attached %d others.' % (len(empty_ids), attached)
@@ -9,6 +9,7 @@ from django.views.generic.simple import redirect_to
 
 from base_groups.decorators import group_membership_required, visibility_required
 from whiteboard.forms import WhiteboardForm
+from whiteboard.helpers import attach_whiteboard
 from wiki.models import Article
 from wiki.utils import get_ct, login_required
 from wiki.views import *
@@ -66,12 +67,11 @@ def edit_article(request, title,
 
                 new_article, changeset = form.save()
             
-                # FIXME: is there a more efficient way of finding the parent
-                # than running these count() queries? 
-                if new_article.topic.count():
-                    url = new_article.topic.all()[0].get_absolute_url()
-                elif new_article.event.count():
-                    url = new_article.event.all()[0].get_absolute_url()
+                # whiteboards are created on first edit; the title says
+                # which post, event or group this one belongs to
+                owner = attach_whiteboard(new_article, group)
+                if owner is not None:
+                    url = owner.get_absolute_url()
                 else:
                     url = group.get_absolute_url()
                     
@@ -98,6 +98,7 @@ MIDDLEWARE_CLASSES = (
     'djangodblog.middleware.DBLogMiddleware',
     'pinax.middleware.security.HideSensistiveFieldsMiddleware',
     'django.middleware.transaction.TransactionMiddleware',
+    'base_groups.middleware.MemberRecordBufferMiddleware',
     'siteutils.online_middleware.OnlineUsers',
     # 'djangologging.middleware.LoggingMiddleware',
 #    'siteutils.helpers.SQLLogToConsoleMiddleware',
@@ -196,6 +197,7 @@ INSTALLED_APPS = (
     'photos',
     'tag_app',    
     'attachments',
+    'attachments_extra',
     'topics',
     'group_topics',
     'groups',
@@ -214,6 +216,7 @@ INSTALLED_APPS = (
     'siteutils',
     'manager_extras',
     'user_search',
+    'search_index',
 
     # our own third-party libs
     'contrib.django_evolution',
@@ -281,6 +284,38 @@ FORCE_LOWERCASE_TAGS = True
 
 WIKI_REQUIRES_LOGIN = True
 
+# group membership history (GroupMemberRecord) is normally written in one
+# batch at the end of each request; set this to queue all of it instead
+# (commands and the shell too) and have the drain_member_records command
+# write it in the background, in the order it was recorded
+GROUP_MEMBER_RECORDS_DEFERRED = False
+
+# group emails are queued and sent by the send_group_mail command (run it
+# from cron, like mailer's send_mail) in messages of at most this many bcc
+# recipients; a batch that fails is retried up to GROUP_MAIL_MAX_ATTEMPTS times
+GROUP_MAIL_BATCH_SIZE = 100
+GROUP_MAIL_MAX_ATTEMPTS = 5
+# a batch still marked as sending this many seconds after a worker claimed
+# it is assumed to have lost its worker, and is queued again
+GROUP_MAIL_SEND_TIMEOUT = 60 * 60
+# give each recipient of a post email an unsubscribe link with their own
+# address in it; this sends one message per recipient instead of one per batch
+GROUP_MAIL_PERSONAL_FOOTERS = False
+
+# the front page lists at most this many of the newest posts a user can see
+# (see group_topics.models.TopicTimelineEntry); trim_topic_timelines cuts
+# stored timelines back to this length
+TOPIC_TIMELINE_LENGTH = 500
+
+# listings paged with keyset_paginate ... with_total show a row count that
+# is cached for this many seconds
+PAGINATION_COUNT_CACHE_TIME = 300
+
+# pages shown to guests (the front page, public group and post pages) are
+# cached for this many seconds, or until a post, reply or group on them
+# changes (see siteutils.pagecache); 0 turns the cache off
+ANONYMOUS_PAGE_CACHE_TIME = 300
+
 # Uncomment this line after signing up for a Yahoo Maps API key at the
 # following URL: https://developer.yahoo.com/wsregapp/
 # YAHOO_MAPS_API_KEY = ''
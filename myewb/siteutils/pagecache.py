@@ -0,0 +1,115 @@
+"""myEWB anonymous page cache
+
+Whole pages rendered for anonymous visitors (who all see the same thing)
+are cached, keyed by URL and language, so that a guest hitting the front
+page doesn't cost a full render plus the online-users and inbox context
+processors.
+
+Each cached view names the scopes its page depends on ("frontpage",
+"group:<slug>", ...).  Every scope has a generation token that is part of
+the cache key; invalidate_anonymous_pages() replaces the token, so that all
+pages in the scope are re-rendered on their next hit without our having to
+know which URLs they were cached under.
+
+Bits of a page that must differ per request (the login form) are left as
+markers in the cached copy and filled in on the way out.
+
+This file is part of myEWB
+Copyright 2009 Engineers Without Borders (Canada) Organisation and/or volunteer contributors
+"""
+
+import random
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.functional import wraps
+from django.utils.hashcompat import md5_constructor
+from django.utils.translation import get_language
+
+FRAGMENT_MARKER = '<!-- per-request: %s -->'
+
+class _ScopeArgs(dict):
+    # view arguments for filling in scopes; ones a URL doesn't pass are blank
+    def __missing__(self, key):
+        return ''
+
+def _generation_key(scope):
+    return 'anonymous_page_generation_%s' % md5_constructor(scope.encode('utf-8')).hexdigest()
+
+def _new_generation():
+    return '%x%x' % (int(time.time() * 1000), random.getrandbits(32))
+
+def _generations(scopes):
+    """
+    The current generation token of each scope.  A scope with no token (or
+    one the cache has dropped) is given a fresh one rather than a default,
+    so pages cached under an older token can never come back.
+    """
+    keys = [_generation_key(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    generations = []
+    for key in keys:
+        if key not in found:
+            found[key] = _new_generation()
+            cache.set(key, found[key], settings.ANONYMOUS_PAGE_CACHE_TIME * 2)
+        generations.append(found[key])
+    return generations
+
+def invalidate_anonymous_pages(*scopes):
+    """
+    Drops the cached anonymous pages of the given scopes.
+    """
+    for scope in scopes:
+        cache.set(_generation_key(scope), _new_generation(), settings.ANONYMOUS_PAGE_CACHE_TIME * 2)
+
+def anonymous_page_cache(*scopes, **options):
+    """
+    Caches a view's GET responses to anonymous users for
+    ANONYMOUS_PAGE_CACHE_TIME seconds (0 turns the cache off).  Scopes are
+    filled in from the view's keyword arguments:
+
+        @anonymous_page_cache('group:%(group_slug)s')
+        def group_detail(request, group_slug): ...
+
+    fragments maps names to functions of the request returning HTML, which
+    replace FRAGMENT_MARKER % name in every page served to a guest.
+    """
+    fragments = options.get('fragments', {})
+
+    def decorator(view):
+        def wrapper(request, *args, **kwargs):
+            if request.user.is_authenticated():
+                return view(request, *args, **kwargs)
+            if request.method not in ('GET', 'HEAD') or not settings.ANONYMOUS_PAGE_CACHE_TIME:
+                return _fill_fragments(request, view(request, *args, **kwargs), fragments)
+
+            page_scopes = [scope % _ScopeArgs(kwargs) for scope in scopes]
+            key = 'anonymous_page_%s' % md5_constructor(repr((request.get_full_path(), get_language(),
+                                                               _generations(page_scopes)))).hexdigest()
+            page = cache.get(key)
+            if page is not None:
+                response = HttpResponse(page['content'], content_type=page['content_type'])
+            else:
+                response = view(request, *args, **kwargs)
+                # only plain pages; not redirects, errors, or anything
+                # setting cookies of its own
+                if response.status_code == 200 and not response.cookies:
+                    cache.set(key, {'content': response.content,
+                                    'content_type': response['Content-Type']},
+                              settings.ANONYMOUS_PAGE_CACHE_TIME)
+            return _fill_fragments(request, response, fragments)
+        return wraps(view)(wrapper)
+    return decorator
+
+def _fill_fragments(request, response, fragments):
+    if response.status_code != 200:
+        return response
+    content = response.content
+    for name, render in fragments.items():
+        marker = FRAGMENT_MARKER % name
+        if marker in content:
+            content = content.replace(marker, render(request).encode(settings.DEFAULT_CHARSET))
+    response.content = content
+    return response
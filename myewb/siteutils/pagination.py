@@ -0,0 +1,186 @@
+"""myEWB keyset pagination
+
+Pages through a queryset by remembering where the last page ended (the
+values of its ordering columns) instead of counting rows to skip, so that
+page 500 costs the same as page 1: an index range read of per_page rows,
+with no OFFSET and no COUNT(*).
+
+This file is part of myEWB
+Copyright 2009 Engineers Without Borders (Canada) Organisation and/or volunteer contributors
+"""
+
+import base64
+import datetime
+import decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models.fields import FieldDoesNotExist
+from django.utils import simplejson
+from django.utils.hashcompat import md5_constructor
+
+class KeysetPage(object):
+    def __init__(self, object_list, has_next, has_previous, next_cursor, previous_cursor, total=None):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.total = total
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+class KeysetPaginator(object):
+    """
+    Splits a queryset into pages by its ordering, plus the primary key to
+    break ties.  Pages are asked for by the opaque cursor of the page before
+    (after=) or after (before=) them.
+
+    Ordering columns can be fields on the model itself or extra() selects
+    (such as the counts in the group listings), and should not be null.
+    If approximate_total is set, page.total is the row count, cached for
+    PAGINATION_COUNT_CACHE_TIME seconds.
+    """
+
+    def __init__(self, queryset, per_page, approximate_total=False):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.approximate_total = approximate_total
+        self.keys = self._get_keys()
+
+    def _get_keys(self):
+        """
+        Returns (name, descending, sql, params) for each ordering column.
+        """
+        query = self.queryset.query
+        opts = self.queryset.model._meta
+        qn = connection.ops.quote_name
+
+        ordering = list(query.order_by or (query.default_ordering and opts.ordering) or [])
+        if not [name for name in ordering if name.lstrip('-') in ('pk', opts.pk.name)]:
+            descending = ordering and ordering[-1].startswith('-')
+            ordering.append(descending and '-pk' or 'pk')
+
+        keys = []
+        for name in ordering:
+            descending = name.startswith('-')
+            name = name.lstrip('-')
+            if name in query.extra_select:
+                sql, params = query.extra_select[name]
+                keys.append((name, descending, '(%s)' % sql, list(params)))
+                continue
+            if name == 'pk':
+                field = opts.pk
+            else:
+                try:
+                    field = opts.get_field(name)
+                except FieldDoesNotExist:
+                    raise ValueError("Can't page by %r; keyset pagination needs fields of %s "
+                                     "or extra selects." % (name, opts.object_name))
+            keys.append((field.attname, descending,
+                         '%s.%s' % (qn(field.model._meta.db_table), qn(field.column)), []))
+        return keys
+
+    def _seek(self, queryset, values, backwards):
+        """
+        Filters to the rows after values in the ordering (or before them, if
+        backwards): (a > x) OR (a = x AND b > y) OR ...
+        """
+        clauses = []
+        params = []
+        for i, (name, descending, sql, key_params) in enumerate(self.keys):
+            parts = []
+            for (prev_name, prev_descending, prev_sql, prev_params), value in zip(self.keys[:i], values):
+                parts.append('%s = %%s' % prev_sql)
+                params.extend(prev_params + [value])
+            parts.append('%s %s %%s' % (sql, (descending != backwards) and '<' or '>'))
+            params.extend(key_params + [values[i]])
+            clauses.append('(%s)' % ' AND '.join(parts))
+        return queryset.extra(where=['(%s)' % ' OR '.join(clauses)], params=params)
+
+    def _cursor_for(self, obj):
+        values = []
+        for name, descending, sql, params in self.keys:
+            value = getattr(obj, name)
+            if isinstance(value, datetime.datetime):
+                value = connection.ops.value_to_db_datetime(value)
+            elif isinstance(value, datetime.date):
+                value = connection.ops.value_to_db_date(value)
+            elif isinstance(value, decimal.Decimal):
+                value = str(value)
+            values.append(value)
+        return encode_cursor(values)
+
+    def page(self, after=None, before=None):
+        """
+        Returns the page following the cursor after, preceding the cursor
+        before, or else the first page.  A cursor that can't be read gives
+        the first page.
+        """
+        backwards = False
+        values = decode_cursor(after or before, len(self.keys))
+        queryset = self.queryset
+        if values is not None:
+            backwards = not after
+            queryset = self._seek(queryset, values, backwards)
+        if backwards:
+            queryset = queryset.reverse()
+
+        rows = list(queryset[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+            has_next, has_previous = True, more
+        else:
+            has_next, has_previous = more, values is not None
+
+        next_cursor = previous_cursor = None
+        if rows:
+            next_cursor = has_next and self._cursor_for(rows[-1]) or None
+            previous_cursor = has_previous and self._cursor_for(rows[0]) or None
+
+        total = None
+        if self.approximate_total:
+            total = approximate_count(self.queryset)
+        return KeysetPage(rows, has_next, has_previous, next_cursor, previous_cursor, total)
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(simplejson.dumps(values)).rstrip('=')
+
+def decode_cursor(cursor, length):
+    """
+    Returns the list of values in a cursor, or None if there is no cursor or
+    it isn't one of ours.
+    """
+    if not cursor:
+        return None
+    try:
+        cursor = str(cursor)
+        values = simplejson.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (TypeError, ValueError, UnicodeError):
+        return None
+    if not isinstance(values, list) or len(values) != length:
+        return None
+    return values
+
+def approximate_count(queryset):
+    """
+    Counts a queryset, caching the result for PAGINATION_COUNT_CACHE_TIME
+    seconds; good enough for "about 1,200 posts".
+    """
+    sql, params = queryset.query.as_sql()
+    key = 'pagination_count_%s' % md5_constructor(repr((sql, tuple(params)))).hexdigest()
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, settings.PAGINATION_COUNT_CACHE_TIME)
+    return count
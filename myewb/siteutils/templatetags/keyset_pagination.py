@@ -0,0 +1,70 @@
+from django import template
+
+from siteutils.pagination import KeysetPaginator
+
+register = template.Library()
+
+DEFAULT_PER_PAGE = 20
+
+class KeysetPaginateNode(template.Node):
+    def __init__(self, queryset_var, per_page, with_total):
+        self.queryset_var = template.Variable(queryset_var)
+        self.per_page = per_page
+        self.with_total = with_total
+
+    def render(self, context):
+        name = self.queryset_var.var
+        request = context['request']
+        queryset = self.queryset_var.resolve(context)
+        try:
+            paginator = KeysetPaginator(queryset, self.per_page, approximate_total=self.with_total)
+        except ValueError:
+            # sorted (by autosort) on something we can't seek on; fall back
+            # to the model's own ordering
+            paginator = KeysetPaginator(queryset.order_by(), self.per_page,
+                                        approximate_total=self.with_total)
+        page = paginator.page(after=request.GET.get('after', None),
+                              before=request.GET.get('before', None))
+        context[name] = page.object_list
+        context['keyset_page'] = page
+        return u''
+
+def keyset_paginate(parser, token):
+    """
+    Keyset version of django-pagination's autopaginate: replaces a queryset
+    in the context with one page of it, and puts the page itself in
+    keyset_page for keyset_links.
+    
+        {% keyset_paginate topics 10 %}         (or ... 10 with_total)
+        {% for topic in topics %}...{% endfor %}
+        {% keyset_links %}
+    """
+    bits = token.split_contents()
+    with_total = bits[-1] == 'with_total'
+    if with_total:
+        bits = bits[:-1]
+    if len(bits) not in (2, 3):
+        raise template.TemplateSyntaxError("%r tag takes a queryset, an optional number per page, "
+                                           "and optionally 'with_total'" % bits[0])
+    per_page = DEFAULT_PER_PAGE
+    if len(bits) == 3:
+        try:
+            per_page = int(bits[2])
+        except ValueError:
+            raise template.TemplateSyntaxError("%r tag's number per page must be a number" % bits[0])
+    return KeysetPaginateNode(bits[1], per_page, with_total)
+register.tag('keyset_paginate', keyset_paginate)
+
+@register.inclusion_tag("pagination/keyset.html", takes_context=True)
+def keyset_links(context):
+    """
+    Previous / next links for the page set up by keyset_paginate, keeping
+    the rest of the query string (search terms, sorting).
+    """
+    getvars = context['request'].GET.copy()
+    for key in ('after', 'before', 'page'):
+        if key in getvars:
+            del getvars[key]
+    getvars = getvars.urlencode()
+    return {'keyset_page': context.get('keyset_page', None),
+            'getvars': getvars and '&%s' % getvars or ''}
@@ -0,0 +1,67 @@
+import datetime
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from base_groups.models import BaseGroup
+from base_groups.helpers import get_counts
+from siteutils.pagination import KeysetPaginator
+
+class TestKeysetPaginator(TestCase):
+    
+    def setUp(self):
+        self.creator = User.objects.create_user('creator', 'creator@ewb.ca', 'password')
+        created = datetime.datetime(2009, 9, 1)
+        for i in range(7):
+            # pairs of groups share a creation time, so ties have to be
+            # broken by id
+            BaseGroup.objects.create(slug='group%d' % i, name='group %d' % i, creator=self.creator,
+                                     model='BaseGroup', visibility='E',
+                                     created=created + datetime.timedelta(days=i / 2))
+    
+    def tearDown(self):
+        BaseGroup.objects.all().delete()
+        User.objects.all().delete()
+    
+    def walk(self, queryset, per_page):
+        paginator = KeysetPaginator(queryset, per_page)
+        page = paginator.page()
+        seen = [g.slug for g in page]
+        pages = [page]
+        while page.has_next:
+            page = paginator.page(after=page.next_cursor)
+            seen.extend([g.slug for g in page])
+            pages.append(page)
+        return seen, pages
+    
+    def test_walk_forwards(self):
+        for ordering in (('created',), ('-created',), ('name',)):
+            queryset = BaseGroup.objects.order_by(*ordering)
+            seen, pages = self.walk(queryset, 3)
+            tiebreak = ordering[-1].startswith('-') and '-pk' or 'pk'
+            self.assertEquals(seen, [g.slug for g in BaseGroup.objects.order_by(*(ordering + (tiebreak,)))])
+            self.assertEquals(len(pages), 3)
+            self.assertFalse(pages[0].has_previous)
+            self.assertTrue(pages[-1].has_previous)
+    
+    def test_walk_backwards(self):
+        queryset = BaseGroup.objects.order_by('-created')
+        paginator = KeysetPaginator(queryset, 3)
+        seen, pages = self.walk(queryset, 3)
+        previous = paginator.page(before=pages[-1].previous_cursor)
+        self.assertEquals([g.slug for g in previous], seen[3:6])
+        self.assertTrue(previous.has_next)
+        first = paginator.page(before=previous.previous_cursor)
+        self.assertEquals([g.slug for g in first], seen[:3])
+        self.assertFalse(first.has_previous)
+    
+    def test_extra_select_ordering(self):
+        queryset = get_counts(BaseGroup.objects.all(), BaseGroup).order_by('-member_count', 'name')
+        seen, pages = self.walk(queryset, 2)
+        self.assertEquals(seen, [g.slug for g in queryset])
+    
+    def test_bad_cursor(self):
+        paginator = KeysetPaginator(BaseGroup.objects.order_by('created'), 3, approximate_total=True)
+        page = paginator.page(after='not-a-cursor')
+        self.assertEquals([g.slug for g in page], ['group0', 'group1', 'group2'])
+        self.assertEquals(page.total, 7)
@@ -64,6 +64,7 @@ urlpatterns = patterns('',
     (r'^communities/', include('communities.urls')),
     (r'^events/', include('events.urls')),
     (r'^posts/', include('group_topics.urls')),
+    (r'^attachments/', include('attachments_extra.urls')),
     (r'^creditcard/', include('creditcard.urls')),
     (r'^usersearch/', include('user_search.urls')),
     